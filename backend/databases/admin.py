@@ -0,0 +1,53 @@
+'''
+Долгоживущие admin-соединения к Postgres для DDL баз серверов (CREATE/DROP DATABASE, ROLE),
+отдельно от пула запросов pool.py. ADMIN_DATABASE_URL - роль с CREATEDB и CREATEROLE
+(по умолчанию DATABASE_URL). Соединения работают в autocommit - CREATE DATABASE нельзя
+выполнить внутри транзакции - и переживают тёплые вызовы контейнера; сломанное соединение
+закрывается и пересоздаётся при следующей выдаче.
+'''
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Iterator, List
+
+from pool import PoolExhausted
+
+ADMIN_DATABASE_URL = os.environ.get('ADMIN_DATABASE_URL') or os.environ.get('DATABASE_URL')
+ADMIN_POOL_MAX_SIZE = int(os.environ.get('ADMIN_POOL_MAX_SIZE', '2'))
+ADMIN_CHECKOUT_TIMEOUT = float(os.environ.get('ADMIN_CHECKOUT_TIMEOUT', '10'))
+
+_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(ADMIN_POOL_MAX_SIZE)
+_idle: List[Any] = []
+
+
+def _connect() -> Any:
+    import psycopg2
+    conn = psycopg2.connect(ADMIN_DATABASE_URL)
+    conn.autocommit = True
+    return conn
+
+
+@contextmanager
+def connection() -> Iterator[Any]:
+    import psycopg2
+
+    if not _slots.acquire(timeout=ADMIN_CHECKOUT_TIMEOUT):
+        raise PoolExhausted('No free admin database connections')
+    conn = None
+    try:
+        with _lock:
+            conn = _idle.pop() if _idle else None
+        if conn is None or conn.closed:
+            conn = _connect()
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        if conn is not None:
+            conn.close()
+            conn = None
+        raise
+    finally:
+        if conn is not None and not conn.closed:
+            with _lock:
+                _idle.append(conn)
+        _slots.release()
@@ -1,182 +1,308 @@
-import json
-import os
-from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from typing import Dict, Any, List, Optional, Set
+from pool import PoolExhausted
+from row_encoder import compile_row_encoder, encode_rows
+from runtime import App, Request, Route, error, respond, respond_encoded, tuple_cursor_class
+from storage import bump_storage_totals, format_size
+
+MAX_BATCH_SIZE = 1000
+MAX_CREATE_BATCH_SIZE = 50
+CACHED_TABLES = ['server_databases']
+DATABASE_COLUMNS = (
+    'id', 'server_id', 'db_name', 'db_size_bytes', 'status', 'size_refreshed_at', 'last_error', 'created_at'
+)
+DATABASE_KEYS = (
+    'id', 'server_id', 'db_name', 'db_size', 'db_size_bytes', 'status', 'size_refreshed_at', 'last_error',
+    'created_at'
+)
+RETURNING_COLUMNS = ', '.join(DATABASE_COLUMNS)
+DATABASE_ENCODER = compile_row_encoder(DATABASE_KEYS, DATABASE_COLUMNS, {'db_size': ('db_size_bytes', format_size)})
+
+def render_database(db: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'id': db['id'],
+        'server_id': db['server_id'],
+        'db_name': db['db_name'],
+        'db_size': format_size(db['db_size_bytes']),
+        'db_size_bytes': db['db_size_bytes'],
+        'status': db['status'],
+        'size_refreshed_at': db['size_refreshed_at'].isoformat() if db['size_refreshed_at'] else None,
+        'last_error': db['last_error'],
+        'created_at': db['created_at'].isoformat() if db['created_at'] else None
+    }
+
+def render_created(db: Dict[str, Any], outcome: Any) -> Dict[str, Any]:
+    '''Пароль отдаётся только в ответе на создание; без outcome база ждёт периодического задания.'''
+    import provisioning
+    
+    item = render_database(db)
+    if outcome is None:
+        return item
+    password, message = outcome
+    item['status'] = 'failed' if message else 'ready'
+    item['last_error'] = message
+    if password:
+        item['pg_name'], item['role_name'] = provisioning.physical_names(db['id'])
+        item['password'] = password
+    return item
+
+def parse_ids(value: Optional[str]) -> List[int]:
+    return [int(item) for item in (value or '').split(',') if item.strip()]
+
+def batch_response(results: List[Dict[str, Any]], success_status: int) -> Dict[str, Any]:
+    failed = sum(1 for item in results if not item['ok'])
+    if failed == 0:
+        status_code = success_status
+    elif failed == len(results):
+        status_code = 400
+    else:
+        status_code = 207
+    return respond(status_code, {'results': results, 'succeeded': len(results) - failed, 'failed': failed})
+
+def insert_creating(cursor: Any, rows: List[Any]) -> List[Dict[str, Any]]:
+    '''
+    Вставляет записи (server_id, db_name) в статусе creating и добавляет их в итоги хранилища.
+    Физические имена строятся по id, поэтому базы создаются уже после фиксации записей.
+    '''
+    from psycopg2.extras import execute_values
+    
+    created = execute_values(
+        cursor,
+        'INSERT INTO server_databases (server_id, db_name, status) VALUES %s RETURNING ' + RETURNING_COLUMNS,
+        rows, template="(%s, %s, 'creating')", page_size=len(rows), fetch=True
+    )
+    per_server: Dict[Any, int] = {}
+    for row in created:
+        per_server[row['server_id']] = per_server.get(row['server_id'], 0) + 1
+    for server_id, count in per_server.items():
+        bump_storage_totals(cursor, server_id, database_count=count)
+    return created
+
+def batch_failed(results: List[Any], positions: List[int], error: str) -> None:
+    for index in positions:
+        results[index] = {'index': index, 'ok': False, 'error': error}
+
+def existing_server_ids(cursor: Any, server_ids: List[int]) -> Set[int]:
+    cursor.execute(
+        'SELECT id FROM minecraft_servers WHERE id = ANY(%s) AND deleted_at IS NULL',
+        (list(set(server_ids)),)
+    )
+    return {row['id'] for row in cursor.fetchall()}
+
+def provisioning_failed(exc: Exception) -> Dict[str, Any]:
+    import provisioning
+    
+    if isinstance(exc, PoolExhausted):
+        return error(503, 'Database provisioning is busy, retry later')
+    return error(500, 'Database provisioning failed', detail=provisioning.error_message(exc))
+
+def create_databases_batch(items: List[Any], conn: Any, cursor: Any) -> Dict[str, Any]:
+    import psycopg2
+    import provisioning
+    
+    results: List[Any] = [None] * len(items)
+    rows = []
+    positions = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not item.get('server_id') or not item.get('db_name'):
+            results[index] = {'index': index, 'ok': False, 'error': 'Missing required fields'}
+            continue
+        try:
+            rows.append((int(item['server_id']), str(item['db_name'])))
+        except (TypeError, ValueError):
+            results[index] = {'index': index, 'ok': False, 'error': 'Invalid server_id'}
+            continue
+        positions.append(index)
+    
+    if rows:
+        try:
+            known_servers = existing_server_ids(cursor, [row[0] for row in rows])
+            valid_rows = []
+            valid_positions = []
+            for index, row in zip(positions, rows):
+                if row[0] in known_servers:
+                    valid_rows.append(row)
+                    valid_positions.append(index)
+                else:
+                    results[index] = {'index': index, 'ok': False, 'error': 'Server not found'}
+            if valid_rows:
+                created = insert_creating(cursor, valid_rows)
+                conn.commit()
+                try:
+                    outcomes = provisioning.create_databases(conn, cursor, [row['id'] for row in created])
+                except PoolExhausted:
+                    outcomes = {}
+                for index, row in zip(valid_positions, created):
+                    outcome = outcomes.get(row['id'])
+                    results[index] = {'index': index, 'ok': not (outcome and outcome[1]), 'item': render_created(row, outcome)}
+                    if outcome and outcome[1]:
+                        results[index]['error'] = outcome[1]
+        except psycopg2.Error as exc:
+            conn.rollback()
+            batch_failed(results, positions, exc.pgerror or str(exc))
+    
+    return batch_response(results, 201)
+
+def delete_databases_batch(ids: List[int], conn: Any, cursor: Any) -> Dict[str, Any]:
+    import psycopg2
+    import provisioning
+    
+    results: List[Any] = [None] * len(ids)
+    try:
+        dropping = {row['id']: row for row in provisioning.mark_dropping(cursor, 'id = ANY(%s)', (ids,))}
+        conn.commit()
+    except psycopg2.Error as exc:
+        conn.rollback()
+        batch_failed(results, list(range(len(ids))), exc.pgerror or str(exc))
+        return batch_response(results, 200)
+    
+    outcomes = provisioning.drop_databases(conn, cursor, list(dropping.values()))
+    for index, item_id in enumerate(ids):
+        row = dropping.get(item_id)
+        if not row:
+            results[index] = {'index': index, 'ok': False, 'error': 'Database not found'}
+            continue
+        item = {'id': row['id'], 'db_name': row['db_name'], 'status': 'dropping' if outcomes[item_id] else 'deleted'}
+        results[index] = {'index': index, 'ok': True, 'item': item}
+    
+    return batch_response(results, 200)
+
+def batch_size_error(limit: int = MAX_BATCH_SIZE) -> Dict[str, Any]:
+    return error(400, 'Batch must contain 1 to %d items' % limit)
+
+def list_databases(request: Request) -> Dict[str, Any]:
+    server_id = request.query.get('server_id')
+    
+    if not server_id:
+        return error(400, 'Missing server_id')
+    if not server_id.isdigit():
+        return error(400, 'Invalid server_id')
+    
+    with request.conn.cursor(cursor_factory=tuple_cursor_class()) as cursor:
+        cursor.execute(
+            'SELECT ' + RETURNING_COLUMNS + ' FROM server_databases '
+            "WHERE server_id = %s AND status <> 'dropping' ORDER BY created_at DESC",
+            (server_id,)
+        )
+        databases = cursor.fetchall()
+    
+    return respond_encoded(200, '{"databases": ' + encode_rows(DATABASE_ENCODER, databases) + '}')
+
+def create_database(request: Request) -> Dict[str, Any]:
+    import provisioning
+    
+    body_data = request.body()
+    
+    if isinstance(body_data, list):
+        if not body_data or len(body_data) > MAX_CREATE_BATCH_SIZE:
+            return batch_size_error(MAX_CREATE_BATCH_SIZE)
+        return create_databases_batch(body_data, request.conn, request.cursor)
+    
+    server_id = body_data.get('server_id')
+    db_name = body_data.get('db_name')
+    
+    if not server_id or not db_name:
+        return error(400, 'Missing required fields')
+    if not str(server_id).isdigit():
+        return error(400, 'Invalid server_id')
+    
+    cursor = request.cursor
+    if not existing_server_ids(cursor, [int(server_id)]):
+        return error(404, 'Server not found')
+    
+    new_db = insert_creating(cursor, [(server_id, db_name)])[0]
+    request.conn.commit()
+    
+    try:
+        outcome = provisioning.create_databases(request.conn, cursor, [new_db['id']])[new_db['id']]
+    except PoolExhausted:
+        return respond(202, render_created(new_db, None))
+    if outcome[1]:
+        return error(500, 'Database provisioning failed', detail=outcome[1], item=render_created(new_db, outcome))
+    
+    return respond(201, render_created(new_db, outcome))
+
+def delete_database(request: Request) -> Dict[str, Any]:
+    import provisioning
+    
+    if request.query.get('ids'):
+        try:
+            ids = parse_ids(request.query['ids'])
+        except ValueError:
+            ids = []
+        if not ids or len(ids) > MAX_BATCH_SIZE:
+            return batch_size_error()
+        return delete_databases_batch(ids, request.conn, request.cursor)
+    
+    db_id = request.query.get('id')
+    
+    if not db_id:
+        return error(400, 'Missing database id')
+    if not db_id.isdigit():
+        return error(400, 'Invalid database id')
+    
+    rows = provisioning.mark_dropping(request.cursor, 'id = %s', (int(db_id),))
+    if not rows:
+        return error(404, 'Database not found')
+    request.conn.commit()
+    
+    message = provisioning.drop_databases(request.conn, request.cursor, rows)[rows[0]['id']]
+    if message:
+        return respond(202, {'message': 'Database deletion queued', 'db_name': rows[0]['db_name'], 'status': 'dropping'})
+    
+    return respond(200, {'message': 'Database deleted', 'db_name': rows[0]['db_name']})
+
+def reset_password(request: Request) -> Dict[str, Any]:
+    import psycopg2
+    import admin
+    import provisioning
+    
+    db_id = request.query.get('id')
+    
+    if not db_id:
+        return error(400, 'Missing database id')
+    if not db_id.isdigit():
+        return error(400, 'Invalid database id')
+    
+    cursor = request.cursor
+    cursor.execute("SELECT id, role_name, pg_name, status FROM server_databases WHERE id = %s AND status <> 'dropping'", (int(db_id),))
+    db = cursor.fetchone()
+    
+    if not db:
+        return error(404, 'Database not found')
+    if db['status'] != 'ready':
+        return error(409, 'Database is not ready', status=db['status'])
+    
+    try:
+        with admin.connection() as admin_conn:
+            password = provisioning.reset_password(admin_conn, db['role_name'])
+    except (PoolExhausted, psycopg2.Error) as exc:
+        return provisioning_failed(exc)
+    
+    return respond(200, {'id': db['id'], 'pg_name': db['pg_name'], 'role_name': db['role_name'], 'password': password})
+
+def refresh(request: Request) -> Dict[str, Any]:
+    import psycopg2
+    import provisioning
+    
+    try:
+        return respond(200, provisioning.run_maintenance(request.conn, request.cursor))
+    except (PoolExhausted, psycopg2.Error) as exc:
+        request.conn.rollback()
+        return provisioning_failed(exc)
+
+app = App({
+    ('GET', None): Route(list_databases, cacheable=True),
+    ('POST', None): Route(create_database),
+    ('POST', 'refresh'): Route(refresh),
+    ('POST', 'reset_password'): Route(reset_password),
+    ('DELETE', None): Route(delete_database)
+}, cached_tables=CACHED_TABLES)
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Business: Управление базами данных серверов - получение списка БД, создание, удаление
+    Business: Управление базами данных серверов - список с сохранёнными размерами, создание и удаление
+    настоящих баз Postgres с ролями, сброс пароля, периодическое обновление размеров (?action=refresh)
     Args: event с httpMethod, body, queryStringParameters; context с request_id
     Returns: HTTP response с данными баз данных
     '''
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    if method == 'GET':
-        query_params = event.get('queryStringParameters', {})
-        server_id = query_params.get('server_id')
-        
-        if not server_id:
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'Missing server_id'}),
-                'isBase64Encoded': False
-            }
-        
-        cursor.execute('SELECT * FROM server_databases WHERE server_id = %s ORDER BY created_at DESC', (server_id,))
-        databases = cursor.fetchall()
-        
-        result = []
-        for db in databases:
-            result.append({
-                'id': db['id'],
-                'server_id': db['server_id'],
-                'db_name': db['db_name'],
-                'db_size': db['db_size'],
-                'created_at': db['created_at'].isoformat() if db['created_at'] else None
-            })
-        
-        cursor.close()
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'databases': result}),
-            'isBase64Encoded': False
-        }
-    
-    if method == 'POST':
-        body_data = json.loads(event.get('body', '{}'))
-        
-        server_id = body_data.get('server_id')
-        db_name = body_data.get('db_name')
-        db_size = body_data.get('db_size', '0 MB')
-        
-        if not server_id or not db_name:
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'Missing required fields'}),
-                'isBase64Encoded': False
-            }
-        
-        cursor.execute('''
-            INSERT INTO server_databases 
-            (server_id, db_name, db_size)
-            VALUES (%s, %s, %s)
-            RETURNING id, server_id, db_name, db_size, created_at
-        ''', (server_id, db_name, db_size))
-        
-        new_db = cursor.fetchone()
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
-        return {
-            'statusCode': 201,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'id': new_db['id'],
-                'server_id': new_db['server_id'],
-                'db_name': new_db['db_name'],
-                'db_size': new_db['db_size'],
-                'created_at': new_db['created_at'].isoformat()
-            }),
-            'isBase64Encoded': False
-        }
-    
-    if method == 'DELETE':
-        query_params = event.get('queryStringParameters', {})
-        db_id = query_params.get('id')
-        
-        if not db_id:
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'Missing database id'}),
-                'isBase64Encoded': False
-            }
-        
-        cursor.execute('SELECT db_name FROM server_databases WHERE id = %s', (db_id,))
-        db = cursor.fetchone()
-        
-        if not db:
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 404,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'Database not found'}),
-                'isBase64Encoded': False
-            }
-        
-        cursor.execute('DELETE FROM server_databases WHERE id = %s', (db_id,))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'message': 'Database deleted', 'db_name': db['db_name']}),
-            'isBase64Encoded': False
-        }
-    
-    cursor.close()
-    conn.close()
-    
-    return {
-        'statusCode': 405,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
-        },
-        'body': json.dumps({'error': 'Method not allowed'}),
-        'isBase64Encoded': False
-    }
+    return app(event, context)
@@ -0,0 +1,149 @@
+'''
+Пул соединений с Postgres, переживающий тёплые вызовы одного контейнера.
+Каждая функция в backend/ деплоится отдельно, поэтому копия модуля лежит
+в каждой из них - держите копии одинаковыми. psycopg2 импортируется внутри функций,
+чтобы ответы без БД не тянули драйвер при холодном старте.
+'''
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Any, List, Iterator, Tuple
+
+POOL_MAX_SIZE = int(os.environ.get('DB_POOL_MAX_SIZE', '4'))
+POOL_CHECKOUT_TIMEOUT = float(os.environ.get('DB_POOL_CHECKOUT_TIMEOUT', '10'))
+HEALTH_CHECK_AFTER = float(os.environ.get('DB_POOL_HEALTH_CHECK_AFTER', '30'))
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(POOL_MAX_SIZE)
+_idle: List[Tuple[Any, float]] = []
+_stats: Dict[str, int] = {
+    'hits': 0,
+    'misses': 0,
+    'reconnects': 0,
+    'discarded': 0,
+    'in_use': 0
+}
+
+
+def _connect() -> Any:
+    import psycopg2
+    return psycopg2.connect(os.environ.get('DATABASE_URL'))
+
+
+def _is_healthy(conn: Any, idle_since: float) -> bool:
+    '''
+    Дешёвая проверка при выдаче: закрытые соединения и незавершённые транзакции
+    отбрасываются сразу, а давно простаивающие пингуются SELECT 1.
+    '''
+    import psycopg2
+    import psycopg2.extensions
+    if conn.closed:
+        return False
+    if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+        return False
+    if time.monotonic() - idle_since < HEALTH_CHECK_AFTER:
+        return True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute('SELECT 1')
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+
+
+def _discard(conn: Any) -> None:
+    import psycopg2
+    with _lock:
+        _stats['discarded'] += 1
+    try:
+        conn.close()
+    except psycopg2.Error:
+        pass
+
+
+def acquire() -> Any:
+    if not _slots.acquire(timeout=POOL_CHECKOUT_TIMEOUT):
+        raise PoolExhausted('No free database connections in pool')
+    try:
+        while True:
+            with _lock:
+                entry = _idle.pop() if _idle else None
+            if entry is None:
+                break
+            conn, idle_since = entry
+            if _is_healthy(conn, idle_since):
+                with _lock:
+                    _stats['hits'] += 1
+                    _stats['in_use'] += 1
+                return conn
+            _discard(conn)
+            with _lock:
+                _stats['reconnects'] += 1
+        conn = _connect()
+    except Exception:
+        _slots.release()
+        raise
+    with _lock:
+        _stats['misses'] += 1
+        _stats['in_use'] += 1
+    return conn
+
+
+def release(conn: Any, broken: bool = False) -> None:
+    '''
+    Возвращает соединение в пул. Незакоммиченная транзакция откатывается,
+    сломанное соединение закрывается и будет пересоздано при следующей выдаче.
+    '''
+    import psycopg2
+    import psycopg2.extensions
+    try:
+        if not broken and not conn.closed:
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+        else:
+            broken = True
+    except psycopg2.Error:
+        broken = True
+    with _lock:
+        _stats['in_use'] -= 1
+        if not broken:
+            _idle.append((conn, time.monotonic()))
+    if broken:
+        _discard(conn)
+    _slots.release()
+
+
+@contextmanager
+def connection() -> Iterator[Any]:
+    conn = acquire()
+    import psycopg2
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        release(conn, broken=True)
+        raise
+    except Exception:
+        release(conn)
+        raise
+    else:
+        release(conn)
+
+
+def stats() -> Dict[str, int]:
+    with _lock:
+        result = dict(_stats)
+        result['idle'] = len(_idle)
+    result['max_size'] = POOL_MAX_SIZE
+    return result
+
+
+def stats_header() -> str:
+    current = stats()
+    return 'hits={hits}; misses={misses}; reconnects={reconnects}; idle={idle}; in_use={in_use}'.format(**current)
@@ -0,0 +1,323 @@
+'''
+Настоящие базы серверов: на каждую запись server_databases - своя роль и своя база
+(DATABASE_PROVISIONING=database, по умолчанию) или схема в admin-базе (=schema).
+Физические имена строятся по id записи (mcdb_<id>, роль mcdb_<id>_owner), так что
+имя базы от пользователя - только подпись и в DDL не попадает. DDL идёт через admin.py.
+
+Статусы записи: pending (записи клона и старые записи - базы ещё нет) -> creating -> ready;
+failed - создание не удалось; dropping - запись удалена, база ждёт DROP. Счётчики
+server_storage_totals сдвигаются при вставке и при переходе в dropping.
+
+Периодическое задание (python provisioning.py в каталоге функции или POST ?action=refresh
+по расписанию) создаёт базы pending, повторяет DROP для dropping и пачками по
+SIZE_REFRESH_BATCH обновляет db_size_bytes из pg_database_size - запрос списка размеры
+не считает, а отдаёт сохранённые.
+'''
+import os
+import secrets
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+import admin
+from pool import PoolExhausted
+from storage import bump_storage_totals
+
+DATABASE_PROVISIONING = os.environ.get('DATABASE_PROVISIONING', 'database')
+SIZE_REFRESH_BATCH = int(os.environ.get('SIZE_REFRESH_BATCH', '200'))
+SIZE_REFRESH_INTERVAL = int(os.environ.get('SIZE_REFRESH_INTERVAL', '300'))
+PROVISION_BATCH = int(os.environ.get('PROVISION_BATCH', '20'))
+PROVISION_LEASE_SECONDS = int(os.environ.get('PROVISION_LEASE_SECONDS', '300'))
+DROP_RETRY_SECONDS = int(os.environ.get('DROP_RETRY_SECONDS', '60'))
+MAINTENANCE_TIME_BUDGET = float(os.environ.get('MAINTENANCE_TIME_BUDGET', '20'))
+MAINTENANCE_IDLE_SECONDS = float(os.environ.get('MAINTENANCE_IDLE_SECONDS', '30'))
+MAX_ERROR_LENGTH = 1000
+
+
+def physical_names(db_id: int) -> Tuple[str, str]:
+    return 'mcdb_%d' % db_id, 'mcdb_%d_owner' % db_id
+
+
+def error_message(exc: Exception) -> str:
+    return (getattr(exc, 'pgerror', None) or str(exc))[:MAX_ERROR_LENGTH]
+
+
+def role_exists(cursor: Any, role_name: str) -> bool:
+    cursor.execute('SELECT 1 FROM pg_roles WHERE rolname = %s', (role_name,))
+    return cursor.fetchone() is not None
+
+
+def drop_physical(admin_conn: Any, kind: Optional[str], pg_name: str, role_name: str) -> None:
+    '''Идемпотентно удаляет базу (или схему) и роль; отсутствующие объекты пропускаются.'''
+    from psycopg2 import sql
+
+    with admin_conn.cursor() as cursor:
+        if kind == 'schema':
+            cursor.execute(sql.SQL('DROP SCHEMA IF EXISTS {} CASCADE').format(sql.Identifier(pg_name)))
+        else:
+            cursor.execute(sql.SQL('DROP DATABASE IF EXISTS {} WITH (FORCE)').format(sql.Identifier(pg_name)))
+        if role_exists(cursor, role_name):
+            cursor.execute(sql.SQL('DROP OWNED BY {}').format(sql.Identifier(role_name)))
+            cursor.execute(sql.SQL('DROP ROLE {}').format(sql.Identifier(role_name)))
+
+
+def create_physical(admin_conn: Any, kind: str, pg_name: str, role_name: str) -> str:
+    '''
+    Создаёт роль с новым паролем и её базу (или схему), возвращает пароль - он нигде
+    не хранится. Членство admin-роли в новой роли нужно, чтобы без суперпользователя
+    назначить её владельцем и потом удалить. Остатки прошлой неудачной попытки сначала удаляются.
+    '''
+    from psycopg2 import sql
+
+    drop_physical(admin_conn, kind, pg_name, role_name)
+    password = secrets.token_urlsafe(24)
+    role = sql.Identifier(role_name)
+    with admin_conn.cursor() as cursor:
+        cursor.execute(sql.SQL('CREATE ROLE {} LOGIN PASSWORD %s').format(role), (password,))
+        try:
+            cursor.execute(sql.SQL('GRANT {} TO CURRENT_USER').format(role))
+            if kind == 'schema':
+                cursor.execute(sql.SQL('CREATE SCHEMA {} AUTHORIZATION {}').format(sql.Identifier(pg_name), role))
+            else:
+                cursor.execute(sql.SQL('CREATE DATABASE {} OWNER {}').format(sql.Identifier(pg_name), role))
+                cursor.execute(sql.SQL('REVOKE ALL ON DATABASE {} FROM PUBLIC').format(sql.Identifier(pg_name)))
+        except Exception:
+            drop_physical(admin_conn, kind, pg_name, role_name)
+            raise
+    return password
+
+
+def reset_password(admin_conn: Any, role_name: str) -> str:
+    from psycopg2 import sql
+
+    password = secrets.token_urlsafe(24)
+    with admin_conn.cursor() as cursor:
+        cursor.execute(sql.SQL('ALTER ROLE {} PASSWORD %s').format(sql.Identifier(role_name)), (password,))
+    return password
+
+
+def measure_sizes(admin_conn: Any, kind: str, names: List[str]) -> Dict[str, int]:
+    '''Размеры пачки одним запросом; для схемы - таблицы, индексы и TOAST её отношений.'''
+    with admin_conn.cursor() as cursor:
+        if kind == 'schema':
+            cursor.execute('''
+                SELECT n.nspname, COALESCE(SUM(pg_total_relation_size(c.oid)), 0)::bigint
+                FROM pg_namespace n
+                LEFT JOIN pg_class c ON c.relnamespace = n.oid AND c.relkind IN ('r', 'm')
+                WHERE n.nspname = ANY(%s)
+                GROUP BY n.nspname
+            ''', (names,))
+        else:
+            cursor.execute(
+                'SELECT datname, pg_database_size(oid) FROM pg_database WHERE datname = ANY(%s)',
+                (names,)
+            )
+        return dict(cursor.fetchall())
+
+
+def refresh_sizes(conn: Any, cursor: Any, limit: int = SIZE_REFRESH_BATCH) -> int:
+    '''
+    Обновляет размеры самых давно измеренных баз (не чаще SIZE_REFRESH_INTERVAL на базу)
+    и сдвигает server_storage_totals на разницу. Возвращает число обработанных записей.
+    '''
+    from psycopg2.extras import execute_values
+
+    cursor.execute('''
+        SELECT id, server_id, kind, pg_name, db_size_bytes FROM server_databases
+        WHERE status = 'ready'
+          AND (size_refreshed_at IS NULL OR size_refreshed_at < CURRENT_TIMESTAMP - make_interval(secs => %s))
+        ORDER BY size_refreshed_at NULLS FIRST, id
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    ''', (SIZE_REFRESH_INTERVAL, limit))
+    rows = cursor.fetchall()
+    if not rows:
+        conn.rollback()
+        return 0
+
+    sizes: Dict[str, int] = {}
+    with admin.connection() as admin_conn:
+        for kind in {row['kind'] for row in rows}:
+            sizes.update(measure_sizes(admin_conn, kind, [row['pg_name'] for row in rows if row['kind'] == kind]))
+
+    deltas: Dict[int, int] = {}
+    updates = []
+    for row in rows:
+        size = sizes.get(row['pg_name'], row['db_size_bytes'])
+        updates.append((row['id'], size))
+        if size != row['db_size_bytes']:
+            deltas[row['server_id']] = deltas.get(row['server_id'], 0) + size - row['db_size_bytes']
+    execute_values(cursor, '''
+        UPDATE server_databases AS d
+        SET db_size_bytes = v.size, size_refreshed_at = CURRENT_TIMESTAMP
+        FROM (VALUES %s) AS v(id, size)
+        WHERE d.id = v.id
+    ''', updates, template='(%s::integer, %s::bigint)', page_size=len(updates))
+    for server_id, delta in deltas.items():
+        bump_storage_totals(cursor, server_id, database_bytes=delta)
+    conn.commit()
+    return len(rows)
+
+
+def create_databases(conn: Any, cursor: Any, ids: List[int]) -> Dict[int, Tuple[Optional[str], Optional[str]]]:
+    '''
+    Создаёт базы для уже закоммиченных записей creating и переводит их в ready или failed.
+    Возвращает {id: (пароль, None) или (None, текст ошибки)}. Если admin-соединение
+    получить не удалось, записи остаются creating и их подберёт задание после аренды.
+    '''
+    results: Dict[int, Tuple[Optional[str], Optional[str]]] = {}
+    with admin.connection() as admin_conn:
+        for db_id in ids:
+            pg_name, role_name = physical_names(db_id)
+            try:
+                results[db_id] = (create_physical(admin_conn, DATABASE_PROVISIONING, pg_name, role_name), None)
+            except Exception as exc:
+                results[db_id] = (None, error_message(exc))
+            cursor.execute('''
+                UPDATE server_databases
+                SET status = %s, kind = %s, pg_name = %s, role_name = %s, last_error = %s,
+                    size_refreshed_at = NULL, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s AND status = 'creating'
+            ''', ('failed' if results[db_id][1] else 'ready', DATABASE_PROVISIONING, pg_name, role_name,
+                  results[db_id][1], db_id))
+            conn.commit()
+    return results
+
+
+def provision_pending(conn: Any, cursor: Any, limit: int = PROVISION_BATCH) -> Tuple[int, int]:
+    '''
+    Создаёт базы записей pending (и creating с истёкшей арендой - упавшая попытка).
+    Записи сначала помечаются creating отдельной транзакцией, DDL идёт уже без блокировок строк.
+    '''
+    cursor.execute('''
+        UPDATE server_databases SET status = 'creating', updated_at = CURRENT_TIMESTAMP
+        WHERE id IN (
+            SELECT id FROM server_databases
+            WHERE status = 'pending'
+               OR (status = 'creating' AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s))
+            ORDER BY id
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id
+    ''', (PROVISION_LEASE_SECONDS, limit))
+    claimed = [row['id'] for row in cursor.fetchall()]
+    conn.commit()
+    if not claimed:
+        return 0, 0
+    results = create_databases(conn, cursor, claimed)
+    failed = sum(1 for _, message in results.values() if message)
+    return len(results) - failed, failed
+
+
+def mark_dropping(cursor: Any, condition: str, params: Tuple[Any, ...]) -> List[Dict[str, Any]]:
+    '''
+    Переводит записи в dropping и вычитает их из итогов хранилища в текущей транзакции.
+    condition - фрагмент WHERE над server_databases, уже отобранные dropping не трогаются.
+    '''
+    cursor.execute('''
+        UPDATE server_databases SET status = 'dropping', updated_at = CURRENT_TIMESTAMP
+        WHERE status <> 'dropping' AND ''' + condition + '''
+        RETURNING id, server_id, db_name, db_size_bytes, kind, pg_name, role_name
+    ''', params)
+    rows = cursor.fetchall()
+    per_server: Dict[Any, List[int]] = {}
+    for row in rows:
+        totals = per_server.setdefault(row['server_id'], [0, 0])
+        totals[0] += 1
+        totals[1] += row['db_size_bytes'] or 0
+    for server_id, (count, size_bytes) in per_server.items():
+        bump_storage_totals(cursor, server_id, database_count=-count, database_bytes=-size_bytes)
+    return rows
+
+
+def drop_databases(conn: Any, cursor: Any, rows: List[Dict[str, Any]]) -> Dict[int, Optional[str]]:
+    '''
+    DROP для уже закоммиченных записей dropping и удаление самих записей.
+    Возвращает {id: None при успехе или текст ошибки}; неудачные повторит периодическое задание.
+    '''
+    import psycopg2
+
+    results: Dict[int, Optional[str]] = {}
+    if not rows:
+        return results
+    try:
+        with admin.connection() as admin_conn:
+            for row in rows:
+                try:
+                    if row['pg_name']:
+                        drop_physical(admin_conn, row['kind'], row['pg_name'], row['role_name'])
+                except psycopg2.Error as exc:
+                    results[row['id']] = error_message(exc)
+                    cursor.execute(
+                        'UPDATE server_databases SET last_error = %s, updated_at = CURRENT_TIMESTAMP WHERE id = %s',
+                        (results[row['id']], row['id'])
+                    )
+                else:
+                    cursor.execute("DELETE FROM server_databases WHERE id = %s AND status = 'dropping'", (row['id'],))
+                    results[row['id']] = None
+                conn.commit()
+    except (PoolExhausted, psycopg2.OperationalError) as exc:
+        for row in rows:
+            results.setdefault(row['id'], error_message(exc))
+    return results
+
+
+def drop_pending(conn: Any, cursor: Any, limit: int = PROVISION_BATCH) -> Tuple[int, int]:
+    '''Повтор DROP для записей dropping, которые не удалось удалить сразу (не чаще DROP_RETRY_SECONDS).'''
+    cursor.execute('''
+        UPDATE server_databases SET updated_at = CURRENT_TIMESTAMP
+        WHERE id IN (
+            SELECT id FROM server_databases
+            WHERE status = 'dropping' AND updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+            ORDER BY updated_at
+            LIMIT %s
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING id, kind, pg_name, role_name
+    ''', (DROP_RETRY_SECONDS, limit))
+    rows = cursor.fetchall()
+    conn.commit()
+    results = drop_databases(conn, cursor, rows)
+    failed = sum(1 for message in results.values() if message)
+    return len(results) - failed, failed
+
+
+def run_maintenance(conn: Any, cursor: Any, time_budget: float = MAINTENANCE_TIME_BUDGET) -> Dict[str, Any]:
+    '''
+    Порция периодического задания: создание pending, повтор DROP, затем пачки обновления размеров,
+    пока есть устаревшие и не кончился time_budget.
+    '''
+    deadline = time.monotonic() + time_budget
+    summary = {'created': 0, 'create_failed': 0, 'dropped': 0, 'drop_failed': 0, 'sizes_refreshed': 0}
+    summary['created'], summary['create_failed'] = provision_pending(conn, cursor)
+    summary['dropped'], summary['drop_failed'] = drop_pending(conn, cursor)
+    while time.monotonic() < deadline:
+        refreshed = refresh_sizes(conn, cursor)
+        summary['sizes_refreshed'] += refreshed
+        if refreshed < SIZE_REFRESH_BATCH:
+            break
+    return summary
+
+
+def main() -> None:
+    import argparse
+
+    import pool
+    from runtime import cursor_class
+
+    parser = argparse.ArgumentParser(description='Создание, удаление и учёт размеров баз серверов')
+    parser.add_argument('--once', action='store_true', help='одна порция MAINTENANCE_TIME_BUDGET и выход')
+    args = parser.parse_args()
+
+    while True:
+        with pool.connection() as conn:
+            with conn.cursor(cursor_factory=cursor_class()) as cursor:
+                summary = run_maintenance(conn, cursor)
+        print(summary, flush=True)
+        if args.once:
+            break
+        time.sleep(MAINTENANCE_IDLE_SECONDS)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,249 @@
+'''
+Трассировка запроса: время по фазам (connect, каждый cursor.execute, fetch, serialize),
+число строк и байт ответа. Итог уходит в заголовок Server-Timing и в структурную
+строку лога с request_id из context.
+
+TRACE_LOG=0 выключает строки лога. TRACE_PROFILE_SLOW_MS включает сэмплирующий
+профилировщик: стек потока запроса снимается каждые TRACE_PROFILE_INTERVAL_MS мс,
+и для запросов дольше порога в лог пишутся самые частые стеки.
+Копия модуля лежит в каждой функции backend/* - держите копии одинаковыми.
+'''
+import contextvars
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional
+
+TRACE_LOG = os.environ.get('TRACE_LOG', '1') != '0'
+PROFILE_SLOW_MS = float(os.environ.get('TRACE_PROFILE_SLOW_MS', '0'))
+PROFILE_INTERVAL_MS = float(os.environ.get('TRACE_PROFILE_INTERVAL_MS', '5'))
+PROFILE_SAMPLE_RATE = float(os.environ.get('TRACE_PROFILE_SAMPLE_RATE', '1'))
+MAX_RECORDED_QUERIES = 100
+
+_current: 'contextvars.ContextVar[Optional[Trace]]' = contextvars.ContextVar('trace', default=None)
+
+
+class StackSampler(threading.Thread):
+    def __init__(self, thread_id: int) -> None:
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.samples: Counter = Counter()
+        self.stopped = threading.Event()
+
+    def run(self) -> None:
+        interval = PROFILE_INTERVAL_MS / 1000
+        while not self.stopped.wait(interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None and len(stack) < 30:
+                code = frame.f_code
+                stack.append('%s:%s:%d' % (os.path.basename(code.co_filename), code.co_name, frame.f_lineno))
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def stop(self) -> List[Dict[str, Any]]:
+        self.stopped.set()
+        self.join()
+        return [{'stack': stack, 'samples': count} for stack, count in self.samples.most_common(10)]
+
+
+class Trace:
+    def __init__(self, request_id: str, method: str) -> None:
+        self.request_id = request_id
+        self.method = method
+        self.started = time.perf_counter()
+        self.last_mark = self.started
+        self.phases: Dict[str, float] = {}
+        self.queries: List[Dict[str, Any]] = []
+        self.query_count = 0
+        self.rows = 0
+        self.notes: Dict[str, str] = {}
+        self.finished = False
+        self.sampler: Optional[StackSampler] = None
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.phases[phase] = self.phases.get(phase, 0.0) + seconds
+
+    def mark(self, phase: str) -> None:
+        now = time.perf_counter()
+        self.add(phase, now - self.last_mark)
+        self.last_mark = now
+
+    def note(self, name: str, value: str) -> None:
+        self.notes[name] = value
+
+    def record_query(self, query: Any, seconds: float) -> None:
+        self.add('db', seconds)
+        self.query_count += 1
+        if len(self.queries) < MAX_RECORDED_QUERIES:
+            self.queries.append({'sql': query_text(query), 'ms': round(seconds * 1000, 3)})
+
+    def record_fetch(self, seconds: float, rows: int) -> None:
+        self.add('fetch', seconds)
+        self.rows += rows
+
+    def server_timing(self, total_ms: float, body_bytes: int) -> str:
+        parts = []
+        for phase, seconds in self.phases.items():
+            entry = '%s;dur=%.2f' % (phase, seconds * 1000)
+            if phase == 'db':
+                entry += ';desc="%d queries"' % self.query_count
+            elif phase == 'fetch':
+                entry += ';desc="%d rows"' % self.rows
+            elif phase == 'serialize':
+                entry += ';desc="%d bytes"' % body_bytes
+            parts.append(entry)
+        for name, value in self.notes.items():
+            parts.append('%s;desc="%s"' % (name, value))
+        parts.append('total;dur=%.2f' % total_ms)
+        return ', '.join(parts)
+
+    def finish(self, response: Optional[Dict[str, Any]], error: Optional[BaseException] = None) -> Optional[Dict[str, Any]]:
+        if self.finished:
+            return response
+        self.finished = True
+        total_ms = (time.perf_counter() - self.started) * 1000
+        profile = self.sampler.stop() if self.sampler else None
+        body_bytes = len(response['body']) if response and isinstance(response.get('body'), str) else 0
+
+        if response is not None:
+            response['headers']['Server-Timing'] = self.server_timing(total_ms, body_bytes)
+            response['headers']['Timing-Allow-Origin'] = '*'
+
+        if TRACE_LOG:
+            line: Dict[str, Any] = {
+                'event': 'request_trace',
+                'request_id': self.request_id,
+                'method': self.method,
+                'status': response['statusCode'] if response else 500,
+                'total_ms': round(total_ms, 3),
+                'phases_ms': {phase: round(seconds * 1000, 3) for phase, seconds in self.phases.items()},
+                'queries': self.query_count,
+                'rows': self.rows,
+                'bytes': body_bytes,
+                'slowest_queries': sorted(self.queries, key=lambda item: -item['ms'])[:5]
+            }
+            line.update(self.notes)
+            if error is not None:
+                line['error'] = repr(error)
+            if profile and total_ms >= PROFILE_SLOW_MS:
+                line['profile'] = profile
+            print(json.dumps(line), flush=True)
+        return response
+
+
+def query_text(query: Any) -> str:
+    if isinstance(query, bytes):
+        query = query.decode('utf-8', 'replace')
+    elif not isinstance(query, str):
+        query = str(query)
+    return ' '.join(query.split())[:160]
+
+
+def current() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def request(context: Any, method: str) -> Iterator[Trace]:
+    trace = Trace(getattr(context, 'request_id', None) or '-', method)
+    if PROFILE_SLOW_MS > 0 and random.random() < PROFILE_SAMPLE_RATE:
+        trace.sampler = StackSampler(threading.get_ident())
+        trace.sampler.start()
+    token = _current.set(trace)
+    try:
+        yield trace
+    except BaseException as error:
+        trace.finish(None, error)
+        raise
+    finally:
+        _current.reset(token)
+        if not trace.finished:
+            trace.finish(None)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    trace = _current.get()
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        if trace is not None:
+            trace.add(name, time.perf_counter() - started)
+
+
+def dumps(value: Any) -> str:
+    trace = _current.get()
+    if trace is None:
+        return json.dumps(value)
+    started = time.perf_counter()
+    result = json.dumps(value)
+    trace.add('serialize', time.perf_counter() - started)
+    return result
+
+
+class TracedCursorMixin:
+    def execute(self, query: Any, vars: Any = None) -> Any:
+        trace = _current.get()
+        if trace is None:
+            return super().execute(query, vars)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            trace.record_query(query, time.perf_counter() - started)
+
+    def fetchone(self) -> Any:
+        trace = _current.get()
+        started = time.perf_counter()
+        row = super().fetchone()
+        if trace is not None:
+            trace.record_fetch(time.perf_counter() - started, 1 if row is not None else 0)
+        return row
+
+    def fetchmany(self, *args: Any) -> Any:
+        trace = _current.get()
+        started = time.perf_counter()
+        rows = super().fetchmany(*args)
+        if trace is not None:
+            trace.record_fetch(time.perf_counter() - started, len(rows))
+        return rows
+
+    def fetchall(self) -> Any:
+        trace = _current.get()
+        started = time.perf_counter()
+        rows = super().fetchall()
+        if trace is not None:
+            trace.record_fetch(time.perf_counter() - started, len(rows))
+        return rows
+
+    def __iter__(self) -> Iterator[Any]:
+        trace = _current.get()
+        iterator = super().__iter__()
+        while True:
+            started = time.perf_counter()
+            try:
+                row = next(iterator)
+            except StopIteration:
+                return
+            if trace is not None:
+                trace.record_fetch(time.perf_counter() - started, 1)
+            yield row
+
+
+_traced_classes: Dict[Any, Any] = {}
+
+
+def traced_cursor(base: Any) -> Any:
+    cursor_class = _traced_classes.get(base)
+    if cursor_class is None:
+        cursor_class = type('Traced' + base.__name__, (TracedCursorMixin, base), {})
+        _traced_classes[base] = cursor_class
+    return cursor_class
@@ -0,0 +1,130 @@
+'''
+Контентно-адресуемое хранилище чанков: ключ - SHA-256 содержимого, поэтому одинаковые
+чанки (один и тот же jar/мод на сотнях серверов) лежат в одном экземпляре.
+
+BLOB_STORE_URL выбирает бэкенд:
+  file:///путь (по умолчанию file:///tmp/blob-store) - локальный каталог, заглушка для тестов:
+    в облачной функции /tmp живёт только в пределах контейнера;
+  s3://bucket/префикс - S3-совместимое хранилище через boto3 (импортируется лениво),
+    адрес задаёт BLOB_STORE_ENDPOINT, ключи - стандартные AWS_ACCESS_KEY_ID/AWS_SECRET_ACCESS_KEY.
+Учёт ссылок на чанки ведётся в таблице blobs, хранилище про него не знает.
+'''
+import os
+import threading
+from typing import Any, Iterator, Optional
+
+BLOB_STORE_URL = os.environ.get('BLOB_STORE_URL', 'file:///tmp/blob-store')
+BLOB_STORE_ENDPOINT = os.environ.get('BLOB_STORE_ENDPOINT')
+
+
+class BlobNotFound(LookupError):
+    pass
+
+
+class LocalBlobStore:
+    def __init__(self, root: str) -> None:
+        self.root = root
+
+    def path(self, sha256: str) -> str:
+        return os.path.join(self.root, sha256[:2], sha256[2:4], sha256)
+
+    def exists(self, sha256: str) -> bool:
+        return os.path.exists(self.path(sha256))
+
+    def put(self, sha256: str, data: bytes) -> None:
+        '''
+        Пишет во временный файл рядом и атомарно переименовывает: читатель
+        никогда не увидит недописанный чанк, а повторная запись того же ключа - no-op.
+        '''
+        import tempfile
+
+        path = self.path(sha256)
+        if os.path.exists(path):
+            return
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                tmp_file.write(data)
+            os.replace(tmp_path, path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+    def read(self, sha256: str, offset: int = 0, length: Optional[int] = None) -> bytes:
+        try:
+            with open(self.path(sha256), 'rb') as blob_file:
+                blob_file.seek(offset)
+                return blob_file.read() if length is None else blob_file.read(length)
+        except FileNotFoundError:
+            raise BlobNotFound(sha256)
+
+    def delete(self, sha256: str) -> None:
+        try:
+            os.unlink(self.path(sha256))
+        except FileNotFoundError:
+            pass
+
+    def keys(self) -> Iterator[str]:
+        for _, _, names in os.walk(self.root):
+            for name in names:
+                if len(name) == 64 and not name.startswith('.'):
+                    yield name
+
+
+class S3BlobStore:
+    def __init__(self, bucket: str, prefix: str) -> None:
+        import boto3
+
+        self.client = boto3.client('s3', endpoint_url=BLOB_STORE_ENDPOINT)
+        self.bucket = bucket
+        self.prefix = prefix.strip('/')
+
+    def key(self, sha256: str) -> str:
+        return '/'.join(filter(None, [self.prefix, sha256[:2], sha256]))
+
+    def exists(self, sha256: str) -> bool:
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.key(sha256))
+            return True
+        except self.client.exceptions.ClientError:
+            return False
+
+    def put(self, sha256: str, data: bytes) -> None:
+        self.client.put_object(Bucket=self.bucket, Key=self.key(sha256), Body=data)
+
+    def read(self, sha256: str, offset: int = 0, length: Optional[int] = None) -> bytes:
+        byte_range = 'bytes=%d-' % offset if length is None else 'bytes=%d-%d' % (offset, offset + length - 1)
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=self.key(sha256), Range=byte_range)
+        except self.client.exceptions.NoSuchKey:
+            raise BlobNotFound(sha256)
+        return response['Body'].read()
+
+    def delete(self, sha256: str) -> None:
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(sha256))
+
+    def keys(self) -> Iterator[str]:
+        paginator = self.client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for item in page.get('Contents', []):
+                yield item['Key'].rsplit('/', 1)[-1]
+
+
+_lock = threading.Lock()
+_store: Any = None
+
+
+def get_store() -> Any:
+    from urllib.parse import urlparse
+
+    global _store
+    with _lock:
+        if _store is None:
+            url = urlparse(BLOB_STORE_URL)
+            if url.scheme == 's3':
+                _store = S3BlobStore(url.netloc, url.path)
+            else:
+                _store = LocalBlobStore(url.path if url.scheme == 'file' else BLOB_STORE_URL)
+        return _store
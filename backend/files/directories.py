@@ -0,0 +1,181 @@
+'''
+Иерархия каталогов для server_files: каждый каталог хранит parent_id и
+материализованный путь вида '/plugins/worldedit/', поэтому поиск каталога,
+список детей и выборка поддерева идут по индексам и не зависят от общего
+числа файлов сервера.
+'''
+from typing import Dict, Any, List, Optional
+from storage import format_size
+
+
+class InvalidPath(ValueError):
+    pass
+
+
+def split_path(path: Optional[str]) -> List[str]:
+    parts = [part for part in (path or '').split('/') if part and part != '.']
+    if '..' in parts:
+        raise InvalidPath('Path must not contain ..')
+    return parts
+
+
+def normalize_dir_path(path: Optional[str]) -> str:
+    parts = split_path(path)
+    return '/' + '/'.join(parts) + '/' if parts else '/'
+
+
+def display_path(dir_path: str) -> str:
+    return dir_path if dir_path == '/' else dir_path.rstrip('/')
+
+
+def parent_dir_path(dir_path: str) -> str:
+    parts = split_path(dir_path)
+    return normalize_dir_path('/'.join(parts[:-1]))
+
+
+def render_file(file: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'id': file['id'],
+        'server_id': file['server_id'],
+        'file_path': file['file_path'],
+        'file_name': file['file_name'],
+        'file_size': format_size(file['file_size_bytes']),
+        'file_size_bytes': file['file_size_bytes'],
+        'file_type': file['file_type'],
+        'created_at': file['created_at'].isoformat() if file['created_at'] else None
+    }
+
+
+def escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def find_directory(cursor: Any, server_id: Any, dir_path: str) -> Optional[Dict[str, Any]]:
+    cursor.execute(
+        'SELECT id, parent_id, name, path, depth FROM server_directories WHERE server_id = %s AND path = %s',
+        (server_id, dir_path)
+    )
+    return cursor.fetchone()
+
+
+def ensure_directory(cursor: Any, server_id: Any, dir_path: str) -> int:
+    '''
+    Возвращает id каталога, при необходимости создавая всю цепочку предков.
+    Обычно каталог уже есть и хватает одного запроса по уникальному индексу,
+    иначе - по одному upsert на уровень вложенности.
+    '''
+    existing = find_directory(cursor, server_id, dir_path)
+    if existing:
+        return existing['id']
+
+    parent_id = None
+    path = '/'
+    names = [''] + split_path(dir_path)
+    for depth, name in enumerate(names):
+        if name:
+            path = path + name + '/'
+        cursor.execute('''
+            INSERT INTO server_directories (server_id, parent_id, name, path, depth)
+            VALUES (%s, %s, %s, %s, %s)
+            ON CONFLICT (server_id, path) DO UPDATE SET name = EXCLUDED.name
+            RETURNING id
+        ''', (server_id, parent_id, name, path, depth))
+        parent_id = cursor.fetchone()['id']
+    return parent_id
+
+
+def list_children(cursor: Any, server_id: Any, dir_path: str) -> Optional[Dict[str, Any]]:
+    directory = find_directory(cursor, server_id, dir_path)
+    if not directory:
+        if dir_path == '/':
+            return {'path': '/', 'directories': [], 'files': []}
+        return None
+
+    cursor.execute(
+        'SELECT id, name, path FROM server_directories WHERE parent_id = %s ORDER BY name',
+        (directory['id'],)
+    )
+    directories = [
+        {'id': row['id'], 'name': row['name'], 'path': display_path(row['path'])}
+        for row in cursor.fetchall()
+    ]
+
+    cursor.execute('''
+        SELECT id, server_id, file_path, file_name, file_size_bytes, file_type, created_at
+        FROM server_files WHERE directory_id = %s ORDER BY file_name
+    ''', (directory['id'],))
+    files = [render_file(file) for file in cursor.fetchall()]
+
+    return {'path': display_path(dir_path), 'directories': directories, 'files': files}
+
+
+def subtree_size(cursor: Any, server_id: Any, dir_path: str) -> Optional[Dict[str, Any]]:
+    if not find_directory(cursor, server_id, dir_path):
+        return None
+
+    cursor.execute('''
+        SELECT COUNT(DISTINCT d.id) - 1 AS directories, COUNT(f.id) AS files,
+               COALESCE(SUM(f.file_size_bytes), 0)::bigint AS total_bytes
+        FROM server_directories d
+        LEFT JOIN server_files f ON f.directory_id = d.id
+        WHERE d.server_id = %s AND d.path LIKE %s
+    ''', (server_id, escape_like(dir_path) + '%'))
+    totals = cursor.fetchone()
+    return {
+        'path': display_path(dir_path),
+        'directories': totals['directories'],
+        'files': totals['files'],
+        'total_bytes': totals['total_bytes'],
+        'total_size': format_size(totals['total_bytes'])
+    }
+
+
+def move_subtree(cursor: Any, server_id: Any, from_path: str, to_path: str) -> Dict[str, Any]:
+    '''
+    Переносит или переименовывает каталог вместе с поддеревом: переписываются
+    только пути каталогов поддерева и file_path их файлов.
+    Вызывающий код отвечает за commit/rollback.
+    '''
+    if from_path == '/':
+        raise InvalidPath('Cannot move root directory')
+    if to_path.startswith(from_path):
+        raise InvalidPath('Cannot move directory into itself')
+
+    cursor.execute(
+        'SELECT id FROM server_directories WHERE server_id = %s AND path = %s FOR UPDATE',
+        (server_id, from_path)
+    )
+    source = cursor.fetchone()
+    if not source:
+        raise LookupError('Directory not found')
+    if find_directory(cursor, server_id, to_path):
+        raise InvalidPath('Target directory already exists')
+
+    new_parent_id = ensure_directory(cursor, server_id, parent_dir_path(to_path))
+    depth_delta = len(split_path(to_path)) - len(split_path(from_path))
+
+    cursor.execute('''
+        UPDATE server_directories
+        SET path = %s || substr(path, %s), depth = depth + %s
+        WHERE server_id = %s AND path LIKE %s
+        RETURNING id
+    ''', (to_path, len(from_path) + 1, depth_delta, server_id, escape_like(from_path) + '%'))
+    moved_ids = [row['id'] for row in cursor.fetchall()]
+
+    cursor.execute(
+        'UPDATE server_directories SET parent_id = %s, name = %s WHERE id = %s',
+        (new_parent_id, split_path(to_path)[-1], source['id'])
+    )
+    cursor.execute('''
+        UPDATE server_files f
+        SET file_path = CASE WHEN d.path = '/' THEN '/' ELSE rtrim(d.path, '/') END
+        FROM server_directories d
+        WHERE f.directory_id = d.id AND d.id = ANY(%s)
+    ''', (moved_ids,))
+
+    return {
+        'from_path': display_path(from_path),
+        'to_path': display_path(to_path),
+        'directories_moved': len(moved_ids),
+        'files_moved': cursor.rowcount
+    }
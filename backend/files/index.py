@@ -1,188 +1,750 @@
+import base64
 import json
-import os
-from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from typing import Dict, Any, List, Optional, Set, Tuple
+import tracing
+from row_encoder import compile_row_encoder, encode_rows
+from runtime import App, Request, Route, error, respond, respond_binary, respond_encoded, tuple_cursor_class
+from directories import (
+    InvalidPath, display_path, ensure_directory, escape_like, list_children, move_subtree,
+    normalize_dir_path, render_file, subtree_size
+)
+from storage import bump_storage_totals, format_size, parse_size, read_storage_totals
 
-def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+MAX_BATCH_SIZE = 1000
+CACHED_TABLES = ['server_files', 'server_directories', 'server_storage_totals', 'server_snapshots']
+FILE_COLUMNS = ('id', 'server_id', 'file_path', 'file_name', 'file_size_bytes', 'file_type', 'created_at')
+FILE_KEYS = ('id', 'server_id', 'file_path', 'file_name', 'file_size', 'file_size_bytes', 'file_type', 'created_at')
+FILE_ENCODER = compile_row_encoder(FILE_KEYS, FILE_COLUMNS, {'file_size': ('file_size_bytes', format_size)})
+EXPORT_FETCH_SIZE = 1000
+DEFAULT_EXPORT_ROWS = 2000
+MAX_EXPORT_ROWS = 10000
+SHA256_HEX = frozenset('0123456789abcdef')
+
+def parse_ids(value: Optional[str]) -> List[int]:
+    return [int(item) for item in (value or '').split(',') if item.strip()]
+
+def batch_response(results: List[Dict[str, Any]], success_status: int) -> Dict[str, Any]:
+    failed = sum(1 for item in results if not item['ok'])
+    if failed == 0:
+        status_code = success_status
+    elif failed == len(results):
+        status_code = 400
+    else:
+        status_code = 207
+    return respond(status_code, {'results': results, 'succeeded': len(results) - failed, 'failed': failed})
+
+def bump_file_totals(cursor: Any, rows: List[Dict[str, Any]], sign: int) -> None:
+    per_server: Dict[Any, List[int]] = {}
+    for row in rows:
+        totals = per_server.setdefault(row['server_id'], [0, 0])
+        totals[0] += 1
+        totals[1] += row['file_size_bytes'] or 0
+    for server_id, (count, size_bytes) in per_server.items():
+        bump_storage_totals(cursor, server_id, file_count=sign * count, file_bytes=sign * size_bytes)
+
+def batch_failed(results: List[Any], positions: List[int], error: str) -> None:
+    for index in positions:
+        results[index] = {'index': index, 'ok': False, 'error': error}
+
+def existing_server_ids(cursor: Any, server_ids: List[int]) -> Set[int]:
     '''
-    Business: Управление файлами серверов через FTP - получение списка файлов, создание, удаление
-    Args: event с httpMethod, body, queryStringParameters; context с request_id
-    Returns: HTTP response с данными файлов
+    Живые серверы из списка. FOR SHARE до конца транзакции не даёт мягкому удалению
+    проскочить между проверкой и записью строк сервера, которые очистка уже прошла.
+    '''
+    cursor.execute(
+        'SELECT id FROM minecraft_servers WHERE id = ANY(%s) AND deleted_at IS NULL ORDER BY id FOR SHARE',
+        (sorted(set(server_ids)),)
+    )
+    return {row['id'] for row in cursor.fetchall()}
+
+def create_files_batch(items: List[Any], conn: Any, cursor: Any) -> Dict[str, Any]:
+    import psycopg2
+    from psycopg2.extras import execute_values
+    
+    results: List[Any] = [None] * len(items)
+    rows = []
+    positions = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not item.get('server_id') or not item.get('file_path') or not item.get('file_name'):
+            results[index] = {'index': index, 'ok': False, 'error': 'Missing required fields'}
+            continue
+        try:
+            dir_path = normalize_dir_path(item['file_path'])
+            file_size_bytes = parse_size(item.get('file_size_bytes', item.get('file_size')))
+            rows.append((int(item['server_id']), display_path(dir_path), item['file_name'], file_size_bytes, item.get('file_type', 'file'), dir_path))
+        except (TypeError, ValueError):
+            results[index] = {'index': index, 'ok': False, 'error': 'Invalid server_id, file_path or file_size'}
+            continue
+        positions.append(index)
+    
+    if rows:
+        try:
+            known_servers = existing_server_ids(cursor, [row[0] for row in rows])
+            directory_ids: Dict[Tuple[int, str], int] = {}
+            valid_rows = []
+            valid_positions = []
+            for index, row in zip(positions, rows):
+                if row[0] in known_servers:
+                    key = (row[0], row[5])
+                    if key not in directory_ids:
+                        directory_ids[key] = ensure_directory(cursor, row[0], row[5])
+                    valid_rows.append(row[:5] + (directory_ids[key],))
+                    valid_positions.append(index)
+                else:
+                    results[index] = {'index': index, 'ok': False, 'error': 'Server not found'}
+            if valid_rows:
+                created = execute_values(cursor, '''
+                    INSERT INTO server_files
+                    (server_id, file_path, file_name, file_size_bytes, file_type, directory_id)
+                    VALUES %s
+                    RETURNING id, server_id, file_path, file_name, file_size_bytes, file_type, created_at
+                ''', valid_rows, page_size=len(valid_rows), fetch=True)
+                bump_file_totals(cursor, created, 1)
+                conn.commit()
+                for index, row in zip(valid_positions, created):
+                    results[index] = {'index': index, 'ok': True, 'item': render_file(row)}
+        except psycopg2.Error as exc:
+            conn.rollback()
+            batch_failed(results, positions, exc.pgerror or str(exc))
+    
+    return batch_response(results, 201)
+
+def delete_files_batch(ids: List[int], conn: Any, cursor: Any) -> Dict[str, Any]:
+    import psycopg2
+    from uploads import release_file_chunks
+    
+    results: List[Any] = [None] * len(ids)
+    try:
+        release_file_chunks(cursor, ids)
+        cursor.execute(
+            'DELETE FROM server_files WHERE id = ANY(%s) RETURNING id, server_id, file_name, file_size_bytes',
+            (ids,)
+        )
+        deleted_rows = cursor.fetchall()
+        bump_file_totals(cursor, deleted_rows, -1)
+        conn.commit()
+        deleted = {row['id']: row for row in deleted_rows}
+        for index, item_id in enumerate(ids):
+            row = deleted.get(item_id)
+            if row:
+                results[index] = {'index': index, 'ok': True, 'item': {'id': row['id'], 'file_name': row['file_name']}}
+            else:
+                results[index] = {'index': index, 'ok': False, 'error': 'File not found'}
+    except psycopg2.Error as exc:
+        conn.rollback()
+        batch_failed(results, list(range(len(ids))), exc.pgerror or str(exc))
+    
+    return batch_response(results, 200)
+
+def encode_export_cursor(row: Tuple[Any, ...]) -> str:
+    raw = json.dumps([row[2], row[3], row[0]])
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_export_cursor(token: str) -> Tuple[str, str, int]:
+    file_path, file_name, file_id = json.loads(base64.urlsafe_b64decode(token.encode('ascii')))
+    return str(file_path), str(file_name), int(file_id)
+
+def export_query(server_id: Any, path_prefix: Optional[str], after: Optional[Tuple[str, str, int]],
+                 limit: int) -> Tuple[str, List[Any]]:
+    conditions = ['server_id = %s']
+    params: List[Any] = [server_id]
+    if path_prefix:
+        conditions.append('file_path LIKE %s')
+        params.append(escape_like(path_prefix) + '%')
+    if after:
+        conditions.append('(file_path, file_name, id) > (%s, %s, %s)')
+        params.extend(after)
+    params.append(limit)
+    return (
+        'SELECT ' + ', '.join(FILE_COLUMNS) + ' FROM server_files WHERE ' + ' AND '.join(conditions) +
+        ' ORDER BY file_path, file_name, id LIMIT %s',
+        params
+    )
+
+def export_files(conn: Any, server_id: Any, query_params: Dict[str, Any]) -> Dict[str, Any]:
     '''
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    if method == 'GET':
-        query_params = event.get('queryStringParameters', {})
-        server_id = query_params.get('server_id')
-        
-        if not server_id:
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'Missing server_id'}),
-                'isBase64Encoded': False
-            }
-        
-        cursor.execute('SELECT * FROM server_files WHERE server_id = %s ORDER BY file_name', (server_id,))
+    Одна страница NDJSON: ответ функции - цельное тело, поэтому страница ограничена
+    MAX_EXPORT_ROWS, а строки кодируются сразу по мере fetchmany - в памяти держатся
+    только готовые строки тела и одна пачка кортежей. Дальше - по X-Next-Cursor.
+    '''
+    try:
+        limit = min(int(query_params.get('limit') or DEFAULT_EXPORT_ROWS), MAX_EXPORT_ROWS)
+        after = decode_export_cursor(query_params['after']) if query_params.get('after') else None
+        if limit < 1:
+            raise ValueError('limit must be positive')
+    except (ValueError, TypeError):
+        return error(400, 'Invalid limit or after parameter')
+    
+    sql, params = export_query(server_id, query_params.get('path_prefix'), after, limit + 1)
+    lines: List[str] = []
+    last_row = None
+    has_more = False
+    with conn.cursor(cursor_factory=tuple_cursor_class()) as cursor:
+        cursor.execute(sql, params)
+        with tracing.phase('serialize'):
+            while not has_more:
+                batch = cursor.fetchmany(EXPORT_FETCH_SIZE)
+                if not batch:
+                    break
+                for row in batch:
+                    if len(lines) == limit:
+                        has_more = True
+                        break
+                    lines.append(FILE_ENCODER(row) + '\n')
+                    last_row = row
+    conn.commit()
+    body = ''.join(lines)
+    
+    headers = {
+        'Content-Type': 'application/x-ndjson',
+        'Access-Control-Allow-Origin': '*',
+        'Access-Control-Expose-Headers': 'X-Next-Cursor'
+    }
+    if has_more and last_row:
+        headers['X-Next-Cursor'] = encode_export_cursor(last_row)
+    
+    return {
+        'statusCode': 200,
+        'headers': headers,
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+def batch_size_error() -> Dict[str, Any]:
+    return error(400, 'Batch must contain 1 to %d items' % MAX_BATCH_SIZE)
+
+def list_files(request: Request) -> Dict[str, Any]:
+    server_id = request.query.get('server_id')
+    
+    if not server_id:
+        return error(400, 'Missing server_id')
+    if not server_id.isdigit():
+        return error(400, 'Invalid server_id')
+    
+    if request.query.get('format') == 'ndjson':
+        return export_files(request.conn, server_id, request.query)
+    
+    path_prefix = request.query.get('path_prefix')
+    with request.conn.cursor(cursor_factory=tuple_cursor_class()) as cursor:
+        if path_prefix:
+            cursor.execute(
+                'SELECT ' + ', '.join(FILE_COLUMNS) + ' FROM server_files '
+                'WHERE server_id = %s AND file_path LIKE %s ORDER BY file_name',
+                (server_id, escape_like(path_prefix) + '%')
+            )
+        else:
+            cursor.execute(
+                'SELECT ' + ', '.join(FILE_COLUMNS) + ' FROM server_files WHERE server_id = %s ORDER BY file_name',
+                (server_id,)
+            )
+        files = cursor.fetchall()
+    
+    return respond_encoded(200, '{"files": ' + encode_rows(FILE_ENCODER, files) + '}')
+
+def search_files(request: Request) -> Dict[str, Any]:
+    import search
+    
+    if not request.query.get('server_id'):
+        return error(400, 'Missing server_id')
+    if not request.query['server_id'].isdigit():
+        return error(400, 'Invalid server_id')
+    
+    try:
+        file_search = search.parse_search(request.query)
+    except (ValueError, TypeError, IndexError) as exc:
+        return error(400, 'Invalid q, ext, path, limit or after parameter', detail=str(exc))
+    
+    sql, params = search.search_query(', '.join(FILE_COLUMNS), file_search)
+    with request.conn.cursor(cursor_factory=tuple_cursor_class()) as cursor:
+        cursor.execute(sql, params)
         files = cursor.fetchall()
-        
-        result = []
-        for file in files:
-            result.append({
-                'id': file['id'],
-                'server_id': file['server_id'],
-                'file_path': file['file_path'],
-                'file_name': file['file_name'],
-                'file_size': file['file_size'],
-                'file_type': file['file_type'],
-                'created_at': file['created_at'].isoformat() if file['created_at'] else None
+    
+    next_cursor = None
+    if len(files) > file_search.limit:
+        files = files[:file_search.limit]
+        next_cursor = search.encode_cursor(file_search, files[-1], FILE_COLUMNS)
+    return respond_encoded(
+        200, '{"files": ' + encode_rows(FILE_ENCODER, files) + ', "next_cursor": ' + json.dumps(next_cursor) + '}'
+    )
+
+def storage_usage(request: Request) -> Dict[str, Any]:
+    server_id = request.query.get('server_id')
+    
+    if not server_id:
+        return error(400, 'Missing server_id')
+    if not server_id.isdigit():
+        return error(400, 'Invalid server_id')
+    
+    return respond(200, read_storage_totals(request.cursor, server_id))
+
+def directory_listing(request: Request) -> Dict[str, Any]:
+    server_id = request.query.get('server_id')
+    
+    if not server_id:
+        return error(400, 'Missing server_id')
+    if not server_id.isdigit():
+        return error(400, 'Invalid server_id')
+    
+    try:
+        dir_path = normalize_dir_path(request.query.get('path'))
+    except InvalidPath as exc:
+        return error(400, str(exc))
+    
+    if request.query.get('action') == 'children':
+        listing = list_children(request.cursor, server_id, dir_path)
+    else:
+        listing = subtree_size(request.cursor, server_id, dir_path)
+    
+    if not listing:
+        return error(404, 'Directory not found')
+    
+    return respond(200, listing)
+
+def create_file(request: Request) -> Dict[str, Any]:
+    body_data = request.body()
+    
+    if isinstance(body_data, list):
+        if not body_data or len(body_data) > MAX_BATCH_SIZE:
+            return batch_size_error()
+        return create_files_batch(body_data, request.conn, request.cursor)
+    
+    server_id = body_data.get('server_id')
+    file_path = body_data.get('file_path')
+    file_name = body_data.get('file_name')
+    file_type = body_data.get('file_type', 'file')
+    
+    if not server_id or not file_path or not file_name:
+        return error(400, 'Missing required fields')
+    
+    if not str(server_id).isdigit():
+        return error(400, 'Invalid server_id')
+    
+    try:
+        dir_path = normalize_dir_path(file_path)
+        file_size_bytes = parse_size(body_data.get('file_size_bytes', body_data.get('file_size')))
+    except ValueError as exc:
+        return error(400, str(exc))
+    
+    cursor = request.cursor
+    if not existing_server_ids(cursor, [int(server_id)]):
+        request.conn.rollback()
+        return error(404, 'Server not found')
+    
+    directory_id = ensure_directory(cursor, server_id, dir_path)
+    cursor.execute('''
+        INSERT INTO server_files 
+        (server_id, file_path, file_name, file_size_bytes, file_type, directory_id)
+        VALUES (%s, %s, %s, %s, %s, %s)
+        RETURNING id, server_id, file_path, file_name, file_size_bytes, file_type, created_at
+    ''', (server_id, display_path(dir_path), file_name, file_size_bytes, file_type, directory_id))
+    new_file = cursor.fetchone()
+    
+    bump_storage_totals(cursor, new_file['server_id'], file_count=1, file_bytes=new_file['file_size_bytes'])
+    request.conn.commit()
+    
+    return respond(201, render_file(new_file))
+
+def move_directory(request: Request) -> Dict[str, Any]:
+    body_data = request.body()
+    
+    if not isinstance(body_data, dict) or not body_data.get('server_id') or not body_data.get('from_path') or not body_data.get('to_path'):
+        return error(400, 'Missing server_id, from_path or to_path')
+    if not str(body_data['server_id']).isdigit():
+        return error(400, 'Invalid server_id')
+    
+    try:
+        moved = move_subtree(
+            request.cursor, body_data['server_id'],
+            normalize_dir_path(body_data['from_path']), normalize_dir_path(body_data['to_path'])
+        )
+    except InvalidPath as exc:
+        request.conn.rollback()
+        return error(400, str(exc))
+    except LookupError as exc:
+        request.conn.rollback()
+        return error(404, str(exc))
+    
+    request.conn.commit()
+    
+    return respond(200, moved)
+
+def delete_file(request: Request) -> Dict[str, Any]:
+    from uploads import release_file_chunks
+    
+    if request.query.get('ids'):
+        try:
+            ids = parse_ids(request.query['ids'])
+        except ValueError:
+            ids = []
+        if not ids or len(ids) > MAX_BATCH_SIZE:
+            return batch_size_error()
+        return delete_files_batch(ids, request.conn, request.cursor)
+    
+    file_id = request.query.get('id')
+    
+    if not file_id:
+        return error(400, 'Missing file id')
+    if not file_id.isdigit():
+        return error(400, 'Invalid file id')
+    
+    cursor = request.cursor
+    release_file_chunks(cursor, [file_id])
+    cursor.execute(
+        'DELETE FROM server_files WHERE id = %s RETURNING server_id, file_name, file_size_bytes',
+        (file_id,)
+    )
+    file = cursor.fetchone()
+    
+    if not file:
+        request.conn.rollback()
+        return error(404, 'File not found')
+    
+    bump_storage_totals(cursor, file['server_id'], file_count=-1, file_bytes=-file['file_size_bytes'])
+    request.conn.commit()
+    
+    return respond(200, {'message': 'File deleted', 'file_name': file['file_name']})
+
+def insert_file(cursor: Any, server_id: Any, dir_path: str, file_name: str, file_type: str,
+                size_bytes: int, content_sha256: Optional[str]) -> Dict[str, Any]:
+    directory_id = ensure_directory(cursor, server_id, dir_path)
+    cursor.execute('''
+        INSERT INTO server_files
+        (server_id, file_path, file_name, file_size_bytes, file_type, directory_id, content_sha256)
+        VALUES (%s, %s, %s, %s, %s, %s, %s)
+        RETURNING id, server_id, file_path, file_name, file_size_bytes, file_type, created_at
+    ''', (server_id, display_path(dir_path), file_name, size_bytes, file_type, directory_id, content_sha256))
+    new_file = cursor.fetchone()
+    bump_storage_totals(cursor, new_file['server_id'], file_count=1, file_bytes=new_file['file_size_bytes'])
+    return new_file
+
+def upload_start(request: Request) -> Dict[str, Any]:
+    from uploads import attach_chunks, complete_upload, start_upload
+    
+    body_data = request.body()
+    
+    if not isinstance(body_data, dict) or not body_data.get('server_id') or not body_data.get('file_path') or not body_data.get('file_name'):
+        return error(400, 'Missing required fields')
+    
+    expected_sha256 = (body_data.get('sha256') or '').lower() or None
+    if expected_sha256 and (len(expected_sha256) != 64 or not SHA256_HEX.issuperset(expected_sha256)):
+        return error(400, 'sha256 must be 64 hex characters')
+    
+    try:
+        dir_path = normalize_dir_path(body_data['file_path'])
+    except InvalidPath as exc:
+        return error(400, str(exc))
+    
+    try:
+        server_id = int(body_data['server_id'])
+        size_bytes = int(body_data.get('size_bytes'))
+    except (TypeError, ValueError):
+        size_bytes = -1
+    if size_bytes < 0:
+        return error(400, 'Invalid server_id or size_bytes')
+    
+    cursor = request.cursor
+    if not existing_server_ids(cursor, [server_id]):
+        return error(404, 'Server not found')
+    
+    file_type = body_data.get('file_type', 'file')
+    session = start_upload(
+        cursor, server_id, display_path(dir_path), body_data['file_name'], file_type,
+        size_bytes, expected_sha256
+    )
+    
+    if size_bytes == 0:
+        session, chunks = complete_upload(cursor, session['upload_id'])
+        new_file = insert_file(cursor, session['server_id'], dir_path, session['file_name'], file_type, 0, session['content_sha256'])
+        attach_chunks(cursor, new_file['id'], session['id'], chunks)
+        request.conn.commit()
+        return respond(201, {'file': render_file(new_file)})
+    
+    request.conn.commit()
+    
+    return respond(201, session)
+
+def upload_chunk(request: Request) -> Dict[str, Any]:
+    from uploads import UploadError, put_chunk
+    
+    upload_id = request.query.get('upload_id')
+    
+    if not upload_id:
+        return error(400, 'Missing upload_id')
+    
+    try:
+        offset = int(request.query.get('offset') or 0)
+    except ValueError:
+        return error(400, 'Invalid offset')
+    
+    try:
+        progress = put_chunk(request.cursor, upload_id, offset, request.raw_body())
+    except UploadError as exc:
+        request.conn.rollback()
+        return error(exc.status_code, str(exc))
+    
+    request.conn.commit()
+    
+    return respond(200, progress)
+
+def upload_status(request: Request) -> Dict[str, Any]:
+    from uploads import UploadError, find_session, session_progress
+    
+    upload_id = request.query.get('upload_id')
+    
+    if not upload_id:
+        return error(400, 'Missing upload_id')
+    
+    try:
+        session = find_session(request.cursor, upload_id)
+    except UploadError as exc:
+        return error(exc.status_code, str(exc))
+    
+    return respond(200, session_progress(request.cursor, session))
+
+def upload_complete(request: Request) -> Dict[str, Any]:
+    from uploads import UploadError, abort_upload, attach_chunks, complete_upload
+    
+    upload_id = request.query.get('upload_id')
+    
+    if not upload_id:
+        return error(400, 'Missing upload_id')
+    
+    cursor = request.cursor
+    try:
+        session, chunks = complete_upload(cursor, upload_id)
+    except UploadError as exc:
+        request.conn.rollback()
+        return error(exc.status_code, str(exc))
+    
+    if not existing_server_ids(cursor, [session['server_id']]):
+        abort_upload(cursor, session['id'])
+        request.conn.commit()
+        return error(404, 'Server not found')
+    
+    new_file = insert_file(
+        cursor, session['server_id'], normalize_dir_path(session['file_path']), session['file_name'],
+        session['file_type'], session['size_bytes'], session['content_sha256']
+    )
+    attach_chunks(cursor, new_file['id'], session['id'], chunks)
+    request.conn.commit()
+    
+    return respond(201, {'file': render_file(new_file), 'sha256': session['content_sha256']})
+
+def upload_abort(request: Request) -> Dict[str, Any]:
+    from uploads import UploadError, abort_upload
+    
+    upload_id = request.query.get('upload_id')
+    
+    if not upload_id:
+        return error(400, 'Missing upload_id')
+    
+    try:
+        abort_upload(request.cursor, upload_id)
+    except UploadError as exc:
+        request.conn.rollback()
+        return error(exc.status_code, str(exc))
+    
+    request.conn.commit()
+    
+    return respond(200, {'message': 'Upload aborted', 'upload_id': upload_id})
+
+def download_file(request: Request) -> Dict[str, Any]:
+    from uploads import DOWNLOAD_MAX_BYTES, UploadError, parse_range, read_range
+    
+    file_id = request.query.get('id')
+    
+    if not file_id:
+        return error(400, 'Missing file id')
+    if not file_id.isdigit():
+        return error(400, 'Invalid file id')
+    
+    cursor = request.cursor
+    cursor.execute(
+        'SELECT id, file_name, file_size_bytes, content_sha256 FROM server_files WHERE id = %s',
+        (file_id,)
+    )
+    file = cursor.fetchone()
+    
+    if not file:
+        return error(404, 'File not found')
+    if not file['content_sha256']:
+        return error(409, 'File has no stored content')
+    
+    size_bytes = file['file_size_bytes']
+    headers = {
+        'Accept-Ranges': 'bytes',
+        'ETag': '"%s"' % file['content_sha256'],
+        'Content-Disposition': 'attachment; filename="%s"' % file['file_name'].replace('"', ''),
+        'Access-Control-Expose-Headers': 'Accept-Ranges, Content-Range, ETag, Content-Disposition'
+    }
+    
+    try:
+        byte_range = parse_range(request.header('Range'), size_bytes)
+    except UploadError as exc:
+        response = error(exc.status_code, str(exc))
+        response['headers']['Content-Range'] = 'bytes */%d' % size_bytes
+        return response
+    
+    if byte_range is None:
+        if size_bytes > DOWNLOAD_MAX_BYTES:
+            response = error(413, 'File is larger than %d bytes, download it with Range requests' % DOWNLOAD_MAX_BYTES,
+                             size_bytes=size_bytes, max_range_bytes=DOWNLOAD_MAX_BYTES)
+            response['headers'].update({
+                key: headers[key] for key in ('Accept-Ranges', 'ETag', 'Access-Control-Expose-Headers')
             })
-        
-        cursor.close()
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'files': result}),
-            'isBase64Encoded': False
-        }
-    
-    if method == 'POST':
-        body_data = json.loads(event.get('body', '{}'))
-        
-        server_id = body_data.get('server_id')
-        file_path = body_data.get('file_path')
-        file_name = body_data.get('file_name')
-        file_size = body_data.get('file_size', '0 KB')
-        file_type = body_data.get('file_type', 'file')
-        
-        if not server_id or not file_path or not file_name:
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'Missing required fields'}),
-                'isBase64Encoded': False
-            }
-        
-        cursor.execute('''
-            INSERT INTO server_files 
-            (server_id, file_path, file_name, file_size, file_type)
-            VALUES (%s, %s, %s, %s, %s)
-            RETURNING id, server_id, file_path, file_name, file_size, file_type, created_at
-        ''', (server_id, file_path, file_name, file_size, file_type))
-        
-        new_file = cursor.fetchone()
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
-        return {
-            'statusCode': 201,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'id': new_file['id'],
-                'server_id': new_file['server_id'],
-                'file_path': new_file['file_path'],
-                'file_name': new_file['file_name'],
-                'file_size': new_file['file_size'],
-                'file_type': new_file['file_type'],
-                'created_at': new_file['created_at'].isoformat()
-            }),
-            'isBase64Encoded': False
-        }
-    
-    if method == 'DELETE':
-        query_params = event.get('queryStringParameters', {})
-        file_id = query_params.get('id')
-        
-        if not file_id:
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'Missing file id'}),
-                'isBase64Encoded': False
-            }
-        
-        cursor.execute('SELECT file_name FROM server_files WHERE id = %s', (file_id,))
-        file = cursor.fetchone()
-        
-        if not file:
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 404,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'File not found'}),
-                'isBase64Encoded': False
-            }
-        
-        cursor.execute('DELETE FROM server_files WHERE id = %s', (file_id,))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'message': 'File deleted', 'file_name': file['file_name']}),
-            'isBase64Encoded': False
-        }
-    
-    cursor.close()
-    conn.close()
+            return response
+        return respond_binary(200, read_range(cursor, file_id, 0, size_bytes - 1) if size_bytes else b'', headers)
     
+    start, end = byte_range
+    end = min(end, start + DOWNLOAD_MAX_BYTES - 1)
+    headers['Content-Range'] = 'bytes %d-%d/%d' % (start, end, size_bytes)
+    
+    return respond_binary(206, read_range(cursor, file_id, start, end), headers)
+
+def snapshot_list(request: Request) -> Dict[str, Any]:
+    from snapshots import list_snapshots
+    
+    server_id = request.query.get('server_id')
+    
+    if not server_id:
+        return error(400, 'Missing server_id')
+    if not server_id.isdigit():
+        return error(400, 'Invalid server_id')
+    
+    return respond(200, {'snapshots': list_snapshots(request.cursor, server_id)})
+
+def snapshot_manifest(request: Request) -> Dict[str, Any]:
+    from blob_store import get_store
+    from snapshots import SnapshotNotFound, find_snapshot
+    
+    snapshot_id = request.query.get('id')
+    
+    if not snapshot_id:
+        return error(400, 'Missing snapshot id')
+    if not snapshot_id.isdigit():
+        return error(400, 'Invalid snapshot id')
+    
+    try:
+        snapshot = find_snapshot(request.cursor, snapshot_id)
+    except SnapshotNotFound as exc:
+        return error(404, str(exc))
+    
+    manifest = get_store().read(snapshot['manifest_sha256'])
     return {
-        'statusCode': 405,
+        'statusCode': 200,
         'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
+            'Content-Type': 'application/x-ndjson',
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Expose-Headers': 'ETag',
+            'ETag': '"%s"' % snapshot['manifest_sha256']
         },
-        'body': json.dumps({'error': 'Method not allowed'}),
+        'body': manifest.decode('utf-8'),
         'isBase64Encoded': False
     }
+
+def snapshot_create(request: Request) -> Dict[str, Any]:
+    from snapshots import create_snapshot
+    
+    body_data = request.body()
+    
+    if not isinstance(body_data, dict) or not body_data.get('server_id'):
+        return error(400, 'Missing server_id')
+    
+    try:
+        server_id = int(body_data['server_id'])
+    except (TypeError, ValueError):
+        return error(400, 'Invalid server_id')
+    
+    if not existing_server_ids(request.cursor, [server_id]):
+        return error(404, 'Server not found')
+    
+    snapshot = create_snapshot(request.cursor, server_id, body_data.get('label'))
+    request.conn.commit()
+    
+    return respond(201, snapshot)
+
+def snapshot_restore(request: Request) -> Dict[str, Any]:
+    from snapshots import SnapshotNotFound, restore_snapshot
+    
+    body_data = request.body()
+    
+    if not isinstance(body_data, dict) or not body_data.get('snapshot_id'):
+        return error(400, 'Missing snapshot_id')
+    if not str(body_data['snapshot_id']).isdigit():
+        return error(400, 'Invalid snapshot_id')
+    
+    try:
+        restored = restore_snapshot(request.cursor, body_data['snapshot_id'])
+    except SnapshotNotFound as exc:
+        request.conn.rollback()
+        return error(404, str(exc))
+    
+    request.conn.commit()
+    
+    return respond(200, restored)
+
+def snapshot_delete(request: Request) -> Dict[str, Any]:
+    from snapshots import SnapshotNotFound, delete_snapshot
+    
+    snapshot_id = request.query.get('id')
+    
+    if not snapshot_id:
+        return error(400, 'Missing snapshot id')
+    if not snapshot_id.isdigit():
+        return error(400, 'Invalid snapshot id')
+    
+    try:
+        snapshot = delete_snapshot(request.cursor, snapshot_id)
+    except SnapshotNotFound as exc:
+        request.conn.rollback()
+        return error(404, str(exc))
+    
+    request.conn.commit()
+    
+    return respond(200, {'message': 'Snapshot deleted', 'id': snapshot['id']})
+
+def garbage_collect(request: Request) -> Dict[str, Any]:
+    from snapshots import GC_BATCH, collect_garbage
+    
+    try:
+        limit = int(request.query.get('limit') or GC_BATCH)
+    except ValueError:
+        limit = 0
+    if limit < 1:
+        return error(400, 'Invalid limit')
+    
+    collected = collect_garbage(request.cursor, limit)
+    request.conn.commit()
+    
+    return respond(200, collected)
+
+app = App({
+    ('GET', None): Route(list_files, cacheable=True),
+    ('GET', 'usage'): Route(storage_usage, cacheable=True),
+    ('GET', 'search'): Route(search_files, cacheable=True),
+    ('GET', 'children'): Route(directory_listing, cacheable=True),
+    ('GET', 'subtree'): Route(directory_listing, cacheable=True),
+    ('GET', 'upload_status'): Route(upload_status),
+    ('GET', 'download'): Route(download_file),
+    ('GET', 'snapshots'): Route(snapshot_list, cacheable=True),
+    ('GET', 'snapshot_manifest'): Route(snapshot_manifest),
+    ('POST', None): Route(create_file),
+    ('POST', 'upload_start'): Route(upload_start),
+    ('POST', 'upload_complete'): Route(upload_complete),
+    ('POST', 'snapshot'): Route(snapshot_create),
+    ('POST', 'restore'): Route(snapshot_restore),
+    ('POST', 'gc'): Route(garbage_collect),
+    ('PUT', None): Route(move_directory),
+    ('PUT', 'upload_chunk'): Route(upload_chunk),
+    ('DELETE', None): Route(delete_file),
+    ('DELETE', 'upload_abort'): Route(upload_abort),
+    ('DELETE', 'snapshot'): Route(snapshot_delete)
+}, cached_tables=CACHED_TABLES, allow_headers='Content-Type, If-None-Match, Range')
+
+def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    '''
+    Business: Управление файлами серверов - список, поиск по имени, расширению и каталогу, обход и перемещение каталогов, докачиваемая загрузка содержимого чанками, скачивание с Range, инкрементальные снимки и восстановление, удаление
+    Args: event с httpMethod, body, queryStringParameters; context с request_id
+    Returns: HTTP response с данными файлов
+    '''
+    return app(event, context)
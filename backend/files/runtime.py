@@ -0,0 +1,188 @@
+'''
+Лёгкий рантайм обработчиков: таблица маршрутов (метод, action) -> функция, заранее
+собранные неизменяемые заголовки и общий путь трассировка -> кэш -> пул -> маршрут.
+psycopg2 загружается лениво при первой выдаче соединения, поэтому preflight OPTIONS,
+405 и ответы из кэша на холодном старте не платят за импорт драйвера.
+Копия модуля лежит в каждой функции backend/* - держите копии одинаковыми.
+'''
+import base64
+import json
+from types import MappingProxyType
+from typing import Dict, Any, Callable, Iterable, Mapping, NamedTuple, Optional, Tuple
+
+import pool
+import response_cache
+import tracing
+
+JSON_HEADERS: Mapping[str, str] = MappingProxyType({
+    'Content-Type': 'application/json',
+    'Access-Control-Allow-Origin': '*'
+})
+METHOD_ORDER = ('GET', 'POST', 'PUT', 'DELETE')
+_MISSING = object()
+
+
+class BadRequest(Exception):
+    pass
+
+
+class Request:
+    __slots__ = ('event', 'method', 'query', 'conn', 'cursor', '_body')
+
+    def __init__(self, event: Dict[str, Any], method: str, query: Dict[str, Any]) -> None:
+        self.event = event
+        self.method = method
+        self.query = query
+        self.conn: Any = None
+        self.cursor: Any = None
+        self._body: Any = _MISSING
+
+    def body(self) -> Any:
+        '''
+        JSON-тело запроса: объект или массив (пакетный режим). Иначе - BadRequest (400).
+        '''
+        if self._body is _MISSING:
+            try:
+                self._body = json.loads(self.event.get('body') or '{}')
+            except ValueError:
+                raise BadRequest('Invalid JSON body')
+            if not isinstance(self._body, (dict, list)):
+                raise BadRequest('JSON body must be an object or an array')
+        return self._body
+
+    def header(self, name: str) -> Optional[str]:
+        return response_cache.request_header(self.event, name)
+
+    def raw_body(self) -> bytes:
+        '''
+        Тело как байты: шлюз передаёт двоичные тела в base64 с флагом isBase64Encoded.
+        '''
+        body = self.event.get('body') or ''
+        if self.event.get('isBase64Encoded'):
+            try:
+                return base64.b64decode(body, validate=True)
+            except ValueError:
+                raise BadRequest('Invalid base64 body')
+        return body.encode('utf-8')
+
+
+class Route(NamedTuple):
+    handler: Callable[[Request], Dict[str, Any]]
+    cacheable: bool = False
+
+
+Routes = Mapping[Tuple[str, Optional[str]], Route]
+
+
+def respond(status_code: int, payload: Any, headers: Optional[Mapping[str, str]] = None) -> Dict[str, Any]:
+    return respond_encoded(status_code, tracing.dumps(payload), headers)
+
+
+def respond_encoded(status_code: int, body: str, headers: Optional[Mapping[str, str]] = None) -> Dict[str, Any]:
+    '''
+    Ответ с уже готовым JSON-текстом (кодировщик строк или json_agg в Postgres) без повторной сериализации.
+    '''
+    response_headers = dict(JSON_HEADERS)
+    if headers:
+        response_headers.update(headers)
+    return {
+        'statusCode': status_code,
+        'headers': response_headers,
+        'body': body,
+        'isBase64Encoded': False
+    }
+
+
+def respond_binary(status_code: int, data: bytes, headers: Optional[Mapping[str, str]] = None) -> Dict[str, Any]:
+    response_headers = {'Content-Type': 'application/octet-stream', 'Access-Control-Allow-Origin': '*'}
+    if headers:
+        response_headers.update(headers)
+    return {
+        'statusCode': status_code,
+        'headers': response_headers,
+        'body': base64.b64encode(data).decode('ascii'),
+        'isBase64Encoded': True
+    }
+
+
+def error(status_code: int, message: str, **details: Any) -> Dict[str, Any]:
+    payload = {'error': message}
+    payload.update(details)
+    return respond(status_code, payload)
+
+
+def cursor_class() -> Any:
+    from psycopg2.extras import RealDictCursor
+    return tracing.traced_cursor(RealDictCursor)
+
+
+def tuple_cursor_class() -> Any:
+    '''
+    Курсор с обычными кортежами для быстрых списков: без dict на каждую строку.
+    '''
+    import psycopg2.extensions
+    return tracing.traced_cursor(psycopg2.extensions.cursor)
+
+
+class App:
+    '''
+    handler функции: OPTIONS и неизвестный метод отвечают без БД, остальное
+    разрешается по таблице маршрутов. Ключ (method, action) точнее (method, None).
+    '''
+
+    def __init__(self, routes: Routes, cached_tables: Iterable[str] = (),
+                 allow_headers: str = 'Content-Type, If-None-Match') -> None:
+        self.routes = MappingProxyType(dict(routes))
+        self.cached_tables = list(cached_tables)
+        self.methods = frozenset(method for method, _ in self.routes)
+        self.preflight_headers = MappingProxyType({
+            'Access-Control-Allow-Origin': '*',
+            'Access-Control-Allow-Methods': ', '.join(
+                [method for method in METHOD_ORDER if method in self.methods] + ['OPTIONS']
+            ),
+            'Access-Control-Allow-Headers': allow_headers,
+            'Access-Control-Max-Age': '86400'
+        })
+
+    def resolve(self, method: str, action: Optional[str]) -> Optional[Route]:
+        return self.routes.get((method, action)) or self.routes.get((method, None))
+
+    def __call__(self, event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        method: str = event.get('httpMethod', 'GET')
+        if method == 'OPTIONS':
+            return {'statusCode': 200, 'headers': dict(self.preflight_headers), 'body': '', 'isBase64Encoded': False}
+
+        query = event.get('queryStringParameters') or {}
+        route = self.resolve(method, query.get('action'))
+        if route is None:
+            return error(405, 'Method not allowed')
+
+        request = Request(event, method, query)
+        with tracing.request(context, method) as trace:
+            if route.cacheable:
+                cached = response_cache.lookup(event)
+                if cached:
+                    trace.note('cache', 'hit')
+                    return trace.finish(cached)
+
+            with pool.connection() as conn:
+                trace.mark('connect')
+                request.conn = conn
+                request.cursor = conn.cursor(cursor_factory=cursor_class())
+                try:
+                    if route.cacheable:
+                        response = response_cache.fetch(
+                            event, request.cursor, self.cached_tables, lambda: route.handler(request)
+                        )
+                    else:
+                        response = route.handler(request)
+                        if method != 'GET' and response['statusCode'] < 400:
+                            response_cache.invalidate()
+                except BadRequest as exc:
+                    conn.rollback()
+                    response = error(400, str(exc))
+                finally:
+                    request.cursor.close()
+
+            response['headers']['X-DB-Pool'] = pool.stats_header()
+            return trace.finish(response)
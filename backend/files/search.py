@@ -0,0 +1,96 @@
+'''
+Поиск файлов сервера: q - подстрока имени (ILIKE по триграммному GIN-индексу на
+(server_id, file_name), выдача ранжируется similarity), ext - расширения через запятую
+(выражение lower(substring(...)) совпадает с выражением индекса), path - поддерево каталога
+через материализованные пути server_directories. Без q страницы идут по (file_path, file_name, id),
+с q - по (rank, id).
+'''
+import base64
+import json
+from typing import Any, List, Mapping, NamedTuple, Optional, Tuple
+from directories import escape_like, normalize_dir_path
+
+EXTENSION_SQL = "lower(substring(file_name FROM '\\.([^.]+)$'))"
+MAX_QUERY_LENGTH = 100
+MAX_EXTENSIONS = 20
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 500
+
+
+class FileSearch(NamedTuple):
+    server_id: int
+    query: Optional[str]
+    extensions: List[str]
+    dir_path: Optional[str]
+    after: Optional[Tuple[Any, ...]]
+    limit: int
+
+
+def parse_search(query_params: Mapping[str, Any]) -> FileSearch:
+    '''Бросает ValueError (InvalidPath - его подкласс) на любой некорректный параметр.'''
+    server_id = int(query_params['server_id'])
+    query = (query_params.get('q') or '').strip()
+    if len(query) > MAX_QUERY_LENGTH:
+        raise ValueError('q must be at most %d characters' % MAX_QUERY_LENGTH)
+
+    extensions = [item.strip().lstrip('.').lower() for item in (query_params.get('ext') or '').split(',')]
+    extensions = [item for item in extensions if item]
+    if len(extensions) > MAX_EXTENSIONS:
+        raise ValueError('ext must list at most %d values' % MAX_EXTENSIONS)
+
+    dir_path = normalize_dir_path(query_params['path']) if query_params.get('path') else None
+    limit = int(query_params.get('limit') or DEFAULT_LIMIT)
+    if not 1 <= limit <= MAX_LIMIT:
+        raise ValueError('limit must be between 1 and %d' % MAX_LIMIT)
+
+    after = None
+    if query_params.get('after'):
+        raw = json.loads(base64.urlsafe_b64decode(query_params['after'].encode('ascii')))
+        if query and raw[0] != 'rank':
+            raise ValueError('Cursor does not belong to a ranked search')
+        after = (float(raw[1]), int(raw[2])) if query else (str(raw[0]), str(raw[1]), int(raw[2]))
+    return FileSearch(server_id, query or None, extensions, dir_path, after, limit)
+
+
+def encode_cursor(search: FileSearch, row: Tuple[Any, ...], columns: Tuple[str, ...]) -> str:
+    if search.query:
+        raw = ['rank', row[-1], row[columns.index('id')]]
+    else:
+        raw = [row[columns.index('file_path')], row[columns.index('file_name')], row[columns.index('id')]]
+    return base64.urlsafe_b64encode(json.dumps(raw).encode('utf-8')).decode('ascii')
+
+
+def search_query(select_list: str, search: FileSearch) -> Tuple[str, List[Any]]:
+    conditions = ['server_id = %s']
+    params: List[Any] = [search.server_id]
+    if search.query:
+        conditions.append('file_name ILIKE %s')
+        params.append('%' + escape_like(search.query) + '%')
+    if search.extensions:
+        conditions.append(EXTENSION_SQL + ' = ANY(%s)')
+        params.append(search.extensions)
+    if search.dir_path and search.dir_path != '/':
+        conditions.append(
+            'directory_id IN (SELECT id FROM server_directories WHERE server_id = %s AND path LIKE %s)'
+        )
+        params.extend([search.server_id, escape_like(search.dir_path) + '%'])
+
+    if search.query:
+        select_list += ', similarity(file_name, %s) AS rank'
+        params.insert(0, search.query)
+        if search.after:
+            conditions.append('(similarity(file_name, %s), id) < (%s, %s)')
+            params.extend([search.query, search.after[0], search.after[1]])
+        order = 'rank DESC, id DESC'
+    else:
+        if search.after:
+            conditions.append('(file_path, file_name, id) > (%s, %s, %s)')
+            params.extend(search.after)
+        order = 'file_path, file_name, id'
+
+    params.append(search.limit + 1)
+    sql = (
+        'SELECT ' + select_list + ' FROM server_files WHERE ' + ' AND '.join(conditions) +
+        ' ORDER BY ' + order + ' LIMIT %s'
+    )
+    return sql, params
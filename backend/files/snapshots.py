@@ -0,0 +1,464 @@
+'''
+Инкрементальные дедуплицированные снимки файлов сервера.
+
+Снимок - манифест в blob_store (NDJSON, строка на файл: путь, размер, sha256 и список
+чанков [sha256, размер]) плюс строка server_snapshots и агрегированные ссылки snapshot_blob_refs.
+Файл, чей content_sha256 уже есть в манифесте предыдущего снимка, не читается вовсе -
+его список чанков переносится как есть. Изменённые файлы режутся на чанки по содержимому (CDC):
+граница ставится после якорного байта, если crc32 окна из CDC_WINDOW байт перед ним
+попадает под маску, поэтому правка в середине region-файла меняет один-два чанка,
+а не сдвигает все последующие. В хранилище пишутся только чанки, которых нет в blobs.
+
+Восстановление читает манифест окнами по MANIFEST_READ_SIZE и пересобирает server_files
+ссылками на те же блобы - байты не копируются. Сборщик мусора удаляет блобы с ref_count = 0.
+Ядро (content_chunks, build_manifest, iter_manifest) не зависит от БД: учёт ссылок
+передаётся объектом с методом add, так его гоняет benchmarks/snapshot_bench.py.
+'''
+import hashlib
+import json
+import os
+import zlib
+from collections import Counter
+from typing import Dict, Any, Callable, Iterable, Iterator, List, Optional, Set, Tuple
+
+from blob_store import get_store
+from directories import display_path, ensure_directory, normalize_dir_path
+from storage import bump_storage_totals, format_size
+from uploads import release_file_chunks
+
+CDC_MIN_SIZE = int(os.environ.get('CDC_MIN_SIZE', str(64 * 1024)))
+CDC_AVG_SIZE = int(os.environ.get('CDC_AVG_SIZE', str(256 * 1024)))
+CDC_MAX_SIZE = int(os.environ.get('CDC_MAX_SIZE', str(1024 * 1024)))
+CDC_WINDOW = 64
+CDC_ANCHOR = 0x8f
+CDC_MASK = max(CDC_AVG_SIZE // 256, 1) - 1
+CHUNK_WRITE_BATCH = 64
+MANIFEST_READ_SIZE = 1024 * 1024
+RESTORE_BATCH = 500
+GC_BATCH = int(os.environ.get('SNAPSHOT_GC_BATCH', '500'))
+UPLOAD_SESSION_TTL_HOURS = int(os.environ.get('UPLOAD_SESSION_TTL_HOURS', '24'))
+
+BlobRefs = Dict[str, Tuple[int, int]]
+
+
+class SnapshotNotFound(LookupError):
+    pass
+
+
+def find_cut(data: Any, final: bool) -> int:
+    '''
+    Длина первого чанка в data (bytes/bytearray от начала чанка). 0 - нужно больше данных:
+    решение принимается только по CDC_MAX_SIZE байтам или по концу файла, так что граница
+    зависит лишь от содержимого и не зависит от того, какими кусками пришли байты.
+    '''
+    size = len(data)
+    if size < CDC_MAX_SIZE and not final:
+        return 0
+    end = min(size, CDC_MAX_SIZE)
+    position = CDC_MIN_SIZE
+    while position < end:
+        position = data.find(CDC_ANCHOR, position, end)
+        if position < 0:
+            break
+        position += 1
+        if not zlib.crc32(data[position - CDC_WINDOW:position]) & CDC_MASK:
+            return position
+    return end
+
+
+def content_chunks(pieces: Iterable[bytes]) -> Iterator[bytes]:
+    '''
+    Перерезает поток кусков произвольной длины на чанки по содержимому.
+    В памяти держится не больше CDC_MAX_SIZE + одного входного куска.
+    '''
+    buffer = bytearray()
+    for piece in pieces:
+        buffer += piece
+        while True:
+            cut = find_cut(buffer, False)
+            if not cut:
+                break
+            yield bytes(buffer[:cut])
+            del buffer[:cut]
+    while buffer:
+        cut = find_cut(buffer, True)
+        yield bytes(buffer[:cut])
+        del buffer[:cut]
+
+
+class ManifestStats:
+    __slots__ = ('file_count', 'total_bytes', 'chunk_count', 'new_chunk_count', 'new_bytes', 'read_bytes')
+
+    def __init__(self) -> None:
+        self.file_count = 0
+        self.total_bytes = 0
+        self.chunk_count = 0
+        self.new_chunk_count = 0
+        self.new_bytes = 0
+        self.read_bytes = 0
+
+    def as_dict(self) -> Dict[str, int]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+def store_chunks(chunks: List[bytes], refs: Any, store: Any, stats: ManifestStats) -> List[List[Any]]:
+    '''
+    Регистрирует ссылки на пачку чанков и пишет байты тех, что вернул refs.add
+    (блоб новый или был без ссылок и мог быть уже удалён сборщиком).
+    '''
+    hashed = [(hashlib.sha256(chunk).hexdigest(), chunk) for chunk in chunks]
+    counts: Counter = Counter(sha256 for sha256, _ in hashed)
+    sizes = {sha256: len(chunk) for sha256, chunk in hashed}
+    needed = refs.add({sha256: (sizes[sha256], count) for sha256, count in counts.items()})
+    for sha256, chunk in hashed:
+        if sha256 in needed:
+            store.put(sha256, chunk)
+            needed.discard(sha256)
+            stats.new_chunk_count += 1
+            stats.new_bytes += len(chunk)
+    return [[sha256, len(chunk)] for sha256, chunk in hashed]
+
+
+def build_manifest(files: Iterable[Dict[str, Any]], previous: Dict[str, List[List[Any]]],
+                   read_content: Callable[[Dict[str, Any]], Iterable[bytes]], refs: Any,
+                   store: Any) -> Tuple[str, Counter, ManifestStats]:
+    '''
+    files - словари с file_path, file_name, file_type, file_size_bytes, content_sha256.
+    previous - content_sha256 -> чанки из манифеста предыдущего снимка.
+    Возвращает sha256 записанного манифеста, все ссылки снимка (sha256 -> число) и статистику.
+    '''
+    stats = ManifestStats()
+    known = dict(previous)
+    snapshot_refs: Counter = Counter()
+    reused: BlobRefs = {}
+    lines = []
+    for file in files:
+        content_sha256 = file['content_sha256']
+        chunks: List[List[Any]] = []
+        if content_sha256 and content_sha256 in known:
+            chunks = known[content_sha256]
+            for sha256, size in chunks:
+                reused[sha256] = (size, reused.get(sha256, (size, 0))[1] + 1)
+        elif content_sha256:
+            pending: List[bytes] = []
+            for chunk in content_chunks(read_content(file)):
+                stats.read_bytes += len(chunk)
+                pending.append(chunk)
+                if len(pending) == CHUNK_WRITE_BATCH:
+                    chunks.extend(store_chunks(pending, refs, store, stats))
+                    pending = []
+            if pending:
+                chunks.extend(store_chunks(pending, refs, store, stats))
+            known[content_sha256] = chunks
+        stats.file_count += 1
+        stats.total_bytes += file['file_size_bytes'] or 0
+        stats.chunk_count += len(chunks)
+        snapshot_refs.update(sha256 for sha256, _ in chunks)
+        lines.append(json.dumps({
+            'path': file['file_path'],
+            'name': file['file_name'],
+            'type': file['file_type'],
+            'size': file['file_size_bytes'],
+            'sha256': content_sha256,
+            'chunks': chunks
+        }, separators=(',', ':')))
+
+    if reused:
+        refs.add(reused)
+    manifest = ('\n'.join(lines) + '\n').encode('utf-8')
+    manifest_sha256 = hashlib.sha256(manifest).hexdigest()
+    if manifest_sha256 in refs.add({manifest_sha256: (len(manifest), 1)}):
+        store.put(manifest_sha256, manifest)
+    snapshot_refs[manifest_sha256] += 1
+    return manifest_sha256, snapshot_refs, stats
+
+
+def iter_manifest(store: Any, manifest_sha256: str, size_bytes: int) -> Iterator[Dict[str, Any]]:
+    '''
+    Записи манифеста по одной; из хранилища читается окно MANIFEST_READ_SIZE за раз.
+    '''
+    offset = 0
+    tail = b''
+    while offset < size_bytes:
+        window = store.read(manifest_sha256, offset, min(MANIFEST_READ_SIZE, size_bytes - offset))
+        offset += len(window)
+        lines = (tail + window).split(b'\n')
+        tail = lines.pop()
+        for line in lines:
+            if line:
+                yield json.loads(line)
+    if tail:
+        yield json.loads(tail)
+
+
+def iter_entry_content(store: Any, entry: Dict[str, Any]) -> Iterator[bytes]:
+    for sha256, _ in entry['chunks']:
+        yield store.read(sha256)
+
+
+class BlobRefTable:
+    '''
+    Учёт ссылок в таблице blobs. add возвращает блобы, байты которых нужно записать:
+    после прибавки ref_count равен прибавке, то есть раньше ссылок не было.
+    '''
+
+    def __init__(self, cursor: Any) -> None:
+        self.cursor = cursor
+
+    def add(self, blob_refs: BlobRefs) -> Set[str]:
+        from psycopg2.extras import execute_values
+
+        if not blob_refs:
+            return set()
+        rows = execute_values(self.cursor, '''
+            INSERT INTO blobs (sha256, size_bytes, ref_count)
+            VALUES %s
+            ON CONFLICT (sha256) DO UPDATE SET ref_count = blobs.ref_count + EXCLUDED.ref_count
+            RETURNING sha256, ref_count
+        ''', [(sha256, size, count) for sha256, (size, count) in sorted(blob_refs.items())],
+            page_size=len(blob_refs), fetch=True)
+        return {row['sha256'] for row in rows if row['ref_count'] == blob_refs[row['sha256']][1]}
+
+
+def render_snapshot(snapshot: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'id': snapshot['id'],
+        'server_id': snapshot['server_id'],
+        'parent_id': snapshot['parent_id'],
+        'label': snapshot['label'],
+        'file_count': snapshot['file_count'],
+        'total_bytes': snapshot['total_bytes'],
+        'total_size': format_size(snapshot['total_bytes']),
+        'chunk_count': snapshot['chunk_count'],
+        'new_chunk_count': snapshot['new_chunk_count'],
+        'new_bytes': snapshot['new_bytes'],
+        'created_at': snapshot['created_at'].isoformat() if snapshot['created_at'] else None
+    }
+
+
+def list_snapshots(cursor: Any, server_id: Any) -> List[Dict[str, Any]]:
+    cursor.execute('SELECT * FROM server_snapshots WHERE server_id = %s ORDER BY id DESC', (server_id,))
+    return [render_snapshot(row) for row in cursor.fetchall()]
+
+
+def server_file_content(cursor: Any, store: Any) -> Callable[[Dict[str, Any]], Iterator[bytes]]:
+    def read_content(file: Dict[str, Any]) -> Iterator[bytes]:
+        cursor.execute(
+            'SELECT blob_sha256 FROM server_file_chunks WHERE file_id = %s ORDER BY chunk_index',
+            (file['id'],)
+        )
+        for row in cursor.fetchall():
+            yield store.read(row['blob_sha256'])
+    return read_content
+
+
+def latest_snapshot(cursor: Any, server_id: Any) -> Optional[Dict[str, Any]]:
+    cursor.execute('''
+        SELECT s.id, s.manifest_sha256, b.size_bytes AS manifest_size
+        FROM server_snapshots s
+        JOIN blobs b ON b.sha256 = s.manifest_sha256
+        WHERE s.server_id = %s
+        ORDER BY s.id DESC
+        LIMIT 1
+        FOR SHARE OF s
+    ''', (server_id,))
+    return cursor.fetchone()
+
+
+def create_snapshot(cursor: Any, server_id: Any, label: Optional[str]) -> Dict[str, Any]:
+    '''
+    Снимок текущих server_files сервера. Предыдущий снимок блокируется FOR SHARE,
+    чтобы его нельзя было удалить, пока на его чанки переносятся ссылки.
+    '''
+    from psycopg2.extras import execute_values
+
+    store = get_store()
+    parent = latest_snapshot(cursor, server_id)
+    previous: Dict[str, List[List[Any]]] = {}
+    if parent:
+        for entry in iter_manifest(store, parent['manifest_sha256'], parent['manifest_size']):
+            if entry['sha256']:
+                previous[entry['sha256']] = entry['chunks']
+
+    cursor.execute('''
+        SELECT id, file_path, file_name, file_type, file_size_bytes, content_sha256
+        FROM server_files WHERE server_id = %s
+        ORDER BY file_path, file_name, id
+    ''', (server_id,))
+    files = cursor.fetchall()
+    manifest_sha256, snapshot_refs, stats = build_manifest(
+        files, previous, server_file_content(cursor, store), BlobRefTable(cursor), store
+    )
+
+    cursor.execute('''
+        INSERT INTO server_snapshots
+        (server_id, parent_id, label, manifest_sha256, file_count, total_bytes, chunk_count, new_chunk_count, new_bytes)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+        RETURNING *
+    ''', (server_id, parent['id'] if parent else None, label, manifest_sha256, stats.file_count,
+          stats.total_bytes, stats.chunk_count, stats.new_chunk_count, stats.new_bytes))
+    snapshot = cursor.fetchone()
+    execute_values(cursor, '''
+        INSERT INTO snapshot_blob_refs (snapshot_id, blob_sha256, ref_count) VALUES %s
+    ''', [(snapshot['id'], sha256, count) for sha256, count in snapshot_refs.items()], page_size=1000)
+    rendered = render_snapshot(snapshot)
+    rendered['read_bytes'] = stats.read_bytes
+    return rendered
+
+
+def find_snapshot(cursor: Any, snapshot_id: Any, lock: str = '') -> Dict[str, Any]:
+    cursor.execute(
+        'SELECT s.*, b.size_bytes AS manifest_size FROM server_snapshots s '
+        'JOIN blobs b ON b.sha256 = s.manifest_sha256 WHERE s.id = %s' + (' FOR ' + lock + ' OF s' if lock else ''),
+        (snapshot_id,)
+    )
+    snapshot = cursor.fetchone()
+    if not snapshot:
+        raise SnapshotNotFound('Snapshot not found')
+    return snapshot
+
+
+def delete_snapshot(cursor: Any, snapshot_id: Any) -> Dict[str, Any]:
+    snapshot = find_snapshot(cursor, snapshot_id, 'UPDATE')
+    cursor.execute('''
+        WITH removed AS (
+            DELETE FROM snapshot_blob_refs WHERE snapshot_id = %s RETURNING blob_sha256, ref_count
+        )
+        UPDATE blobs b SET ref_count = b.ref_count - r.ref_count
+        FROM removed r
+        WHERE b.sha256 = r.blob_sha256
+    ''', (snapshot['id'],))
+    cursor.execute('DELETE FROM server_snapshots WHERE id = %s', (snapshot['id'],))
+    return snapshot
+
+
+def restore_files(cursor: Any, server_id: Any, entries: List[Dict[str, Any]],
+                  directory_ids: Dict[str, int]) -> Tuple[int, int]:
+    from psycopg2.extras import execute_values
+
+    rows = []
+    for entry in entries:
+        dir_path = normalize_dir_path(entry['path'])
+        if dir_path not in directory_ids:
+            directory_ids[dir_path] = ensure_directory(cursor, server_id, dir_path)
+        rows.append((server_id, display_path(dir_path), entry['name'], entry['size'], entry['type'],
+                     directory_ids[dir_path], entry['sha256']))
+    created = execute_values(cursor, '''
+        INSERT INTO server_files
+        (server_id, file_path, file_name, file_size_bytes, file_type, directory_id, content_sha256)
+        VALUES %s
+        RETURNING id
+    ''', rows, page_size=len(rows), fetch=True)
+
+    chunk_rows = []
+    blob_refs: Counter = Counter()
+    for row, entry in zip(created, entries):
+        offset = 0
+        for index, (sha256, size) in enumerate(entry['chunks']):
+            chunk_rows.append((row['id'], index, offset, size, sha256))
+            blob_refs[sha256] += 1
+            offset += size
+    if chunk_rows:
+        execute_values(cursor, '''
+            INSERT INTO server_file_chunks (file_id, chunk_index, offset_bytes, size_bytes, blob_sha256)
+            VALUES %s
+        ''', chunk_rows, page_size=1000)
+        execute_values(cursor, '''
+            UPDATE blobs b SET ref_count = b.ref_count + v.refs
+            FROM (VALUES %s) AS v(sha256, refs)
+            WHERE b.sha256 = v.sha256
+        ''', sorted(blob_refs.items()), page_size=1000)
+    return len(rows), sum(entry['size'] or 0 for entry in entries)
+
+
+def restore_snapshot(cursor: Any, snapshot_id: Any) -> Dict[str, Any]:
+    '''
+    Заменяет файлы сервера содержимым снимка, читая манифест потоком пачками по RESTORE_BATCH.
+    Строка сервера блокируется, чтобы два восстановления одного сервера не перемешались.
+    '''
+    snapshot = find_snapshot(cursor, snapshot_id, 'SHARE')
+    server_id = snapshot['server_id']
+    cursor.execute('SELECT id FROM minecraft_servers WHERE id = %s FOR UPDATE', (server_id,))
+
+    cursor.execute('SELECT id FROM server_files WHERE server_id = %s', (server_id,))
+    release_file_chunks(cursor, [row['id'] for row in cursor.fetchall()])
+    cursor.execute('''
+        WITH removed AS (DELETE FROM server_files WHERE server_id = %s RETURNING file_size_bytes)
+        SELECT COUNT(*) AS file_count, COALESCE(SUM(file_size_bytes), 0) AS file_bytes FROM removed
+    ''', (server_id,))
+    removed = cursor.fetchone()
+
+    restored_count = 0
+    restored_bytes = 0
+    directory_ids: Dict[str, int] = {}
+    batch: List[Dict[str, Any]] = []
+    for entry in iter_manifest(get_store(), snapshot['manifest_sha256'], snapshot['manifest_size']):
+        batch.append(entry)
+        if len(batch) == RESTORE_BATCH:
+            count, size_bytes = restore_files(cursor, server_id, batch, directory_ids)
+            restored_count += count
+            restored_bytes += size_bytes
+            batch = []
+    if batch:
+        count, size_bytes = restore_files(cursor, server_id, batch, directory_ids)
+        restored_count += count
+        restored_bytes += size_bytes
+
+    bump_storage_totals(
+        cursor, server_id,
+        file_count=restored_count - removed['file_count'], file_bytes=restored_bytes - removed['file_bytes']
+    )
+    return {
+        'snapshot_id': snapshot['id'],
+        'server_id': server_id,
+        'removed_files': removed['file_count'],
+        'restored_files': restored_count,
+        'restored_bytes': restored_bytes
+    }
+
+
+def collect_garbage(cursor: Any, limit: int = GC_BATCH) -> Dict[str, Any]:
+    '''
+    Одна ограниченная порция сборки: просроченные сессии загрузки отпускают свои чанки,
+    затем блобы без ссылок удаляются из хранилища и из blobs. Строки блокируются
+    FOR UPDATE SKIP LOCKED до commit, поэтому параллельный upsert той же строки ждёт
+    и после удаления вставляет её заново вместе с байтами.
+    '''
+    cursor.execute('''
+        SELECT id FROM upload_sessions
+        WHERE updated_at < CURRENT_TIMESTAMP - make_interval(hours => %s)
+        ORDER BY updated_at
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    ''', (UPLOAD_SESSION_TTL_HOURS, limit))
+    expired = [row['id'] for row in cursor.fetchall()]
+    if expired:
+        cursor.execute('''
+            WITH removed AS (
+                DELETE FROM upload_session_chunks WHERE upload_id = ANY(%s) RETURNING blob_sha256
+            )
+            UPDATE blobs b SET ref_count = b.ref_count - r.refs
+            FROM (SELECT blob_sha256, COUNT(*) AS refs FROM removed GROUP BY blob_sha256) r
+            WHERE b.sha256 = r.blob_sha256
+        ''', (expired,))
+        cursor.execute('DELETE FROM upload_sessions WHERE id = ANY(%s)', (expired,))
+
+    cursor.execute('''
+        SELECT sha256, size_bytes FROM blobs
+        WHERE ref_count = 0
+        ORDER BY created_at
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    ''', (limit,))
+    garbage = cursor.fetchall()
+    store = get_store()
+    for blob in garbage:
+        store.delete(blob['sha256'])
+    if garbage:
+        cursor.execute('DELETE FROM blobs WHERE sha256 = ANY(%s)', ([blob['sha256'] for blob in garbage],))
+    return {
+        'expired_uploads': len(expired),
+        'deleted_blobs': len(garbage),
+        'freed_bytes': sum(blob['size_bytes'] for blob in garbage),
+        'has_more': len(garbage) == limit
+    }
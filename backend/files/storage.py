@@ -0,0 +1,78 @@
+'''
+Размеры в байтах и предагрегированные итоги хранилища по серверу.
+Копия модуля лежит в functions files и databases - держите копии одинаковыми.
+'''
+import re
+from typing import Dict, Any, Optional
+
+UNITS = ('B', 'KB', 'MB', 'GB', 'TB')
+SIZE_PATTERN = re.compile(r'^\s*(\d+(?:[.,]\d+)?)\s*([KMGT]?B)?\s*$', re.IGNORECASE)
+
+
+def parse_size(value: Any) -> int:
+    '''
+    Принимает число байт или строку вида '12 KB' / '1.5 GB' и возвращает байты.
+    '''
+    if value is None or value == '':
+        return 0
+    if isinstance(value, bool):
+        raise ValueError('Invalid size')
+    if isinstance(value, (int, float)):
+        if value < 0:
+            raise ValueError('Size must not be negative')
+        return int(value)
+    match = SIZE_PATTERN.match(str(value))
+    if not match:
+        raise ValueError('Invalid size: %s' % value)
+    number = float(match.group(1).replace(',', '.'))
+    unit = (match.group(2) or 'B').upper()
+    return int(number * 1024 ** UNITS.index(unit))
+
+
+def format_size(size_bytes: Optional[int]) -> str:
+    size = float(size_bytes or 0)
+    for unit in UNITS:
+        if size < 1024 or unit == UNITS[-1]:
+            break
+        size /= 1024
+    if unit == 'B':
+        return '%d B' % size
+    return ('%.1f' % size).rstrip('0').rstrip('.') + ' ' + unit
+
+
+def bump_storage_totals(cursor: Any, server_id: Any, file_count: int = 0, file_bytes: int = 0,
+                        database_count: int = 0, database_bytes: int = 0) -> None:
+    '''
+    Инкрементально сдвигает счётчики server_storage_totals в текущей транзакции.
+    '''
+    if server_id is None:
+        return
+    cursor.execute('''
+        INSERT INTO server_storage_totals AS t
+        (server_id, file_count, file_bytes, database_count, database_bytes)
+        VALUES (%s, %s, %s, %s, %s)
+        ON CONFLICT (server_id) DO UPDATE SET
+            file_count = t.file_count + EXCLUDED.file_count,
+            file_bytes = t.file_bytes + EXCLUDED.file_bytes,
+            database_count = t.database_count + EXCLUDED.database_count,
+            database_bytes = t.database_bytes + EXCLUDED.database_bytes,
+            updated_at = CURRENT_TIMESTAMP
+    ''', (server_id, file_count, file_bytes, database_count, database_bytes))
+
+
+def read_storage_totals(cursor: Any, server_id: Any) -> Dict[str, Any]:
+    cursor.execute('''
+        SELECT file_count, file_bytes, database_count, database_bytes
+        FROM server_storage_totals WHERE server_id = %s
+    ''', (server_id,))
+    row = cursor.fetchone() or {'file_count': 0, 'file_bytes': 0, 'database_count': 0, 'database_bytes': 0}
+    total_bytes = row['file_bytes'] + row['database_bytes']
+    return {
+        'server_id': int(server_id),
+        'file_count': row['file_count'],
+        'file_bytes': row['file_bytes'],
+        'database_count': row['database_count'],
+        'database_bytes': row['database_bytes'],
+        'total_bytes': total_bytes,
+        'total_size': format_size(total_bytes)
+    }
@@ -0,0 +1,235 @@
+'''
+Загрузка и выдача содержимого файлов. Файл режется на чанки фиксированного размера
+UPLOAD_CHUNK_SIZE, каждый чанк кладётся в blob_store по SHA-256 и учитывается в blobs.ref_count,
+так что одинаковые jar/моды на разных серверах хранятся один раз.
+
+Протокол: upload_start создаёт сессию, upload_chunk принимает чанк по смещению (повтор и параллельная
+отправка безопасны), upload_status отдаёт недостающие смещения для докачки,
+upload_complete проверяет полноту и SHA-256 и превращает сессию в строку server_files.
+Выдача читает только чанки, пересекающие запрошенный Range.
+Файл по одному заявленному sha256 без передачи байт не создаётся: хеш - не доказательство
+владения содержимым. Повторно не пишутся сами чанки, которые уже есть в blobs.
+'''
+import hashlib
+import os
+from typing import Dict, Any, List, Optional, Tuple
+
+from blob_store import get_store
+
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', str(2 * 1024 * 1024)))
+DOWNLOAD_MAX_BYTES = int(os.environ.get('DOWNLOAD_MAX_BYTES', str(2 * 1024 * 1024)))
+MISSING_OFFSETS_LIMIT = 100
+
+
+class UploadError(ValueError):
+    def __init__(self, status_code: int, message: str) -> None:
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def chunk_count(size_bytes: int, chunk_size: int) -> int:
+    return (size_bytes + chunk_size - 1) // chunk_size
+
+
+def release_file_chunks(cursor: Any, file_ids: List[Any]) -> None:
+    '''
+    Снимает ссылки удаляемых файлов на чанки. Вызывать до DELETE из server_files.
+    Сами байты удаляет сборщик мусора по blobs.ref_count = 0.
+    '''
+    cursor.execute('''
+        WITH removed AS (
+            DELETE FROM server_file_chunks WHERE file_id = ANY(%s::integer[]) RETURNING blob_sha256
+        )
+        UPDATE blobs b SET ref_count = b.ref_count - r.refs
+        FROM (SELECT blob_sha256, COUNT(*) AS refs FROM removed GROUP BY blob_sha256) r
+        WHERE b.sha256 = r.blob_sha256
+    ''', (file_ids,))
+
+
+def session_progress(cursor: Any, session: Dict[str, Any]) -> Dict[str, Any]:
+    cursor.execute(
+        'SELECT chunk_index, size_bytes FROM upload_session_chunks WHERE upload_id = %s ORDER BY chunk_index',
+        (session['id'],)
+    )
+    received = cursor.fetchall()
+    received_indexes = {row['chunk_index'] for row in received}
+    missing = [
+        index * session['chunk_size']
+        for index in range(chunk_count(session['size_bytes'], session['chunk_size']))
+        if index not in received_indexes
+    ]
+    return {
+        'upload_id': session['id'],
+        'size_bytes': session['size_bytes'],
+        'chunk_size': session['chunk_size'],
+        'received_bytes': sum(row['size_bytes'] for row in received),
+        'next_offset': missing[0] if missing else None,
+        'missing_offsets': missing[:MISSING_OFFSETS_LIMIT],
+        'complete': not missing
+    }
+
+
+def find_session(cursor: Any, upload_id: Any, lock: bool = False) -> Dict[str, Any]:
+    cursor.execute(
+        'SELECT * FROM upload_sessions WHERE id = %s' + (' FOR UPDATE' if lock else ''),
+        (str(upload_id),)
+    )
+    session = cursor.fetchone()
+    if not session:
+        raise UploadError(404, 'Upload session not found')
+    return session
+
+
+def start_upload(cursor: Any, server_id: Any, file_path: str, file_name: str, file_type: str,
+                 size_bytes: int, expected_sha256: Optional[str]) -> Dict[str, Any]:
+    import uuid
+
+    upload_id = str(uuid.uuid4())
+    cursor.execute('''
+        INSERT INTO upload_sessions
+        (id, server_id, file_path, file_name, file_type, size_bytes, chunk_size, expected_sha256)
+        VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        RETURNING *
+    ''', (upload_id, server_id, file_path, file_name, file_type, size_bytes, UPLOAD_CHUNK_SIZE, expected_sha256))
+    return session_progress(cursor, cursor.fetchone())
+
+
+def put_chunk(cursor: Any, upload_id: Any, offset: int, data: bytes) -> Dict[str, Any]:
+    '''
+    Принимает чанк по смещению, кратному chunk_size. Байты пишутся в хранилище, только если
+    у блоба не было ссылок (новый или ждёт сборщика мусора); повтор того же чанка ничего не меняет.
+    '''
+    session = find_session(cursor, upload_id)
+    chunk_size = session['chunk_size']
+    if offset < 0 or offset % chunk_size or offset >= max(session['size_bytes'], 1):
+        raise UploadError(416, 'Offset must be a multiple of %d below %d' % (chunk_size, session['size_bytes']))
+    expected_length = min(chunk_size, session['size_bytes'] - offset)
+    if len(data) != expected_length:
+        raise UploadError(400, 'Chunk at offset %d must be %d bytes, got %d' % (offset, expected_length, len(data)))
+
+    chunk_index = offset // chunk_size
+    sha256 = hashlib.sha256(data).hexdigest()
+    cursor.execute('''
+        SELECT blob_sha256 FROM upload_session_chunks
+        WHERE upload_id = %s AND chunk_index = %s
+        FOR UPDATE
+    ''', (session['id'], chunk_index))
+    previous = cursor.fetchone()
+    if previous and previous['blob_sha256'] == sha256:
+        return session_progress(cursor, session)
+
+    cursor.execute('''
+        INSERT INTO blobs (sha256, size_bytes, ref_count) VALUES (%s, %s, 1)
+        ON CONFLICT (sha256) DO UPDATE SET ref_count = blobs.ref_count + 1
+        RETURNING ref_count
+    ''', (sha256, len(data)))
+    if cursor.fetchone()['ref_count'] == 1:
+        get_store().put(sha256, data)
+    if previous:
+        cursor.execute('UPDATE blobs SET ref_count = ref_count - 1 WHERE sha256 = %s', (previous['blob_sha256'],))
+    cursor.execute('''
+        INSERT INTO upload_session_chunks (upload_id, chunk_index, size_bytes, blob_sha256)
+        VALUES (%s, %s, %s, %s)
+        ON CONFLICT (upload_id, chunk_index) DO UPDATE
+        SET size_bytes = EXCLUDED.size_bytes, blob_sha256 = EXCLUDED.blob_sha256
+    ''', (session['id'], chunk_index, len(data), sha256))
+    cursor.execute('UPDATE upload_sessions SET updated_at = CURRENT_TIMESTAMP WHERE id = %s', (session['id'],))
+    return session_progress(cursor, session)
+
+
+def complete_upload(cursor: Any, upload_id: Any) -> Tuple[Dict[str, Any], List[Tuple[int, int, int, str]]]:
+    '''
+    Проверяет, что получены все чанки и совпал SHA-256 всего файла.
+    Возвращает сессию и чанки (index, offset, size, sha256) для привязки к новому файлу.
+    '''
+    session = find_session(cursor, upload_id, lock=True)
+    progress = session_progress(cursor, session)
+    if not progress['complete']:
+        raise UploadError(409, 'Upload is incomplete, next offset %s' % progress['next_offset'])
+
+    cursor.execute('''
+        SELECT chunk_index, size_bytes, blob_sha256 FROM upload_session_chunks
+        WHERE upload_id = %s ORDER BY chunk_index
+    ''', (session['id'],))
+    chunks = [
+        (row['chunk_index'], row['chunk_index'] * session['chunk_size'], row['size_bytes'], row['blob_sha256'])
+        for row in cursor.fetchall()
+    ]
+    digest = hashlib.sha256()
+    store = get_store()
+    for _, _, _, sha256 in chunks:
+        digest.update(store.read(sha256))
+    session['content_sha256'] = digest.hexdigest()
+    if session['expected_sha256'] and session['expected_sha256'] != session['content_sha256']:
+        raise UploadError(422, 'SHA-256 mismatch: expected %s, got %s' % (session['expected_sha256'], session['content_sha256']))
+    return session, chunks
+
+
+def attach_chunks(cursor: Any, file_id: int, upload_id: str, chunks: List[Tuple[int, int, int, str]]) -> None:
+    '''
+    Переносит ссылки сессии на файл (ref_count не меняется) и удаляет сессию.
+    '''
+    from psycopg2.extras import execute_values
+
+    if chunks:
+        execute_values(cursor, '''
+            INSERT INTO server_file_chunks (file_id, chunk_index, offset_bytes, size_bytes, blob_sha256)
+            VALUES %s
+        ''', [(file_id,) + chunk for chunk in chunks], page_size=len(chunks))
+    cursor.execute('DELETE FROM upload_sessions WHERE id = %s', (upload_id,))
+
+
+def abort_upload(cursor: Any, upload_id: Any) -> None:
+    session = find_session(cursor, upload_id, lock=True)
+    cursor.execute('''
+        WITH removed AS (
+            DELETE FROM upload_session_chunks WHERE upload_id = %s RETURNING blob_sha256
+        )
+        UPDATE blobs b SET ref_count = b.ref_count - r.refs
+        FROM (SELECT blob_sha256, COUNT(*) AS refs FROM removed GROUP BY blob_sha256) r
+        WHERE b.sha256 = r.blob_sha256
+    ''', (session['id'],))
+    cursor.execute('DELETE FROM upload_sessions WHERE id = %s', (session['id'],))
+
+
+def parse_range(header: Optional[str], size_bytes: int) -> Optional[Tuple[int, int]]:
+    '''
+    Разбирает 'bytes=start-end', 'bytes=start-' и 'bytes=-suffix' (только первый диапазон).
+    Возвращает включительные границы или None без заголовка; за пределами файла - UploadError 416.
+    '''
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec:
+        raise UploadError(416, 'Only byte ranges are supported')
+    first, _, last = spec.split(',')[0].strip().partition('-')
+    try:
+        if first:
+            start = int(first)
+            end = int(last) if last else size_bytes - 1
+        else:
+            start = max(0, size_bytes - int(last))
+            end = size_bytes - 1
+    except ValueError:
+        raise UploadError(416, 'Invalid Range header')
+    if start > end or start >= size_bytes:
+        raise UploadError(416, 'Range not satisfiable')
+    return start, min(end, size_bytes - 1)
+
+
+def read_range(cursor: Any, file_id: Any, start: int, end: int) -> bytes:
+    '''
+    Байты [start, end] файла: читаются только пересекающиеся чанки и только нужные их части.
+    '''
+    cursor.execute('''
+        SELECT offset_bytes, size_bytes, blob_sha256 FROM server_file_chunks
+        WHERE file_id = %s AND offset_bytes <= %s AND offset_bytes + size_bytes > %s
+        ORDER BY chunk_index
+    ''', (file_id, end, start))
+    store = get_store()
+    parts = []
+    for chunk in cursor.fetchall():
+        chunk_start = max(start, chunk['offset_bytes'])
+        chunk_end = min(end, chunk['offset_bytes'] + chunk['size_bytes'] - 1)
+        parts.append(store.read(chunk['blob_sha256'], chunk_start - chunk['offset_bytes'], chunk_end - chunk_start + 1))
+    return b''.join(parts)
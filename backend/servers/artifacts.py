@@ -0,0 +1,311 @@
+'''
+Кэш jar-артефактов серверов на узле воркера, общий для всех серверов и процессов узла.
+
+Содержимое лежит по SHA-256 (blobs/ab/abcd...), а refs/<flavour>/<version> указывает на хэш,
+поэтому одинаковые jar разных ключей хранятся один раз. Промах скачивается один раз
+на ключ: потоки процесса ждут на замке ключа, процессы узла - на flock файла ключа,
+и после замка кэш проверяется снова. Скачанное сверяется с SHA-256 апстрима (если он его
+публикует) и кладётся только для чтения. В каталог сервера jar попадает жёсткой ссылкой,
+если не вышло - reflink (FICLONE), и только потом копией. Размер кэша ограничен
+ARTIFACT_CACHE_MAX_BYTES: после каждого скачивания вытесняются давно не использованные
+блобы (время использования - mtime, его обновляет каждое попадание). Ссылки в каталогах
+серверов вытеснение не ломает - у них свой счётчик ссылок на inode.
+
+ARTIFACT_UPSTREAM_URL выбирает апстрим:
+  file:///путь - локальный каталог <путь>/<flavour>/<version>.jar (+ .jar.sha256), для тестов;
+  http(s)://...{flavour}...{version}... - шаблон URL, контрольная сумма - по тому же URL + .sha256.
+'''
+import errno
+import hashlib
+import os
+import re
+import shutil
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Dict, Iterator, Optional, Tuple
+
+ARTIFACT_CACHE_DIR = os.environ.get('ARTIFACT_CACHE_DIR', '/tmp/minecraft-artifacts')
+ARTIFACT_CACHE_MAX_BYTES = int(os.environ.get('ARTIFACT_CACHE_MAX_BYTES', str(10 * 1024 ** 3)))
+ARTIFACT_UPSTREAM_URL = os.environ.get('ARTIFACT_UPSTREAM_URL', '')
+ARTIFACT_FETCH_TIMEOUT = float(os.environ.get('ARTIFACT_FETCH_TIMEOUT', '60'))
+DEFAULT_FLAVOUR = os.environ.get('ARTIFACT_FLAVOUR', 'vanilla')
+COPY_BUFFER = 1024 * 1024
+FICLONE = 0x40049409
+KEY_PART = re.compile(r'^[A-Za-z0-9][A-Za-z0-9._+-]{0,63}$')
+
+
+class ArtifactError(Exception):
+    pass
+
+
+class ArtifactNotFound(ArtifactError):
+    pass
+
+
+def check_key(flavour: str, version: str) -> None:
+    if not KEY_PART.match(flavour or '') or not KEY_PART.match(version or ''):
+        raise ArtifactError('Invalid artifact key %r/%r' % (flavour, version))
+
+
+def parse_checksum(text: str) -> Optional[str]:
+    '''Первое слово файла .sha256 (формат sha256sum) или None, если это не хэш.'''
+    words = text.split()
+    checksum = words[0].lower() if words else ''
+    return checksum if re.match(r'^[0-9a-f]{64}$', checksum) else None
+
+
+class DirectoryFetcher:
+    def __init__(self, root: str) -> None:
+        self.root = root
+
+    def open(self, flavour: str, version: str) -> Tuple[BinaryIO, Optional[str]]:
+        path = os.path.join(self.root, flavour, version + '.jar')
+        checksum = None
+        if os.path.exists(path + '.sha256'):
+            with open(path + '.sha256') as checksum_file:
+                checksum = parse_checksum(checksum_file.read())
+        try:
+            return open(path, 'rb'), checksum
+        except FileNotFoundError:
+            raise ArtifactNotFound('No artifact %s/%s in %s' % (flavour, version, self.root))
+
+
+class HttpFetcher:
+    def __init__(self, template: str) -> None:
+        self.template = template
+
+    def open(self, flavour: str, version: str) -> Tuple[BinaryIO, Optional[str]]:
+        from urllib.error import HTTPError
+        from urllib.request import urlopen
+
+        url = self.template.format(flavour=flavour, version=version)
+        try:
+            with urlopen(url + '.sha256', timeout=ARTIFACT_FETCH_TIMEOUT) as response:
+                checksum = parse_checksum(response.read(256).decode('ascii', 'replace'))
+        except HTTPError as exc:
+            if exc.code != 404:
+                raise ArtifactError('Failed to fetch checksum for %s: %s' % (url, exc))
+            checksum = None
+        try:
+            return urlopen(url, timeout=ARTIFACT_FETCH_TIMEOUT), checksum
+        except HTTPError as exc:
+            if exc.code == 404:
+                raise ArtifactNotFound('No artifact %s/%s at %s' % (flavour, version, url))
+            raise ArtifactError('Failed to fetch %s: %s' % (url, exc))
+
+
+@contextmanager
+def file_lock(path: str, blocking: bool = True) -> Iterator[bool]:
+    import fcntl
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def reflink(source: str, target: str) -> None:
+    import fcntl
+
+    with open(source, 'rb') as source_file, open(target, 'wb') as target_file:
+        fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
+
+
+def link_or_copy(source: str, target: str) -> str:
+    '''
+    Атомарно кладёт source в target: жёсткая ссылка, иначе reflink, иначе копия.
+    Возвращает использованный способ.
+    '''
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    temp_path = '%s.%s.tmp' % (target, uuid.uuid4().hex)
+    try:
+        try:
+            os.link(source, temp_path)
+            method = 'hardlink'
+        except OSError:
+            try:
+                reflink(source, temp_path)
+                method = 'reflink'
+            except OSError:
+                shutil.copyfile(source, temp_path)
+                method = 'copy'
+        os.replace(temp_path, target)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return method
+
+
+class ArtifactCache:
+    def __init__(self, root: str, fetcher: Any, max_bytes: int = ARTIFACT_CACHE_MAX_BYTES) -> None:
+        self.root = root
+        self.fetcher = fetcher
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._key_locks: Dict[str, threading.Lock] = {}
+        self._stats = {'hits': 0, 'misses': 0, 'fetches': 0, 'fetched_bytes': 0, 'evictions': 0,
+                       'evicted_bytes': 0, 'hardlink': 0, 'reflink': 0, 'copy': 0}
+
+    def blob_path(self, sha256: str) -> str:
+        return os.path.join(self.root, 'blobs', sha256[:2], sha256)
+
+    def ref_path(self, flavour: str, version: str) -> str:
+        return os.path.join(self.root, 'refs', flavour, version)
+
+    def count(self, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self._stats[name] += amount
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self._stats)
+
+    def lookup(self, flavour: str, version: str) -> Optional[str]:
+        ref_path = self.ref_path(flavour, version)
+        try:
+            with open(ref_path) as ref:
+                path = self.blob_path(ref.read().strip())
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+        except PermissionError:
+            # блоб только для чтения другого владельца: он есть, время для LRU не обновить
+            pass
+        return path
+
+    def key_lock(self, key: str) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def get(self, flavour: str, version: str) -> str:
+        '''Путь к блобу артефакта; при промахе скачивает его ровно один раз на узел.'''
+        check_key(flavour, version)
+        path = self.lookup(flavour, version)
+        if path:
+            self.count('hits')
+            return path
+        key = flavour + '/' + version
+        with self.key_lock(key):
+            with file_lock(os.path.join(self.root, 'locks', flavour + '--' + version + '.lock')):
+                path = self.lookup(flavour, version)
+                if path:
+                    self.count('hits')
+                    return path
+                self.count('misses')
+                path = self.fetch(flavour, version)
+        self.evict(keep=path)
+        return path
+
+    def fetch(self, flavour: str, version: str) -> str:
+        stream, expected = self.fetcher.open(flavour, version)
+        temp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(temp_dir, exist_ok=True)
+        temp_path = os.path.join(temp_dir, uuid.uuid4().hex)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with stream, open(temp_path, 'wb') as output:
+                for block in iter(lambda: stream.read(COPY_BUFFER), b''):
+                    digest.update(block)
+                    output.write(block)
+                    size += len(block)
+            sha256 = digest.hexdigest()
+            if expected and sha256 != expected:
+                raise ArtifactError('Checksum mismatch for %s/%s: expected %s, got %s' % (
+                    flavour, version, expected, sha256))
+            os.chmod(temp_path, 0o444)
+            path = self.blob_path(sha256)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+        ref_path = self.ref_path(flavour, version)
+        os.makedirs(os.path.dirname(ref_path), exist_ok=True)
+        temp_ref = '%s.%s.tmp' % (ref_path, uuid.uuid4().hex)
+        with open(temp_ref, 'w') as ref:
+            ref.write(sha256)
+        os.replace(temp_ref, ref_path)
+        self.count('fetches')
+        self.count('fetched_bytes', size)
+        return path
+
+    def materialize(self, flavour: str, version: str, target: str) -> str:
+        '''Кладёт jar в target и возвращает способ (hardlink/reflink/copy).'''
+        try:
+            method = link_or_copy(self.get(flavour, version), target)
+        except FileNotFoundError:
+            method = link_or_copy(self.get(flavour, version), target)
+        self.count(method)
+        return method
+
+    def evict(self, keep: Optional[str] = None) -> int:
+        '''
+        Удаляет самые давно использованные блобы, пока кэш не влезет в max_bytes.
+        Одновременно вытесняет один процесс узла, остальные пропускают. Возвращает освобождённые байты.
+        '''
+        with file_lock(os.path.join(self.root, 'locks', 'evict.lock'), blocking=False) as locked:
+            if not locked:
+                return 0
+            blobs = []
+            total = 0
+            for directory, _, names in os.walk(os.path.join(self.root, 'blobs')):
+                for name in names:
+                    path = os.path.join(directory, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    blobs.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+            freed = 0
+            for _, size, path in sorted(blobs):
+                if total - freed <= self.max_bytes:
+                    break
+                if path == keep:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError as exc:
+                    if exc.errno != errno.ENOENT:
+                        raise
+                    continue
+                freed += size
+                self.count('evictions')
+                self.count('evicted_bytes', size)
+            return freed
+
+
+_cache_lock = threading.Lock()
+_cache: Any = None
+
+
+def make_fetcher(url: str) -> Any:
+    from urllib.parse import urlparse
+
+    parsed = urlparse(url)
+    if parsed.scheme == 'file':
+        return DirectoryFetcher(parsed.path)
+    if parsed.scheme in ('http', 'https'):
+        return HttpFetcher(url)
+    raise ArtifactError('ARTIFACT_UPSTREAM_URL must be file://, http:// or https://')
+
+
+def get_cache() -> ArtifactCache:
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ArtifactCache(ARTIFACT_CACHE_DIR, make_fetcher(ARTIFACT_UPSTREAM_URL))
+        return _cache
@@ -0,0 +1,88 @@
+'''
+Лента изменений статусов серверов: триггер пишет строки в server_status_changes
+и шлёт NOTIFY server_status, а long-poll ждёт уведомления и отдаёт только дельты.
+
+Курсор ленты - xmin снимка транзакций (txid_snapshot_xmin). Все транзакции с txid
+ниже него уже завершены, поэтому строки с txid < курсора видны целиком и навсегда,
+и клиент не пропустит изменение, закоммиченное позже соседнего по порядку.
+'''
+import select
+import time
+from typing import Dict, Any, List, Tuple
+
+CHANNEL = 'server_status'
+MAX_WAIT_SECONDS = 25
+MAX_CHANGES = 1000
+
+
+def current_cursor(cursor: Any) -> int:
+    cursor.execute('SELECT txid_snapshot_xmin(txid_current_snapshot()) AS xmin')
+    return int(cursor.fetchone()['xmin'])
+
+
+def read_changes(cursor: Any, since: int) -> Tuple[List[Dict[str, Any]], int]:
+    upto = current_cursor(cursor)
+    cursor.execute('''
+        SELECT seq, server_id, status, change_type, changed_at, txid
+        FROM server_status_changes
+        WHERE txid >= %s AND txid < %s
+        ORDER BY txid, seq
+        LIMIT %s
+    ''', (since, upto, MAX_CHANGES + 1))
+    rows = cursor.fetchall()
+    if len(rows) > MAX_CHANGES:
+        # Режем по границе транзакции, чтобы следующая страница начиналась с неё целиком
+        boundary = rows[MAX_CHANGES]['txid']
+        rows = [row for row in rows if row['txid'] < boundary]
+        upto = boundary
+        if not rows:
+            cursor.execute('''
+                SELECT seq, server_id, status, change_type, changed_at, txid
+                FROM server_status_changes WHERE txid = %s ORDER BY seq
+            ''', (boundary,))
+            rows = cursor.fetchall()
+            upto = boundary + 1
+    changes = [{
+        'seq': row['seq'],
+        'server_id': row['server_id'],
+        'status': row['status'],
+        'change': row['change_type'],
+        'changed_at': row['changed_at'].isoformat() if row['changed_at'] else None
+    } for row in rows]
+    return changes, upto
+
+
+def wait_for_changes(conn: Any, cursor: Any, since: int, timeout: float) -> Dict[str, Any]:
+    '''
+    Возвращает дельты после курсора since; если их нет - слушает канал до timeout секунд.
+    Соединение на время ожидания переводится в autocommit, иначе NOTIFY не доставляются;
+    UNLISTEN выполняется и при ошибке, чтобы соединение не вернулось в пул подписанным.
+    '''
+    changes, upto = read_changes(cursor, since)
+    conn.commit()
+    if changes or timeout <= 0:
+        return {'changes': changes, 'cursor': upto}
+
+    deadline = time.monotonic() + min(timeout, MAX_WAIT_SECONDS)
+    conn.autocommit = True
+    try:
+        cursor.execute('LISTEN ' + CHANNEL)
+        try:
+            while not changes:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                if select.select([conn], [], [], remaining) == ([], [], []):
+                    continue
+                conn.poll()
+                if not conn.notifies:
+                    continue
+                del conn.notifies[:]
+                changes, upto = read_changes(cursor, since)
+        finally:
+            if not conn.closed:
+                cursor.execute('UNLISTEN ' + CHANNEL)
+                del conn.notifies[:]
+    finally:
+        conn.autocommit = False
+    return {'changes': changes, 'cursor': upto}
@@ -0,0 +1,117 @@
+'''
+Клонирование сервера одной транзакцией: строка minecraft_servers, дерево server_directories,
+server_files с их чанками, server_databases и server_storage_totals копируются
+INSERT ... SELECT без выгрузки строк в Python, так что число запросов не зависит
+от числа файлов. Содержимое файлов не копируется: новые server_file_chunks ссылаются
+на те же блобы, а blobs.ref_count увеличивается (copy-on-write - изменённый файл
+в клоне получит новые чанки, у источника останутся старые).
+Базы данных копируются как записи server_databases в статусе pending с нулевым размером:
+пустые базы клона (с теми же db_name) создаёт периодическое задание функции databases,
+данные баз источника не копируются. Клон создаётся остановленным на хосте источника
+(или на указанном host) и, как новый сервер, получает резерв мощности только при старте.
+'''
+from typing import Dict, Any, Optional
+
+from ports import allocate_ports, bind_ports, reserve_port
+
+SERVER_COLUMNS = 'id, server_name, version, host, port, max_players, gamemode, difficulty, status, created_at'
+
+
+class SourceNotFound(LookupError):
+    pass
+
+
+def clone_server(cursor: Any, source_id: Any, server_name: Optional[str], host: Optional[str],
+                 port: Optional[int]) -> Dict[str, Any]:
+    '''
+    Возвращает новую строку сервера и число скопированных файлов и баз.
+    Строка источника блокируется FOR SHARE, чтобы его не удалили посреди копирования;
+    файлы с чанками и ссылки на блобы копируются одним оператором из одного снимка данных.
+    '''
+    cursor.execute(
+        'SELECT id, host FROM minecraft_servers WHERE id = %s AND deleted_at IS NULL FOR SHARE',
+        (source_id,)
+    )
+    source = cursor.fetchone()
+    if not source:
+        raise SourceNotFound('Source server not found')
+
+    host = host or source['host']
+    if port is not None:
+        reserve_port(cursor, host, port)
+    else:
+        port = allocate_ports(cursor, host, 1)[0]
+
+    cursor.execute('''
+        INSERT INTO minecraft_servers
+        (server_name, version, host, port, max_players, gamemode, difficulty, status)
+        SELECT COALESCE(%s, server_name || ' (копия)'), version, %s, %s, max_players, gamemode, difficulty, 'stopped'
+        FROM minecraft_servers WHERE id = %s
+        RETURNING ''' + SERVER_COLUMNS, (server_name, host, port, source['id']))
+    server = cursor.fetchone()
+    bind_ports(cursor, [server])
+    new_id = server['id']
+
+    cursor.execute('''
+        INSERT INTO server_directories (server_id, name, path, depth)
+        SELECT %s, name, path, depth FROM server_directories WHERE server_id = %s
+    ''', (new_id, source['id']))
+    cursor.execute('''
+        UPDATE server_directories child
+        SET parent_id = parent.id
+        FROM server_directories parent
+        WHERE child.server_id = %s
+          AND child.path <> '/'
+          AND parent.server_id = child.server_id
+          AND parent.path = regexp_replace(child.path, '[^/]+/$', '')
+    ''', (new_id,))
+
+    cursor.execute('''
+        WITH source_files AS (
+            SELECT f.*, nextval(pg_get_serial_sequence('server_files', 'id')) AS new_file_id
+            FROM server_files f
+            WHERE f.server_id = %(source)s
+        ), copied_files AS (
+            INSERT INTO server_files
+            (id, server_id, file_path, file_name, file_size_bytes, file_type, directory_id, content_sha256)
+            SELECT s.new_file_id, %(target)s, s.file_path, s.file_name, s.file_size_bytes, s.file_type,
+                   nd.id, s.content_sha256
+            FROM source_files s
+            LEFT JOIN server_directories od ON od.id = s.directory_id
+            LEFT JOIN server_directories nd ON nd.server_id = %(target)s AND nd.path = od.path
+            RETURNING id
+        ), copied_chunks AS (
+            INSERT INTO server_file_chunks (file_id, chunk_index, offset_bytes, size_bytes, blob_sha256)
+            SELECT s.new_file_id, c.chunk_index, c.offset_bytes, c.size_bytes, c.blob_sha256
+            FROM source_files s
+            JOIN server_file_chunks c ON c.file_id = s.id
+            RETURNING blob_sha256
+        ), shared_blobs AS (
+            UPDATE blobs b SET ref_count = b.ref_count + r.refs
+            FROM (SELECT blob_sha256, COUNT(*) AS refs FROM copied_chunks GROUP BY blob_sha256) r
+            WHERE b.sha256 = r.blob_sha256
+            RETURNING r.refs
+        )
+        SELECT (SELECT COUNT(*) FROM copied_files) AS file_count,
+               (SELECT COALESCE(SUM(refs), 0) FROM shared_blobs) AS chunk_count
+    ''', {'source': source['id'], 'target': new_id})
+    copied = cursor.fetchone()
+
+    cursor.execute('''
+        INSERT INTO server_databases (server_id, db_name, db_size_bytes, status)
+        SELECT %s, db_name, 0, 'pending' FROM server_databases WHERE server_id = %s AND status <> 'dropping'
+    ''', (new_id, source['id']))
+    database_count = cursor.rowcount
+
+    cursor.execute('''
+        INSERT INTO server_storage_totals (server_id, file_count, file_bytes, database_count, database_bytes)
+        SELECT %s, file_count, file_bytes, %s, 0
+        FROM server_storage_totals WHERE server_id = %s
+    ''', (new_id, database_count, source['id']))
+
+    return {
+        'server': server,
+        'file_count': copied['file_count'],
+        'shared_chunk_count': copied['chunk_count'],
+        'database_count': database_count
+    }
@@ -1,232 +1,700 @@
-import json
+import base64
 import os
-from typing import Dict, Any
-import psycopg2
-from psycopg2.extras import RealDictCursor
+from datetime import datetime
+from typing import TYPE_CHECKING, Dict, Any, List, Optional, Tuple
+from row_encoder import RowEncoder, compile_row_encoder, encode_rows, encode_value
+from runtime import App, Request, Route, error, respond, respond_encoded, tuple_cursor_class
+
+if TYPE_CHECKING:
+    from search import ServerFilter
+
+SERVER_FIELDS = ('id', 'server_name', 'version', 'host', 'port', 'max_players', 'gamemode', 'difficulty', 'status', 'created_at')
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+MAX_BATCH_SIZE = 1000
+MAX_JOBS_LIMIT = 100
+SERVER_RETURNING = 'RETURNING id, server_name, version, host, port, max_players, gamemode, difficulty, status, created_at'
+CACHED_TABLES = ['minecraft_servers']
+ROW_JSON_MODE = os.environ.get('ROW_JSON_MODE', 'python')
+
+_page_encoders: Dict[Tuple[str, ...], RowEncoder] = {}
+
+def encode_cursor(created_at: datetime, server_id: int) -> str:
+    raw = '{}|{}'.format(created_at.isoformat(), server_id)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+def decode_cursor(token: str) -> Tuple[datetime, int]:
+    raw = base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8')
+    created_at, server_id = raw.rsplit('|', 1)
+    return datetime.fromisoformat(created_at), int(server_id)
+
+def parse_fields(value: Optional[str]) -> List[str]:
+    if not value:
+        return list(SERVER_FIELDS)
+    requested = [field.strip() for field in value.split(',') if field.strip()]
+    unknown = [field for field in requested if field not in SERVER_FIELDS]
+    if unknown:
+        raise ValueError('Unknown fields: ' + ', '.join(unknown))
+    return [field for field in SERVER_FIELDS if field in requested]
+
+def parse_limit(value: Optional[str]) -> int:
+    if not value:
+        return DEFAULT_PAGE_SIZE
+    limit = int(value)
+    if limit < 1:
+        raise ValueError('limit must be positive')
+    return min(limit, MAX_PAGE_SIZE)
+
+def serialize_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {key: value.isoformat() if isinstance(value, datetime) else value for key, value in row.items()}
+
+def parse_port(value: Any) -> Optional[int]:
+    '''
+    None - порт выдаёт аллокатор (поле не передано или "auto").
+    '''
+    if value is None or value == '' or value == 'auto':
+        return None
+    port = int(value)
+    if not 1 <= port <= 65535:
+        raise ValueError('port must be between 1 and 65535')
+    return port
+
+def parse_ids(value: Optional[str]) -> List[int]:
+    return [int(item) for item in (value or '').split(',') if item.strip()]
+
+def batch_response(results: List[Dict[str, Any]], success_status: int) -> Dict[str, Any]:
+    failed = sum(1 for item in results if not item['ok'])
+    if failed == 0:
+        status_code = success_status
+    elif failed == len(results):
+        status_code = 400
+    else:
+        status_code = 207
+    return respond(status_code, {'results': results, 'succeeded': len(results) - failed, 'failed': failed})
+
+def batch_failed(results: List[Any], positions: List[int], error: str) -> None:
+    for index in positions:
+        results[index] = {'index': index, 'ok': False, 'error': error}
+
+def create_servers_batch(items: List[Any], conn: Any, cursor: Any) -> Dict[str, Any]:
+    import psycopg2
+    from psycopg2.extras import execute_values
+    from ports import DEFAULT_HOST, PortUnavailable, allocate_ports, bind_ports, reserve_port
+    
+    results: List[Any] = [None] * len(items)
+    rows = []
+    positions = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not item.get('server_name') or not item.get('version'):
+            results[index] = {'index': index, 'ok': False, 'error': 'Missing required fields'}
+            continue
+        try:
+            port = parse_port(item.get('port'))
+        except (TypeError, ValueError):
+            results[index] = {'index': index, 'ok': False, 'error': 'Invalid port'}
+            continue
+        try:
+            int(item.get('max_players', 20) or 0)
+        except (TypeError, ValueError):
+            results[index] = {'index': index, 'ok': False, 'error': 'Invalid max_players'}
+            continue
+        rows.append([
+            item['server_name'], item['version'], item.get('host') or DEFAULT_HOST, port,
+            item.get('max_players', 20), item.get('gamemode', 'survival'), item.get('difficulty', 'normal'),
+            'stopped'
+        ])
+        positions.append(index)
+    
+    if rows:
+        try:
+            valid_rows = []
+            valid_positions = []
+            auto_rows: Dict[str, List[List[Any]]] = {}
+            # Ручные порты блокируются в порядке (host, port), чтобы параллельные пакеты не сцеплялись
+            for index, row in sorted(zip(positions, rows), key=lambda pair: (pair[1][2], pair[1][3] or 0)):
+                if row[3] is not None:
+                    try:
+                        reserve_port(cursor, row[2], row[3])
+                    except PortUnavailable as exc:
+                        results[index] = {'index': index, 'ok': False, 'error': str(exc)}
+                        continue
+                else:
+                    auto_rows.setdefault(row[2], []).append(row)
+                valid_rows.append(row)
+                valid_positions.append(index)
+            for host, host_rows in sorted(auto_rows.items()):
+                for row, port in zip(host_rows, allocate_ports(cursor, host, len(host_rows))):
+                    row[3] = port
+            
+            created = []
+            if valid_rows:
+                created = execute_values(cursor, '''
+                    INSERT INTO minecraft_servers
+                    (server_name, version, host, port, max_players, gamemode, difficulty, status)
+                    VALUES %s
+                ''' + SERVER_RETURNING, [tuple(row) for row in valid_rows], page_size=len(valid_rows), fetch=True)
+                bind_ports(cursor, created)
+            conn.commit()
+            for index, server in zip(valid_positions, created):
+                results[index] = {'index': index, 'ok': True, 'item': serialize_row(server)}
+        except (psycopg2.Error, PortUnavailable) as exc:
+            conn.rollback()
+            batch_failed(results, positions, getattr(exc, 'pgerror', None) or str(exc))
+    
+    return batch_response(results, 201)
+
+def update_servers_batch(items: List[Any], conn: Any, cursor: Any) -> Dict[str, Any]:
+    import psycopg2
+    from psycopg2.extras import execute_values
+    import jobs
+    import lifecycle
+    import scheduler
+    
+    results: List[Any] = [None] * len(items)
+    rows = []
+    positions = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not item.get('id') or not item.get('status'):
+            results[index] = {'index': index, 'ok': False, 'error': 'Missing id or status'}
+            continue
+        if not isinstance(item['status'], str) or item['status'] not in lifecycle.TRANSITIONS:
+            results[index] = {'index': index, 'ok': False, 'error': 'Unknown status'}
+            continue
+        try:
+            rows.append((int(item['id']), item['status'], lifecycle.allowed_sources(item['status'])))
+        except (TypeError, ValueError):
+            results[index] = {'index': index, 'ok': False, 'error': 'Invalid id'}
+            continue
+        positions.append(index)
+    
+    if rows:
+        try:
+            starting = [row[0] for row in rows if row[1] == 'starting']
+            unplaced = set(scheduler.place_servers(cursor, starting, lifecycle.allowed_sources('starting')))
+            for index, row in zip(positions, rows):
+                if row[0] in unplaced and row[1] == 'starting':
+                    results[index] = {'index': index, 'ok': False, 'error': 'No host has capacity for this server'}
+            positions, rows = [index for index in positions if results[index] is None], [
+                row for row in rows if not (row[0] in unplaced and row[1] == 'starting')
+            ]
+            updated = execute_values(cursor, '''
+                UPDATE minecraft_servers AS s
+                SET status = v.status, updated_at = CURRENT_TIMESTAMP
+                FROM (VALUES %s) AS v(id, status, sources)
+                WHERE s.id = v.id AND s.status = ANY(v.sources)
+                RETURNING s.id, s.server_name, s.status
+            ''', rows, template='(%s::integer, %s, %s::varchar[])', page_size=len(rows), fetch=True) if rows else []
+            scheduler.release_capacity(cursor, [server['id'] for server in updated if server['status'] in scheduler.MOVABLE_STATUSES])
+            queued: Dict[int, Dict[str, Any]] = {}
+            for status, kind in jobs.JOB_KINDS.items():
+                queued.update(jobs.enqueue(cursor, [server['id'] for server in updated if server['status'] == status], kind))
+            conn.commit()
+            by_id = {server['id']: server for server in updated}
+            for index, row in zip(positions, rows):
+                server = by_id.get(row[0])
+                if server:
+                    item = serialize_row(server)
+                    if server['id'] in queued:
+                        item['job'] = queued[server['id']]
+                    results[index] = {'index': index, 'ok': True, 'item': item}
+                else:
+                    results[index] = {'index': index, 'ok': False, 'error': 'Server not found or invalid status transition'}
+        except psycopg2.Error as exc:
+            conn.rollback()
+            batch_failed(results, positions, exc.pgerror or str(exc))
+    
+    return batch_response(results, 200)
+
+def delete_servers_batch(server_ids: List[int], conn: Any, cursor: Any) -> Dict[str, Any]:
+    import psycopg2
+    from purge import soft_delete_servers
+    
+    results: List[Any] = [None] * len(server_ids)
+    try:
+        deleted = {server['id']: server for server in soft_delete_servers(cursor, server_ids)}
+        conn.commit()
+        for index, server_id in enumerate(server_ids):
+            server = deleted.get(server_id)
+            if server:
+                results[index] = {'index': index, 'ok': True, 'item': serialize_row(server)}
+            else:
+                results[index] = {'index': index, 'ok': False, 'error': 'Server not found'}
+    except psycopg2.Error as exc:
+        conn.rollback()
+        batch_failed(results, list(range(len(server_ids))), exc.pgerror or str(exc))
+    
+    return batch_response(results, 202)
+
+def batch_size_error() -> Dict[str, Any]:
+    return error(400, 'Batch must contain 1 to %d items' % MAX_BATCH_SIZE)
+
+def page_columns(fields: List[str]) -> List[str]:
+    return list(dict.fromkeys(fields + ['id', 'created_at']))
+
+def page_query(select_list: str, after: Optional[Tuple[datetime, int]], limit: int,
+               filters: 'ServerFilter') -> Tuple[str, List[Any]]:
+    import search
+    
+    sql = 'SELECT ' + select_list + ' FROM minecraft_servers WHERE deleted_at IS NULL ' + search.where_clause(filters)
+    params: List[Any] = list(filters.params)
+    if after:
+        sql += 'AND (created_at, id) < (%s, %s) '
+        params.extend(after)
+    sql += 'ORDER BY created_at DESC, id DESC LIMIT %s'
+    params.append(limit)
+    return sql, params
+
+def page_encoder(fields: List[str]) -> RowEncoder:
+    key = tuple(fields)
+    encoder = _page_encoders.get(key)
+    if encoder is None:
+        encoder = compile_row_encoder(fields, page_columns(fields))
+        _page_encoders[key] = encoder
+    return encoder
+
+def fetch_page_tuples(conn: Any, fields: List[str], after: Optional[Tuple[datetime, int]],
+                      limit: int, filters: 'ServerFilter') -> Tuple[str, Optional[Tuple[datetime, int]]]:
+    columns = page_columns(fields)
+    sql, params = page_query(', '.join(columns), after, limit + 1, filters)
+    with conn.cursor(cursor_factory=tuple_cursor_class()) as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    
+    last = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = (rows[-1][columns.index('created_at')], rows[-1][columns.index('id')])
+    return encode_rows(page_encoder(fields), rows), last
+
+def fetch_page_json(cursor: Any, fields: List[str], after: Optional[Tuple[datetime, int]],
+                    limit: int, filters: 'ServerFilter') -> Tuple[str, Optional[Tuple[datetime, int]]]:
+    '''
+    Страницу собирает Postgres через json_agg, в Python приходит одна строка с готовым JSON.
+    Ключи те же, что у кодировщика строк; created_at Postgres пишет без хвостовых нулей в долях секунды.
+    '''
+    columns = page_columns(fields)
+    inner_sql, inner_params = page_query(
+        ', '.join(columns) + ', row_number() OVER (ORDER BY created_at DESC, id DESC) AS row_no', after, limit + 1,
+        filters
+    )
+    pairs = ', '.join("'%s', page.%s" % (field, field) for field in fields)
+    cursor.execute(
+        'SELECT coalesce(json_agg(json_build_object(' + pairs + ') ORDER BY page.row_no) '
+        "FILTER (WHERE page.row_no <= %s), '[]')::text AS servers, "
+        'count(*) AS fetched, '
+        'max(page.created_at) FILTER (WHERE page.row_no = %s) AS last_created_at, '
+        'max(page.id) FILTER (WHERE page.row_no = %s) AS last_id '
+        'FROM (' + inner_sql + ') AS page',
+        [limit, limit, limit] + inner_params
+    )
+    page = cursor.fetchone()
+    
+    last = None
+    if page['fetched'] > limit:
+        last = (page['last_created_at'], page['last_id'])
+    return page['servers'], last
+
+def fetch_ranked_page(conn: Any, fields: List[str], after: Optional[Tuple[float, int]],
+                      limit: int, filters: 'ServerFilter') -> Tuple[str, Optional[str]]:
+    import search
+    
+    columns = page_columns(fields)
+    sql, params = search.ranked_query(', '.join(columns), filters, after, limit + 1)
+    with conn.cursor(cursor_factory=tuple_cursor_class()) as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = search.encode_rank_cursor(rows[-1][-1], rows[-1][columns.index('id')])
+    return encode_rows(page_encoder(fields), rows), next_cursor
+
+def list_servers(request: Request) -> Dict[str, Any]:
+    import search
+    
+    try:
+        fields = parse_fields(request.query.get('fields'))
+        limit = parse_limit(request.query.get('limit'))
+        filters = search.parse_filters(request.query)
+        if filters.query:
+            ranked_after = search.decode_rank_cursor(request.query['after']) if request.query.get('after') else None
+        else:
+            after = decode_cursor(request.query['after']) if request.query.get('after') else None
+    except (ValueError, TypeError) as exc:
+        return error(400, 'Invalid fields, limit, filter or after parameter', detail=str(exc))
+    
+    if filters.query:
+        servers_json, next_cursor = fetch_ranked_page(request.conn, fields, ranked_after, limit, filters)
+        return respond_encoded(200, '{"servers": ' + servers_json + ', "next_cursor": ' + encode_value(next_cursor) + '}')
+    
+    if ROW_JSON_MODE == 'postgres':
+        servers_json, last = fetch_page_json(request.cursor, fields, after, limit, filters)
+    else:
+        servers_json, last = fetch_page_tuples(request.conn, fields, after, limit, filters)
+    
+    next_cursor = encode_cursor(last[0], last[1]) if last else None
+    return respond_encoded(200, '{"servers": ' + servers_json + ', "next_cursor": ' + encode_value(next_cursor) + '}')
+
+def list_changes(request: Request) -> Dict[str, Any]:
+    import change_feed
+    
+    try:
+        timeout = float(request.query.get('timeout') or change_feed.MAX_WAIT_SECONDS)
+        if request.query.get('since'):
+            feed = change_feed.wait_for_changes(request.conn, request.cursor, int(request.query['since']), timeout)
+        else:
+            feed = {'changes': [], 'cursor': change_feed.current_cursor(request.cursor)}
+    except ValueError:
+        return error(400, 'Invalid since or timeout parameter')
+    
+    return respond(200, feed)
+
+def create_server(request: Request) -> Dict[str, Any]:
+    from ports import DEFAULT_HOST, PortUnavailable, allocate_ports, bind_ports, reserve_port
+    
+    body_data = request.body()
+    
+    if isinstance(body_data, list):
+        if not body_data or len(body_data) > MAX_BATCH_SIZE:
+            return batch_size_error()
+        return create_servers_batch(body_data, request.conn, request.cursor)
+    
+    import psycopg2.errors
+    
+    server_name = body_data.get('server_name')
+    version = body_data.get('version')
+    max_players = body_data.get('max_players', 20)
+    gamemode = body_data.get('gamemode', 'survival')
+    difficulty = body_data.get('difficulty', 'normal')
+    
+    if not server_name or not version:
+        return error(400, 'Missing required fields')
+    
+    try:
+        port = parse_port(body_data.get('port'))
+        int(max_players or 0)
+    except (TypeError, ValueError):
+        return error(400, 'Invalid port or max_players')
+    
+    host = body_data.get('host') or DEFAULT_HOST
+    cursor = request.cursor
+    try:
+        if port is not None:
+            reserve_port(cursor, host, port)
+        else:
+            port = allocate_ports(cursor, host, 1)[0]
+        cursor.execute('''
+            INSERT INTO minecraft_servers 
+            (server_name, version, host, port, max_players, gamemode, difficulty, status)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+        ''' + SERVER_RETURNING, (server_name, version, host, port, max_players, gamemode, difficulty, 'stopped'))
+    except PortUnavailable as exc:
+        request.conn.rollback()
+        return error(409, str(exc))
+    except psycopg2.errors.UniqueViolation:
+        request.conn.rollback()
+        return error(409, 'Port %d is already in use on host %s' % (port, host))
+    
+    new_server = cursor.fetchone()
+    bind_ports(cursor, [new_server])
+    request.conn.commit()
+    
+    return respond(201, serialize_row(new_server))
+
+def update_server(request: Request) -> Dict[str, Any]:
+    import jobs
+    import lifecycle
+    
+    body_data = request.body()
+    
+    if isinstance(body_data, list):
+        if not body_data or len(body_data) > MAX_BATCH_SIZE:
+            return batch_size_error()
+        return update_servers_batch(body_data, request.conn, request.cursor)
+    
+    server_id = body_data.get('id')
+    new_status = body_data.get('status')
+    
+    if not server_id or not new_status:
+        return error(400, 'Missing id or status')
+    if not str(server_id).isdigit():
+        return error(400, 'Invalid id')
+    
+    cursor = request.cursor
+    idempotency_key = request.header('Idempotency-Key') or body_data.get('idempotency_key')
+    if idempotency_key:
+        stored = lifecycle.claim_idempotency_key(cursor, idempotency_key, lifecycle.request_hash(body_data))
+        if stored:
+            request.conn.rollback()
+            return respond(stored[0], stored[1], {'Idempotent-Replayed': 'true'})
+    
+    status_code, result = lifecycle.transition(cursor, int(server_id), new_status, body_data.get('expected_status'))
+    if status_code == 200 and new_status in jobs.JOB_KINDS:
+        result['job'] = jobs.enqueue(cursor, [result['id']], jobs.JOB_KINDS[new_status]).get(result['id'])
+    
+    if idempotency_key:
+        lifecycle.store_idempotent_result(cursor, idempotency_key, status_code, result)
+    request.conn.commit()
+    
+    return respond(status_code, result)
+
+def delete_server(request: Request) -> Dict[str, Any]:
+    from purge import read_purge, soft_delete_servers
+    
+    if request.query.get('ids'):
+        try:
+            server_ids = parse_ids(request.query['ids'])
+        except ValueError:
+            server_ids = []
+        if not server_ids or len(server_ids) > MAX_BATCH_SIZE:
+            return batch_size_error()
+        return delete_servers_batch(server_ids, request.conn, request.cursor)
+    
+    server_id = request.query.get('id')
+    
+    if not server_id:
+        return error(400, 'Missing server id')
+    
+    try:
+        servers = soft_delete_servers(request.cursor, [int(server_id)])
+    except ValueError:
+        return error(400, 'Invalid server id')
+    
+    if not servers:
+        return error(404, 'Server not found')
+    
+    request.conn.commit()
+    
+    return respond(202, {
+        'message': 'Server deletion scheduled',
+        'server_name': servers[0]['server_name'],
+        'purge': read_purge(request.cursor, servers[0]['id'])
+    })
+
+def purge_status(request: Request) -> Dict[str, Any]:
+    from purge import read_purge
+    
+    server_id = request.query.get('id')
+    
+    if not server_id:
+        return error(400, 'Missing server id')
+    
+    if not server_id.isdigit():
+        return error(400, 'Invalid server id')
+    
+    purge = read_purge(request.cursor, int(server_id))
+    
+    if not purge:
+        return error(404, 'Purge not found')
+    
+    return respond(200, purge)
+
+def purge_step(request: Request) -> Dict[str, Any]:
+    from purge import run_purges
+    
+    return respond(200, run_purges(request.conn, request.cursor))
+
+def ingest_metrics(request: Request) -> Dict[str, Any]:
+    import psycopg2
+    import lifecycle
+    import metrics
+    
+    body_data = request.body()
+    items = body_data.get('samples') if isinstance(body_data, dict) else body_data
+    
+    if not isinstance(items, list) or not items or len(items) > metrics.METRICS_MAX_BATCH:
+        return error(400, 'Batch must contain 1 to %d samples' % metrics.METRICS_MAX_BATCH)
+    
+    samples, rejected = metrics.parse_samples(items)
+    if not samples:
+        return respond(400, {'accepted': 0, 'rejected': len(rejected), 'errors': rejected[:metrics.MAX_REPORTED_ERRORS]})
+    
+    cursor = request.cursor
+    try:
+        metrics.ensure_partitions(request.conn, cursor, {sample[1].date() for _, sample in samples})
+    except psycopg2.Error as exc:
+        request.conn.rollback()
+        return error(503, 'Metrics partitions are being maintained, retry later', detail=exc.pgerror or str(exc))
+    
+    idempotency_key = request.header('Idempotency-Key')
+    if idempotency_key:
+        stored = lifecycle.claim_idempotency_key(cursor, idempotency_key, lifecycle.request_hash(items))
+        if stored:
+            request.conn.rollback()
+            return respond(stored[0], stored[1], {'Idempotent-Replayed': 'true'})
+    
+    result = metrics.ingest(cursor, samples, rejected)
+    status_code = 202 if not result['rejected'] else 207 if result['accepted'] else 400
+    
+    if idempotency_key:
+        lifecycle.store_idempotent_result(cursor, idempotency_key, status_code, result)
+    request.conn.commit()
+    
+    return respond(status_code, result)
+
+def metrics_series(request: Request) -> Dict[str, Any]:
+    import metrics
+    
+    server_id = request.query.get('id')
+    
+    if not server_id or not server_id.isdigit():
+        return error(400, 'Missing or invalid server id')
+    
+    try:
+        start_at, end_at, resolution = metrics.parse_window(
+            request.query.get('from'), request.query.get('to'), request.query.get('resolution')
+        )
+    except (TypeError, ValueError) as exc:
+        return error(400, str(exc))
+    
+    return respond(200, metrics.read_series(request.cursor, int(server_id), start_at, end_at, resolution))
+
+def list_jobs(request: Request) -> Dict[str, Any]:
+    import jobs
+    
+    if request.query.get('job_id'):
+        if not request.query['job_id'].isdigit():
+            return error(400, 'Invalid job_id')
+        job = jobs.read_job(request.cursor, request.query['job_id'])
+        if not job:
+            return error(404, 'Job not found')
+        return respond(200, job)
+    
+    server_id = request.query.get('id')
+    if not server_id or not server_id.isdigit():
+        return error(400, 'Missing or invalid id')
+    try:
+        limit = min(int(request.query.get('limit') or 20), MAX_JOBS_LIMIT)
+    except ValueError:
+        return error(400, 'Invalid limit')
+    return respond(200, {'jobs': jobs.read_jobs(request.cursor, server_id, limit)})
+
+def list_hosts(request: Request) -> Dict[str, Any]:
+    import scheduler
+    
+    return respond(200, {'hosts': scheduler.list_hosts(request.cursor)})
+
+def save_host(request: Request) -> Dict[str, Any]:
+    import scheduler
+    from ports import DEFAULT_PORT_RANGE, add_port_range
+    
+    body_data = request.body()
+    
+    if not isinstance(body_data, dict) or not body_data.get('name'):
+        return error(400, 'Missing host name')
+    
+    try:
+        memory_mb = int(body_data['memory_mb'])
+        cpu_millis = int(body_data['cpu_millis'])
+        first_port, last_port = (int(port) for port in body_data.get('port_range') or DEFAULT_PORT_RANGE)
+    except (KeyError, TypeError, ValueError):
+        return error(400, 'memory_mb, cpu_millis and an optional [first, last] port_range are required')
+    
+    if memory_mb <= 0 or cpu_millis <= 0 or not 1 <= first_port <= last_port <= 65535:
+        return error(400, 'Capacity must be positive and the port range within 1-65535')
+    
+    host = scheduler.save_host(request.cursor, body_data['name'], memory_mb, cpu_millis)
+    host['ports_added'] = add_port_range(request.cursor, body_data['name'], first_port, last_port)
+    request.conn.commit()
+    
+    return respond(201, host)
+
+def update_host(request: Request) -> Dict[str, Any]:
+    import scheduler
+    
+    body_data = request.body()
+    
+    if not isinstance(body_data, dict) or not body_data.get('name') or body_data.get('status') not in scheduler.HOST_STATUSES:
+        return error(400, 'Missing host name or status', allowed=list(scheduler.HOST_STATUSES))
+    
+    host = scheduler.set_host_status(request.cursor, body_data['name'], body_data['status'])
+    
+    if not host:
+        return error(404, 'Host not found')
+    
+    if host['status'] == 'draining':
+        host['rebalance'] = scheduler.rebalance(request.cursor, MAX_BATCH_SIZE, host['name'])
+    request.conn.commit()
+    
+    return respond(200, host)
+
+def rebalance(request: Request) -> Dict[str, Any]:
+    import scheduler
+    
+    result = scheduler.rebalance(request.cursor, MAX_BATCH_SIZE)
+    request.conn.commit()
+    
+    return respond(200, result)
+
+def clone(request: Request) -> Dict[str, Any]:
+    from cloning import SourceNotFound, clone_server
+    from ports import PortUnavailable
+    
+    body_data = request.body()
+    
+    if not isinstance(body_data, dict) or not body_data.get('source_id'):
+        return error(400, 'Missing source_id')
+    
+    import psycopg2.errors
+    
+    try:
+        source_id = int(body_data['source_id'])
+    except (TypeError, ValueError):
+        return error(400, 'Invalid source_id')
+    
+    try:
+        port = parse_port(body_data.get('port'))
+    except (TypeError, ValueError):
+        return error(400, 'Invalid port')
+    
+    try:
+        cloned = clone_server(
+            request.cursor, source_id, body_data.get('server_name'), body_data.get('host'), port
+        )
+    except SourceNotFound as exc:
+        request.conn.rollback()
+        return error(404, str(exc))
+    except PortUnavailable as exc:
+        request.conn.rollback()
+        return error(409, str(exc))
+    except psycopg2.errors.UniqueViolation:
+        request.conn.rollback()
+        return error(409, 'Port is already in use', port=port)
+    
+    request.conn.commit()
+    
+    result = serialize_row(cloned['server'])
+    result.update({
+        'cloned_from': source_id,
+        'file_count': cloned['file_count'],
+        'shared_chunk_count': cloned['shared_chunk_count'],
+        'database_count': cloned['database_count']
+    })
+    return respond(201, result)
+
+app = App({
+    ('GET', None): Route(list_servers, cacheable=True),
+    ('GET', 'changes'): Route(list_changes),
+    ('GET', 'hosts'): Route(list_hosts),
+    ('GET', 'jobs'): Route(list_jobs),
+    ('GET', 'metrics'): Route(metrics_series),
+    ('GET', 'purge_status'): Route(purge_status),
+    ('POST', None): Route(create_server),
+    ('POST', 'clone'): Route(clone),
+    ('POST', 'hosts'): Route(save_host),
+    ('POST', 'metrics'): Route(ingest_metrics),
+    ('POST', 'purge'): Route(purge_step),
+    ('POST', 'rebalance'): Route(rebalance),
+    ('PUT', None): Route(update_server),
+    ('PUT', 'hosts'): Route(update_host),
+    ('DELETE', None): Route(delete_server)
+}, cached_tables=CACHED_TABLES, allow_headers='Content-Type, If-None-Match, Idempotency-Key')
 
 def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
     '''
-    Business: Управление серверами Minecraft - создание, получение, обновление статуса
+    Business: Управление серверами Minecraft - создание, клонирование, получение с фильтрами и поиском по имени, обновление статуса с заданиями запуска и остановки для воркера и их прогрессом, лента изменений статусов, мягкое удаление с фоновой очисткой, приём и графики метрик, хосты и размещение серверов по их мощности
     Args: event с httpMethod, body, queryStringParameters; context с request_id
     Returns: HTTP response с данными серверов
     '''
-    method: str = event.get('httpMethod', 'GET')
-    
-    if method == 'OPTIONS':
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Access-Control-Allow-Origin': '*',
-                'Access-Control-Allow-Methods': 'GET, POST, PUT, DELETE, OPTIONS',
-                'Access-Control-Allow-Headers': 'Content-Type',
-                'Access-Control-Max-Age': '86400'
-            },
-            'body': '',
-            'isBase64Encoded': False
-        }
-    
-    dsn = os.environ.get('DATABASE_URL')
-    conn = psycopg2.connect(dsn)
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    
-    if method == 'GET':
-        cursor.execute('SELECT * FROM minecraft_servers ORDER BY created_at DESC')
-        servers = cursor.fetchall()
-        
-        result = []
-        for server in servers:
-            result.append({
-                'id': server['id'],
-                'server_name': server['server_name'],
-                'version': server['version'],
-                'port': server['port'],
-                'max_players': server['max_players'],
-                'gamemode': server['gamemode'],
-                'difficulty': server['difficulty'],
-                'status': server['status'],
-                'created_at': server['created_at'].isoformat() if server['created_at'] else None
-            })
-        
-        cursor.close()
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'servers': result}),
-            'isBase64Encoded': False
-        }
-    
-    if method == 'POST':
-        body_data = json.loads(event.get('body', '{}'))
-        
-        server_name = body_data.get('server_name')
-        version = body_data.get('version')
-        port = body_data.get('port')
-        max_players = body_data.get('max_players', 20)
-        gamemode = body_data.get('gamemode', 'survival')
-        difficulty = body_data.get('difficulty', 'normal')
-        
-        if not server_name or not version or not port:
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'Missing required fields'}),
-                'isBase64Encoded': False
-            }
-        
-        cursor.execute('''
-            INSERT INTO minecraft_servers 
-            (server_name, version, port, max_players, gamemode, difficulty, status)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            RETURNING id, server_name, version, port, max_players, gamemode, difficulty, status, created_at
-        ''', (server_name, version, port, max_players, gamemode, difficulty, 'stopped'))
-        
-        new_server = cursor.fetchone()
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
-        return {
-            'statusCode': 201,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'id': new_server['id'],
-                'server_name': new_server['server_name'],
-                'version': new_server['version'],
-                'port': new_server['port'],
-                'max_players': new_server['max_players'],
-                'gamemode': new_server['gamemode'],
-                'difficulty': new_server['difficulty'],
-                'status': new_server['status'],
-                'created_at': new_server['created_at'].isoformat()
-            }),
-            'isBase64Encoded': False
-        }
-    
-    if method == 'PUT':
-        body_data = json.loads(event.get('body', '{}'))
-        server_id = body_data.get('id')
-        new_status = body_data.get('status')
-        
-        if not server_id or not new_status:
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'Missing id or status'}),
-                'isBase64Encoded': False
-            }
-        
-        cursor.execute('''
-            UPDATE minecraft_servers 
-            SET status = %s, updated_at = CURRENT_TIMESTAMP
-            WHERE id = %s
-            RETURNING id, server_name, status
-        ''', (new_status, server_id))
-        
-        updated_server = cursor.fetchone()
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
-        if not updated_server:
-            return {
-                'statusCode': 404,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'Server not found'}),
-                'isBase64Encoded': False
-            }
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({
-                'id': updated_server['id'],
-                'server_name': updated_server['server_name'],
-                'status': updated_server['status']
-            }),
-            'isBase64Encoded': False
-        }
-    
-    if method == 'DELETE':
-        query_params = event.get('queryStringParameters', {})
-        server_id = query_params.get('id')
-        
-        if not server_id:
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 400,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'Missing server id'}),
-                'isBase64Encoded': False
-            }
-        
-        cursor.execute('SELECT server_name FROM minecraft_servers WHERE id = %s', (server_id,))
-        server = cursor.fetchone()
-        
-        if not server:
-            cursor.close()
-            conn.close()
-            return {
-                'statusCode': 404,
-                'headers': {
-                    'Content-Type': 'application/json',
-                    'Access-Control-Allow-Origin': '*'
-                },
-                'body': json.dumps({'error': 'Server not found'}),
-                'isBase64Encoded': False
-            }
-        
-        cursor.execute('DELETE FROM minecraft_servers WHERE id = %s', (server_id,))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        
-        return {
-            'statusCode': 200,
-            'headers': {
-                'Content-Type': 'application/json',
-                'Access-Control-Allow-Origin': '*'
-            },
-            'body': json.dumps({'message': 'Server deleted', 'server_name': server['server_name']}),
-            'isBase64Encoded': False
-        }
-    
-    cursor.close()
-    conn.close()
-    
-    return {
-        'statusCode': 405,
-        'headers': {
-            'Content-Type': 'application/json',
-            'Access-Control-Allow-Origin': '*'
-        },
-        'body': json.dumps({'error': 'Method not allowed'}),
-        'isBase64Encoded': False
-    }
+    return app(event, context)
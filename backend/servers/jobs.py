@@ -0,0 +1,210 @@
+'''
+Очередь заданий провижининга в Postgres (provisioning_jobs).
+
+PUT status = starting/stopping ставит задание start/stop в той же транзакции, что и переход,
+поэтому статус и задание не расходятся. Воркер (python worker.py) забирает задания через
+FOR UPDATE SKIP LOCKED: параллельные воркеры не ждут друг друга и не берут одно задание дважды.
+Одновременно на хосте выполняется не больше hosts.max_concurrent_jobs заданий - счётчик
+проверяется под advisory-блокировкой хоста, которую держит только транзакция выдачи.
+Для одного сервера задания выполняются строго по очереди. Неудачная попытка возвращает задание
+в очередь с экспоненциальной задержкой и джиттером, после max_attempts оно становится failed.
+Взятое задание продлевает аренду (heartbeat_at) с каждым шагом; задание упавшего воркера
+через JOB_LEASE_SECONDS снова попадает в очередь.
+'''
+import os
+import random
+from typing import Dict, Any, List, Optional
+
+JOB_KINDS = {'starting': 'start', 'stopping': 'stop'}
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', '5'))
+JOB_BACKOFF_SECONDS = float(os.environ.get('JOB_BACKOFF_SECONDS', '5'))
+JOB_BACKOFF_MAX_SECONDS = float(os.environ.get('JOB_BACKOFF_MAX_SECONDS', '300'))
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', '120'))
+DEFAULT_HOST_JOBS = int(os.environ.get('DEFAULT_HOST_JOBS', '2'))
+CLAIM_SCAN_FACTOR = 4
+HOST_LOCK_CLASS = 0x6a6f6273
+MAX_ERROR_LENGTH = 1000
+
+
+def render_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'id': job['id'],
+        'server_id': job['server_id'],
+        'kind': job['kind'],
+        'host': job['host'],
+        'status': job['status'],
+        'step': job['step'],
+        'progress': job['progress'],
+        'attempts': job['attempts'],
+        'max_attempts': job['max_attempts'],
+        'last_error': job['last_error'],
+        'run_after': job['run_after'].isoformat() if job['run_after'] else None,
+        'created_at': job['created_at'].isoformat() if job['created_at'] else None,
+        'started_at': job['started_at'].isoformat() if job['started_at'] else None,
+        'finished_at': job['finished_at'].isoformat() if job['finished_at'] else None
+    }
+
+
+def latest_jobs(cursor: Any, server_ids: List[Any]) -> Dict[int, Dict[str, Any]]:
+    cursor.execute('''
+        SELECT DISTINCT ON (server_id) * FROM provisioning_jobs
+        WHERE server_id = ANY(%s)
+        ORDER BY server_id, id DESC
+    ''', (list(server_ids),))
+    return {job['server_id']: render_job(job) for job in cursor.fetchall()}
+
+
+def enqueue(cursor: Any, server_ids: List[Any], kind: str) -> Dict[int, Dict[str, Any]]:
+    '''
+    Ставит задание kind серверам на их текущий хост и возвращает последнее задание каждого.
+    Ещё не взятые задания другого вида отменяются (остановка, запрошенная до начала запуска,
+    заменяет запуск), а при ожидающем или идущем задании того же вида новое не создаётся -
+    повтор PUT не запускает сервер дважды.
+    '''
+    if not server_ids:
+        return {}
+    cursor.execute('''
+        UPDATE provisioning_jobs
+        SET status = 'cancelled', finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        WHERE server_id = ANY(%s) AND status = 'queued' AND kind <> %s
+    ''', (list(server_ids), kind))
+    cursor.execute('''
+        INSERT INTO provisioning_jobs (server_id, kind, host, max_attempts)
+        SELECT s.id, %s, s.host, %s FROM minecraft_servers s
+        WHERE s.id = ANY(%s) AND s.deleted_at IS NULL
+          AND NOT EXISTS (
+              SELECT 1 FROM provisioning_jobs j
+              WHERE j.server_id = s.id AND j.kind = %s AND j.status IN ('queued', 'running')
+          )
+    ''', (kind, JOB_MAX_ATTEMPTS, list(server_ids), kind))
+    return latest_jobs(cursor, server_ids)
+
+
+def read_jobs(cursor: Any, server_id: Any, limit: int) -> List[Dict[str, Any]]:
+    cursor.execute(
+        'SELECT * FROM provisioning_jobs WHERE server_id = %s ORDER BY id DESC LIMIT %s',
+        (server_id, limit)
+    )
+    return [render_job(job) for job in cursor.fetchall()]
+
+
+def read_job(cursor: Any, job_id: Any) -> Optional[Dict[str, Any]]:
+    cursor.execute('SELECT * FROM provisioning_jobs WHERE id = %s', (job_id,))
+    job = cursor.fetchone()
+    return render_job(job) if job else None
+
+
+def claim(cursor: Any, worker_id: str, limit: int) -> List[Dict[str, Any]]:
+    '''
+    Берёт до limit готовых заданий в порядке run_after с учётом свободных слотов хостов.
+    Хост, который в этот момент раздаёт другой воркер, пропускается до следующего опроса.
+    Вызывающий коммитит транзакцию сразу после выдачи.
+    '''
+    cursor.execute('''
+        SELECT j.id, j.host FROM provisioning_jobs j
+        WHERE j.status = 'queued' AND j.run_after <= CURRENT_TIMESTAMP
+          AND NOT EXISTS (
+              SELECT 1 FROM provisioning_jobs r WHERE r.server_id = j.server_id AND r.status = 'running'
+          )
+        ORDER BY j.run_after, j.id
+        LIMIT %s
+        FOR UPDATE OF j SKIP LOCKED
+    ''', (limit * CLAIM_SCAN_FACTOR,))
+    candidates = cursor.fetchall()
+
+    by_host: Dict[str, List[int]] = {}
+    for job in candidates:
+        by_host.setdefault(job['host'], []).append(job['id'])
+
+    chosen: List[int] = []
+    for host, job_ids in by_host.items():
+        if len(chosen) >= limit:
+            break
+        cursor.execute('SELECT pg_try_advisory_xact_lock(%s, hashtext(%s)) AS locked', (HOST_LOCK_CLASS, host))
+        if not cursor.fetchone()['locked']:
+            continue
+        cursor.execute('''
+            SELECT COALESCE((SELECT max_concurrent_jobs FROM hosts WHERE name = %s), %s) - count(*) AS free
+            FROM provisioning_jobs WHERE host = %s AND status = 'running'
+        ''', (host, DEFAULT_HOST_JOBS, host))
+        free = cursor.fetchone()['free']
+        chosen.extend(job_ids[:max(0, min(free, limit - len(chosen)))])
+
+    if not chosen:
+        return []
+    cursor.execute('''
+        UPDATE provisioning_jobs
+        SET status = 'running', attempts = attempts + 1, locked_by = %s, step = NULL, progress = 0,
+            started_at = COALESCE(started_at, CURRENT_TIMESTAMP), heartbeat_at = CURRENT_TIMESTAMP,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = ANY(%s)
+        RETURNING *
+    ''', (worker_id, chosen))
+    return sorted(cursor.fetchall(), key=lambda job: chosen.index(job['id']))
+
+
+def heartbeat(cursor: Any, job: Dict[str, Any], step: str, progress: int) -> bool:
+    '''Отмечает шаг и продлевает аренду. False - задание уже не наше (аренда истекла).'''
+    cursor.execute('''
+        UPDATE provisioning_jobs
+        SET step = %s, progress = %s, heartbeat_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s AND status = 'running' AND locked_by = %s
+        RETURNING id
+    ''', (step, progress, job['id'], job['locked_by']))
+    return cursor.fetchone() is not None
+
+
+def finish(cursor: Any, job: Dict[str, Any], status: str, message: Optional[str] = None) -> bool:
+    cursor.execute('''
+        UPDATE provisioning_jobs
+        SET status = %s, progress = CASE WHEN %s = 'succeeded' THEN 100 ELSE progress END,
+            last_error = COALESCE(%s, last_error), locked_by = NULL,
+            finished_at = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s AND status = 'running' AND locked_by = %s
+        RETURNING id
+    ''', (status, status, message and message[:MAX_ERROR_LENGTH], job['id'], job['locked_by']))
+    return cursor.fetchone() is not None
+
+
+def backoff_seconds(attempts: int) -> float:
+    '''Экспонента от JOB_BACKOFF_SECONDS с потолком и джиттером в половину задержки.'''
+    delay = min(JOB_BACKOFF_SECONDS * 2 ** max(attempts - 1, 0), JOB_BACKOFF_MAX_SECONDS)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def retry(cursor: Any, job: Dict[str, Any], message: str) -> str:
+    '''
+    Возвращает задание в очередь с задержкой или, если попытки кончились, помечает failed.
+    Возвращает новый статус; пустая строка - задание уже не наше.
+    '''
+    if job['attempts'] >= job['max_attempts']:
+        return 'failed' if finish(cursor, job, 'failed', message) else ''
+    cursor.execute('''
+        UPDATE provisioning_jobs
+        SET status = 'queued', last_error = %s, locked_by = NULL,
+            run_after = CURRENT_TIMESTAMP + make_interval(secs => %s), updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s AND status = 'running' AND locked_by = %s
+        RETURNING id
+    ''', (message[:MAX_ERROR_LENGTH], backoff_seconds(job['attempts']), job['id'], job['locked_by']))
+    return 'queued' if cursor.fetchone() else ''
+
+
+def recover_stale(cursor: Any) -> List[Dict[str, Any]]:
+    '''
+    Возвращает в очередь задания, чья аренда истекла, а исчерпавшие попытки помечает failed.
+    Возвращает задания, ставшие failed, - серверам нужно выставить error.
+    '''
+    cursor.execute('''
+        UPDATE provisioning_jobs
+        SET status = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+            finished_at = CASE WHEN attempts >= max_attempts THEN CURRENT_TIMESTAMP END,
+            last_error = 'Worker lease expired', locked_by = NULL,
+            run_after = CURRENT_TIMESTAMP, updated_at = CURRENT_TIMESTAMP
+        WHERE id IN (
+            SELECT id FROM provisioning_jobs
+            WHERE status = 'running' AND heartbeat_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING *
+    ''', (JOB_LEASE_SECONDS,))
+    return [job for job in cursor.fetchall() if job['status'] == 'failed']
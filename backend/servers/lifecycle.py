@@ -0,0 +1,113 @@
+'''
+Жизненный цикл сервера: stopped -> starting -> running -> stopping -> stopped, плюс error.
+Статус deleting ставит только мягкое удаление (purge.py); удалённый сервер для переходов - 404.
+Перед переходом в starting сервер без резерва мощности или на выводимом хосте
+размещается планировщиком (scheduler.py); если места нет - 409 и ничего не меняется.
+В stopped и error резерв снимается, так что остановленный сервер мощность хоста не держит.
+Переходы выполняются одним compare-and-swap UPDATE ... WHERE status = ANY(допустимые),
+а повторы запросов с тем же Idempotency-Key возвращают сохранённый ответ.
+'''
+import hashlib
+import json
+from typing import Dict, Any, List, Optional, Tuple
+
+import scheduler
+
+TRANSITIONS: Dict[str, Tuple[str, ...]] = {
+    'stopped': ('starting',),
+    'starting': ('running', 'error', 'stopping'),
+    'running': ('stopping', 'error'),
+    'stopping': ('stopped', 'error'),
+    'error': ('starting', 'stopped')
+}
+STATES = tuple(TRANSITIONS)
+
+
+def allowed_sources(target: str) -> List[str]:
+    return [source for source, targets in TRANSITIONS.items() if target in targets]
+
+
+def request_hash(body_data: Any) -> str:
+    return hashlib.sha256(json.dumps(body_data, sort_keys=True).encode('utf-8')).hexdigest()
+
+
+def claim_idempotency_key(cursor: Any, key: str, body_hash: str) -> Optional[Tuple[int, Dict[str, Any]]]:
+    '''
+    Занимает ключ в текущей транзакции. Возвращает None, если запрос нужно выполнить,
+    или (statusCode, body) ранее завершённого запроса с этим ключом.
+    Параллельный запрос с тем же ключом ждёт на уникальном индексе до нашего commit.
+    '''
+    cursor.execute('''
+        INSERT INTO idempotency_keys (idempotency_key, request_hash)
+        VALUES (%s, %s)
+        ON CONFLICT (idempotency_key) DO NOTHING
+        RETURNING idempotency_key
+    ''', (key, body_hash))
+    if cursor.fetchone():
+        return None
+
+    cursor.execute(
+        'SELECT request_hash, status_code, response_body FROM idempotency_keys WHERE idempotency_key = %s',
+        (key,)
+    )
+    stored = cursor.fetchone()
+    if stored['request_hash'] != body_hash:
+        return 422, {'error': 'Idempotency-Key was already used with a different request'}
+    if stored['status_code'] is None:
+        return 409, {'error': 'Request with this Idempotency-Key is still in progress'}
+    return stored['status_code'], json.loads(stored['response_body'])
+
+
+def store_idempotent_result(cursor: Any, key: str, status_code: int, body: Dict[str, Any]) -> None:
+    cursor.execute(
+        'UPDATE idempotency_keys SET status_code = %s, response_body = %s WHERE idempotency_key = %s',
+        (status_code, json.dumps(body), key)
+    )
+
+
+def transition(cursor: Any, server_id: Any, target: str,
+               expected: Optional[str] = None) -> Tuple[int, Dict[str, Any]]:
+    '''
+    Атомарно переводит сервер в target. Повтор уже выполненного перехода
+    (сервер уже в target) отвечает 200 без записи.
+    '''
+    if target not in TRANSITIONS:
+        return 400, {'error': 'Unknown status', 'allowed': list(STATES)}
+
+    sources = allowed_sources(target)
+    if expected is not None:
+        sources = [source for source in sources if source == expected]
+
+    if target == 'starting' and scheduler.place_servers(cursor, [server_id], sources):
+        return 409, {'error': 'No host has capacity for this server', 'requested_status': target}
+
+    cursor.execute('''
+        UPDATE minecraft_servers
+        SET status = %s, updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s AND status = ANY(%s) AND deleted_at IS NULL
+        RETURNING id, server_name, status
+    ''', (target, server_id, sources))
+    updated_server = cursor.fetchone()
+    if updated_server:
+        if target in scheduler.MOVABLE_STATUSES:
+            scheduler.release_capacity(cursor, [updated_server['id']])
+        return 200, {
+            'id': updated_server['id'],
+            'server_name': updated_server['server_name'],
+            'status': updated_server['status']
+        }
+
+    cursor.execute(
+        'SELECT id, server_name, status FROM minecraft_servers WHERE id = %s AND deleted_at IS NULL',
+        (server_id,)
+    )
+    server = cursor.fetchone()
+    if not server:
+        return 404, {'error': 'Server not found'}
+    if server['status'] == target and expected is None:
+        return 200, {'id': server['id'], 'server_name': server['server_name'], 'status': server['status']}
+    return 409, {
+        'error': 'Invalid status transition',
+        'current_status': server['status'],
+        'requested_status': target
+    }
@@ -0,0 +1,299 @@
+'''
+Метрики работающих серверов: TPS, игроки онлайн, занятая куча и загруженные чанки.
+
+Агент сервера шлёт пачки сэмплов в POST ?action=metrics. Сырые сэмплы пишутся одним COPY
+в server_metrics, секционированную по суткам, а свёртки server_metrics_1m и server_metrics_1h
+обновляются в той же транзакции: пачка агрегируется в Python и сливается
+INSERT ... ON CONFLICT по суммам, минимумам и максимумам, без перечитывания сырых данных.
+Графики (GET ?action=metrics) читают только свёртки. Суточные секции создаются заранее
+отдельной короткой транзакцией и удаляются целиком по сроку хранения вместо DELETE.
+'''
+import io
+import math
+import os
+from datetime import date, datetime, timedelta, timezone
+from typing import Dict, Any, Callable, Iterable, List, Optional, Set, Tuple
+
+import tracing
+
+METRICS_MAX_BATCH = int(os.environ.get('METRICS_MAX_BATCH', '10000'))
+METRICS_MAX_DELAY_HOURS = int(os.environ.get('METRICS_MAX_DELAY_HOURS', '24'))
+METRICS_RAW_RETENTION_DAYS = int(os.environ.get('METRICS_RAW_RETENTION_DAYS', '7'))
+METRICS_MINUTE_RETENTION_DAYS = int(os.environ.get('METRICS_MINUTE_RETENTION_DAYS', '30'))
+METRICS_AUTO_MINUTE_HOURS = int(os.environ.get('METRICS_AUTO_MINUTE_HOURS', '6'))
+METRICS_MAX_POINTS = int(os.environ.get('METRICS_MAX_POINTS', '5000'))
+METRICS_DDL_LOCK_TIMEOUT_MS = int(os.environ.get('METRICS_DDL_LOCK_TIMEOUT_MS', '2000'))
+MAX_CLOCK_SKEW = timedelta(minutes=5)
+MAX_REPORTED_ERRORS = 100
+PARTITION_LOCK_KEY = 0x6d657472
+PARTITION_RETENTION = {
+    'server_metrics': METRICS_RAW_RETENTION_DAYS,
+    'server_metrics_1m': METRICS_MINUTE_RETENTION_DAYS
+}
+RESOLUTIONS: Dict[str, Tuple[str, timedelta]] = {
+    '1m': ('server_metrics_1m', timedelta(minutes=1)),
+    '1h': ('server_metrics_1h', timedelta(hours=1))
+}
+ROLLUP_COLUMNS = (
+    'server_id, bucket, samples, tps_sum, tps_min, tps_max, players_sum, players_max, '
+    'heap_used_sum, heap_used_max, heap_max_bytes, chunks_sum, chunks_max'
+)
+
+Sample = Tuple[int, datetime, float, int, int, Optional[int], int]
+
+_ready_days: Set[date] = set()
+
+
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def parse_timestamp(value: Any) -> datetime:
+    '''
+    ISO 8601 (со смещением или без - тогда UTC) либо секунды Unix. Хранится UTC без зоны.
+    '''
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None)
+    if isinstance(value, str):
+        parsed = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if parsed.tzinfo:
+            parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+        return parsed
+    raise ValueError('ts must be an ISO 8601 string or Unix seconds')
+
+
+def parse_sample(item: Any, oldest: datetime, newest: datetime) -> Sample:
+    if not isinstance(item, dict):
+        raise ValueError('Sample must be an object')
+    sampled_at = parse_timestamp(item.get('ts'))
+    if not oldest <= sampled_at <= newest:
+        raise ValueError('ts must be within the last %d hours' % METRICS_MAX_DELAY_HOURS)
+    tps = float(item['tps'])
+    if not math.isfinite(tps) or tps < 0:
+        raise ValueError('tps must be a non-negative number')
+    heap_max = item.get('heap_max_bytes')
+    sample = (
+        int(item['server_id']), sampled_at, tps, int(item['players']), int(item['heap_used_bytes']),
+        None if heap_max is None else int(heap_max), int(item['loaded_chunks'])
+    )
+    if min(value for value in sample[3:] if value is not None) < 0:
+        raise ValueError('players, heap and chunk counts must be non-negative')
+    return sample
+
+
+def parse_samples(items: List[Any]) -> Tuple[List[Tuple[int, Sample]], List[Dict[str, Any]]]:
+    '''
+    Разбирает пачку в (индекс, сэмпл); ошибки - {'index', 'error'} по позициям пачки.
+    '''
+    now = utcnow()
+    oldest = now - timedelta(hours=METRICS_MAX_DELAY_HOURS)
+    newest = now + MAX_CLOCK_SKEW
+    samples = []
+    rejected = []
+    for index, item in enumerate(items):
+        try:
+            samples.append((index, parse_sample(item, oldest, newest)))
+        except KeyError as exc:
+            rejected.append({'index': index, 'error': 'Missing field %s' % exc.args[0]})
+        except (TypeError, ValueError, OverflowError) as exc:
+            rejected.append({'index': index, 'error': str(exc)})
+    return samples, rejected
+
+
+def partition_name(table: str, day: date) -> str:
+    return '%s_p%s' % (table, day.strftime('%Y%m%d'))
+
+
+def ensure_partitions(conn: Any, cursor: Any, days: Iterable[date]) -> None:
+    '''
+    Создаёт суточные секции для дней пачки (и заранее на сегодня и завтра) и удаляет
+    просроченные. Отдельная транзакция под advisory-блокировкой с lock_timeout:
+    DDL на родительской таблице не должен долго держать или ждать блокировку.
+    Созданные дни запоминаются в контейнере, так что обычная пачка сюда не ходит.
+    '''
+    today = utcnow().date()
+    missing = (set(days) | {today, today + timedelta(days=1)}) - _ready_days
+    if not missing:
+        return
+    cursor.execute('SET LOCAL lock_timeout = %s', (METRICS_DDL_LOCK_TIMEOUT_MS,))
+    cursor.execute('SELECT pg_advisory_xact_lock(%s)', (PARTITION_LOCK_KEY,))
+    for day in sorted(missing):
+        for table in PARTITION_RETENTION:
+            cursor.execute(
+                'CREATE TABLE IF NOT EXISTS ' + partition_name(table, day) + ' PARTITION OF ' + table +
+                ' FOR VALUES FROM (%s) TO (%s)',
+                (day.isoformat(), (day + timedelta(days=1)).isoformat())
+            )
+    drop_expired_partitions(cursor, today)
+    conn.commit()
+    _ready_days.update(missing)
+
+
+def drop_expired_partitions(cursor: Any, today: date) -> List[str]:
+    cursor.execute('''
+        SELECT parent.relname AS parent, child.relname AS name
+        FROM pg_inherits i
+        JOIN pg_class parent ON parent.oid = i.inhparent
+        JOIN pg_class child ON child.oid = i.inhrelid
+        WHERE parent.relname = ANY(%s)
+    ''', (list(PARTITION_RETENTION),))
+    dropped = []
+    for row in cursor.fetchall():
+        day = datetime.strptime(row['name'].rsplit('_p', 1)[1], '%Y%m%d').date()
+        if day < today - timedelta(days=PARTITION_RETENTION[row['parent']]):
+            cursor.execute('DROP TABLE IF EXISTS ' + row['name'])
+            dropped.append(row['name'])
+    return dropped
+
+
+def copy_samples(cursor: Any, samples: List[Sample]) -> None:
+    buffer = io.StringIO()
+    for server_id, sampled_at, tps, players, heap_used, heap_max, chunks in samples:
+        buffer.write('%d\t%s\t%r\t%d\t%d\t%s\t%d\n' % (
+            server_id, sampled_at.isoformat(' '), tps, players, heap_used,
+            '\\N' if heap_max is None else heap_max, chunks
+        ))
+    buffer.seek(0)
+    with tracing.phase('copy'):
+        cursor.copy_expert(
+            'COPY server_metrics (server_id, sampled_at, tps, players, heap_used_bytes, heap_max_bytes, loaded_chunks) '
+            'FROM STDIN', buffer
+        )
+
+
+def truncate_minute(value: datetime) -> datetime:
+    return value.replace(second=0, microsecond=0)
+
+
+def truncate_hour(value: datetime) -> datetime:
+    return value.replace(minute=0, second=0, microsecond=0)
+
+
+def rollup_rows(samples: List[Sample], truncate: Callable[[datetime], datetime]) -> List[Tuple[Any, ...]]:
+    '''
+    Агрегаты пачки по (server_id, bucket) в порядке ключа: одна строка на ключ для
+    ON CONFLICT и одинаковый порядок блокировок у параллельных пачек.
+    '''
+    buckets: Dict[Tuple[int, datetime], List[Any]] = {}
+    for server_id, sampled_at, tps, players, heap_used, heap_max, chunks in samples:
+        key = (server_id, truncate(sampled_at))
+        acc = buckets.get(key)
+        if acc is None:
+            buckets[key] = [1, tps, tps, tps, players, players, heap_used, heap_used, heap_max, chunks, chunks]
+            continue
+        acc[0] += 1
+        acc[1] += tps
+        acc[2] = min(acc[2], tps)
+        acc[3] = max(acc[3], tps)
+        acc[4] += players
+        acc[5] = max(acc[5], players)
+        acc[6] += heap_used
+        acc[7] = max(acc[7], heap_used)
+        if heap_max is not None and (acc[8] is None or heap_max > acc[8]):
+            acc[8] = heap_max
+        acc[9] += chunks
+        acc[10] = max(acc[10], chunks)
+    return [key + tuple(acc) for key, acc in sorted(buckets.items())]
+
+
+def merge_rollup(cursor: Any, table: str, rows: List[Tuple[Any, ...]]) -> None:
+    from psycopg2.extras import execute_values
+
+    execute_values(cursor, '''
+        INSERT INTO ''' + table + ''' AS r (''' + ROLLUP_COLUMNS + ''') VALUES %s
+        ON CONFLICT (server_id, bucket) DO UPDATE SET
+            samples = r.samples + EXCLUDED.samples,
+            tps_sum = r.tps_sum + EXCLUDED.tps_sum,
+            tps_min = LEAST(r.tps_min, EXCLUDED.tps_min),
+            tps_max = GREATEST(r.tps_max, EXCLUDED.tps_max),
+            players_sum = r.players_sum + EXCLUDED.players_sum,
+            players_max = GREATEST(r.players_max, EXCLUDED.players_max),
+            heap_used_sum = r.heap_used_sum + EXCLUDED.heap_used_sum,
+            heap_used_max = GREATEST(r.heap_used_max, EXCLUDED.heap_used_max),
+            heap_max_bytes = GREATEST(r.heap_max_bytes, EXCLUDED.heap_max_bytes),
+            chunks_sum = r.chunks_sum + EXCLUDED.chunks_sum,
+            chunks_max = GREATEST(r.chunks_max, EXCLUDED.chunks_max)
+    ''', rows, page_size=len(rows))
+
+
+def ingest(cursor: Any, samples: List[Tuple[int, Sample]], rejected: List[Dict[str, Any]]) -> Dict[str, Any]:
+    '''
+    Пишет сэмплы существующих (не удалённых) серверов: COPY сырых строк и слияние свёрток.
+    Сэмплы неизвестных серверов попадают в rejected. Commit - на вызывающем.
+    '''
+    server_ids = sorted({sample[0] for _, sample in samples})
+    cursor.execute(
+        'SELECT id FROM minecraft_servers WHERE id = ANY(%s::integer[]) AND deleted_at IS NULL',
+        (server_ids,)
+    )
+    known = {row['id'] for row in cursor.fetchall()}
+    accepted = []
+    for index, sample in samples:
+        if sample[0] in known:
+            accepted.append(sample)
+        else:
+            rejected.append({'index': index, 'error': 'Server not found'})
+
+    if accepted:
+        copy_samples(cursor, accepted)
+        merge_rollup(cursor, 'server_metrics_1m', rollup_rows(accepted, truncate_minute))
+        merge_rollup(cursor, 'server_metrics_1h', rollup_rows(accepted, truncate_hour))
+
+    rejected.sort(key=lambda item: item['index'])
+    return {
+        'accepted': len(accepted),
+        'rejected': len(rejected),
+        'errors': rejected[:MAX_REPORTED_ERRORS]
+    }
+
+
+def parse_window(start: Optional[str], end: Optional[str],
+                 resolution: Optional[str]) -> Tuple[datetime, datetime, str]:
+    '''
+    Окно графика: по умолчанию последний час. resolution auto (по умолчанию) берёт
+    минутную свёртку для окон до METRICS_AUTO_MINUTE_HOURS, пока она ещё хранится, иначе часовую.
+    '''
+    now = utcnow()
+    end_at = parse_timestamp(end) if end else now
+    start_at = parse_timestamp(start) if start else end_at - timedelta(hours=1)
+    if start_at >= end_at:
+        raise ValueError('from must be earlier than to')
+    resolution = resolution or 'auto'
+    if resolution == 'auto':
+        minute_kept_since = now - timedelta(days=METRICS_MINUTE_RETENTION_DAYS)
+        short = end_at - start_at <= timedelta(hours=METRICS_AUTO_MINUTE_HOURS)
+        resolution = '1m' if short and start_at >= minute_kept_since else '1h'
+    if resolution not in RESOLUTIONS:
+        raise ValueError('resolution must be one of auto, ' + ', '.join(RESOLUTIONS))
+    if (end_at - start_at) / RESOLUTIONS[resolution][1] > METRICS_MAX_POINTS:
+        raise ValueError('Window has more than %d points at resolution %s' % (METRICS_MAX_POINTS, resolution))
+    return start_at, end_at, resolution
+
+
+def read_series(cursor: Any, server_id: int, start_at: datetime, end_at: datetime, resolution: str) -> Dict[str, Any]:
+    table, step = RESOLUTIONS[resolution]
+    truncate = truncate_minute if step == RESOLUTIONS['1m'][1] else truncate_hour
+    cursor.execute('''
+        SELECT bucket, samples,
+               tps_sum / samples AS tps_avg, tps_min, tps_max,
+               players_sum::float8 / samples AS players_avg, players_max,
+               (heap_used_sum / samples)::bigint AS heap_used_avg, heap_used_max, heap_max_bytes,
+               chunks_sum::float8 / samples AS chunks_avg, chunks_max
+        FROM ''' + table + '''
+        WHERE server_id = %s AND bucket >= %s AND bucket < %s
+        ORDER BY bucket
+    ''', (server_id, truncate(start_at), end_at))
+    points = []
+    for row in cursor.fetchall():
+        point = dict(row)
+        point['bucket'] = row['bucket'].isoformat()
+        for key in ('tps_avg', 'tps_min', 'tps_max', 'players_avg', 'chunks_avg'):
+            point[key] = round(row[key], 2)
+        points.append(point)
+    return {
+        'server_id': server_id,
+        'resolution': resolution,
+        'from': start_at.isoformat(),
+        'to': end_at.isoformat(),
+        'points': points
+    }
@@ -0,0 +1,76 @@
+'''
+Выдача портов. port_allocations хранит по строке на каждый порт диапазона хоста
+(server_id IS NULL - порт свободен). Автовыбор берёт свободные строки FOR UPDATE SKIP LOCKED,
+так что параллельные создания не ждут друг друга и не получают один порт, а уникальный
+индекс (host, port) на minecraft_servers страхует порты, выбранные клиентом вручную.
+'''
+from typing import Dict, Any, List
+
+DEFAULT_HOST = 'default'
+DEFAULT_PORT_RANGE = (19132, 21131)
+
+
+class PortUnavailable(Exception):
+    pass
+
+
+def allocate_ports(cursor: Any, host: str, count: int) -> List[int]:
+    '''
+    Свободные порты хоста по возрастанию. Строки остаются заблокированными до commit,
+    параллельная транзакция их пропускает и берёт следующие.
+    '''
+    cursor.execute('''
+        SELECT port FROM port_allocations
+        WHERE host = %s AND server_id IS NULL
+        ORDER BY port
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    ''', (host, count))
+    ports = [row['port'] for row in cursor.fetchall()]
+    if len(ports) < count:
+        raise PortUnavailable('No free ports left on host %s' % host)
+    return ports
+
+
+def reserve_port(cursor: Any, host: str, port: int) -> None:
+    '''
+    Порт, выбранный вручную: если он из диапазона, блокирует его строку
+    (ждёт, пока автовыбор в другой транзакции завершится) и проверяет, что он свободен.
+    '''
+    cursor.execute(
+        'SELECT server_id FROM port_allocations WHERE host = %s AND port = %s FOR UPDATE',
+        (host, port)
+    )
+    row = cursor.fetchone()
+    if row and row['server_id'] is not None:
+        raise PortUnavailable('Port %d is already in use on host %s' % (port, host))
+
+
+def bind_ports(cursor: Any, servers: List[Dict[str, Any]]) -> None:
+    from psycopg2.extras import execute_values
+
+    execute_values(cursor, '''
+        UPDATE port_allocations AS p
+        SET server_id = v.id, allocated_at = CURRENT_TIMESTAMP
+        FROM (VALUES %s) AS v(id, host, port)
+        WHERE p.host = v.host AND p.port = v.port
+    ''', [(server['id'], server['host'], server['port']) for server in servers], page_size=len(servers))
+
+
+def release_ports(cursor: Any, server_ids: List[Any]) -> None:
+    cursor.execute(
+        'UPDATE port_allocations SET server_id = NULL, allocated_at = NULL WHERE server_id = ANY(%s::integer[])',
+        (server_ids,)
+    )
+
+
+def add_port_range(cursor: Any, host: str, first_port: int, last_port: int) -> int:
+    '''
+    Заводит строки портов нового хоста; существующие строки не трогает.
+    '''
+    cursor.execute('''
+        INSERT INTO port_allocations (host, port)
+        SELECT %s, port FROM generate_series(%s, %s) AS port
+        ON CONFLICT (host, port) DO NOTHING
+    ''', (host, first_port, last_port))
+    return cursor.rowcount
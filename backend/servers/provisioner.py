@@ -0,0 +1,227 @@
+'''
+Исполнение заданий провижининга: start - скачать jar версии, сгенерировать server.properties
+из gamemode/difficulty/max_players, запустить процесс и дождаться готовности; stop - остановить.
+
+PROVISIONING_RUNTIME_URL выбирает среду исполнения:
+  stub:///путь (по умолчанию stub:///tmp/minecraft-servers) - заглушка без сети и java:
+    пишет каталог сервера, фиктивный jar и server.properties, шаги длятся
+    PROVISIONING_STUB_STEP_SECONDS, а PROVISIONING_STUB_FAILURE_RATE роняет долю шагов,
+    чтобы повторы и backoff можно было прогнать локально от PUT до running;
+  local:///путь - настоящие процессы java на хосте воркера, eula.txt пишется только
+    при MINECRAFT_ACCEPT_EULA=true.
+jar берётся из общего кэша артефактов узла (artifacts.py) и кладётся в каталог сервера ссылкой;
+заглушка без ARTIFACT_UPSTREAM_URL пишет фиктивный jar.
+'''
+import os
+import random
+import signal
+import threading
+import time
+from typing import Any, Callable, Dict
+
+import artifacts
+
+PROVISIONING_RUNTIME_URL = os.environ.get('PROVISIONING_RUNTIME_URL', 'stub:///tmp/minecraft-servers')
+PROVISIONING_STUB_STEP_SECONDS = float(os.environ.get('PROVISIONING_STUB_STEP_SECONDS', '0.2'))
+PROVISIONING_STUB_FAILURE_RATE = float(os.environ.get('PROVISIONING_STUB_FAILURE_RATE', '0'))
+MINECRAFT_ACCEPT_EULA = os.environ.get('MINECRAFT_ACCEPT_EULA', '').lower() == 'true'
+JAVA_BIN = os.environ.get('JAVA_BIN', 'java')
+READY_TIMEOUT_SECONDS = float(os.environ.get('PROVISIONING_READY_TIMEOUT_SECONDS', '300'))
+STOP_TIMEOUT_SECONDS = float(os.environ.get('PROVISIONING_STOP_TIMEOUT_SECONDS', '60'))
+HEARTBEAT_SECONDS = 10.0
+DEFAULT_MEMORY_MB = 1024
+SERVER_COLUMNS = (
+    'id', 'server_name', 'version', 'port', 'max_players', 'gamemode', 'difficulty', 'host', 'status',
+    'reserved_memory_mb'
+)
+
+Report = Callable[[str, int], None]
+
+
+class ProvisioningError(Exception):
+    pass
+
+
+def server_properties(server: Dict[str, Any]) -> str:
+    properties = (
+        ('motd', server['server_name']),
+        ('server-port', server['port']),
+        ('max-players', server['max_players'] or 20),
+        ('gamemode', server['gamemode'] or 'survival'),
+        ('difficulty', server['difficulty'] or 'normal'),
+        ('enable-status', 'true')
+    )
+    return ''.join('%s=%s\n' % (key, str(value).replace('\n', ' ')) for key, value in properties)
+
+
+def server_dir(root: str, server: Dict[str, Any]) -> str:
+    return os.path.join(root, 'servers', str(server['id']))
+
+
+def write_file(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = '%s.%d.tmp' % (path, threading.get_ident())
+    with open(temp_path, 'wb') as output:
+        output.write(data)
+    os.replace(temp_path, path)
+
+
+def fetch_jar(directory: str, version: str) -> str:
+    path = os.path.join(directory, 'server.jar')
+    try:
+        artifacts.get_cache().materialize(artifacts.DEFAULT_FLAVOUR, version, path)
+    except (artifacts.ArtifactError, OSError) as exc:
+        raise ProvisioningError('Failed to fetch server jar %s: %s' % (version, exc))
+    return path
+
+
+class StubRuntime:
+    def __init__(self, root: str) -> None:
+        self.root = root
+
+    def step(self, name: str) -> None:
+        time.sleep(PROVISIONING_STUB_STEP_SECONDS)
+        if random.random() < PROVISIONING_STUB_FAILURE_RATE:
+            raise ProvisioningError('Stub runtime failed at %s' % name)
+
+    def fetch_jar(self, server: Dict[str, Any]) -> str:
+        self.step('download')
+        if artifacts.ARTIFACT_UPSTREAM_URL:
+            return fetch_jar(server_dir(self.root, server), server['version'])
+        path = os.path.join(server_dir(self.root, server), 'server.jar')
+        write_file(path, ('stub server jar %s\n' % server['version']).encode('utf-8'))
+        return path
+
+    def configure(self, server: Dict[str, Any], properties: str) -> None:
+        self.step('configure')
+        write_file(os.path.join(server_dir(self.root, server), 'server.properties'), properties.encode('utf-8'))
+
+    def start(self, server: Dict[str, Any], jar_path: str) -> None:
+        self.step('launch')
+        write_file(os.path.join(server_dir(self.root, server), 'running'), jar_path.encode('utf-8'))
+
+    def wait_ready(self, server: Dict[str, Any], report: Report) -> None:
+        self.step('wait_ready')
+
+    def stop(self, server: Dict[str, Any]) -> None:
+        self.step('stop')
+        marker = os.path.join(server_dir(self.root, server), 'running')
+        if os.path.exists(marker):
+            os.remove(marker)
+
+
+class LocalProcessRuntime:
+    def __init__(self, root: str) -> None:
+        self.root = root
+
+    def pid_path(self, server: Dict[str, Any]) -> str:
+        return os.path.join(server_dir(self.root, server), 'server.pid')
+
+    def read_pid(self, server: Dict[str, Any]) -> int:
+        '''PID живого процесса сервера или 0; завершившегося потомка воркера подбирает waitpid.'''
+        try:
+            with open(self.pid_path(server)) as pid_file:
+                pid = int(pid_file.read().strip())
+            os.kill(pid, 0)
+        except (OSError, ValueError):
+            return 0
+        try:
+            if os.waitpid(pid, os.WNOHANG)[0]:
+                return 0
+        except ChildProcessError:
+            pass
+        return pid
+
+    def fetch_jar(self, server: Dict[str, Any]) -> str:
+        return fetch_jar(server_dir(self.root, server), server['version'])
+
+    def configure(self, server: Dict[str, Any], properties: str) -> None:
+        directory = server_dir(self.root, server)
+        write_file(os.path.join(directory, 'server.properties'), properties.encode('utf-8'))
+        if MINECRAFT_ACCEPT_EULA:
+            write_file(os.path.join(directory, 'eula.txt'), b'eula=true\n')
+
+    def start(self, server: Dict[str, Any], jar_path: str) -> None:
+        import subprocess
+
+        if self.read_pid(server):
+            return
+        directory = server_dir(self.root, server)
+        os.makedirs(directory, exist_ok=True)
+        memory_mb = server['reserved_memory_mb'] or DEFAULT_MEMORY_MB
+        with open(os.path.join(directory, 'server.log'), 'wb') as log:
+            process = subprocess.Popen(
+                [JAVA_BIN, '-Xmx%dM' % memory_mb, '-jar', os.path.basename(jar_path), 'nogui'],
+                cwd=directory, stdin=subprocess.DEVNULL, stdout=log, stderr=subprocess.STDOUT,
+                start_new_session=True
+            )
+        write_file(self.pid_path(server), str(process.pid).encode('ascii'))
+
+    def wait_ready(self, server: Dict[str, Any], report: Report) -> None:
+        '''Ждёт строку "Done (" в логе, раз в HEARTBEAT_SECONDS продлевая аренду задания.'''
+        log_path = os.path.join(server_dir(self.root, server), 'server.log')
+        deadline = time.monotonic() + READY_TIMEOUT_SECONDS
+        next_heartbeat = time.monotonic() + HEARTBEAT_SECONDS
+        while time.monotonic() < deadline:
+            if not self.read_pid(server):
+                raise ProvisioningError('Server process exited during startup, see server.log')
+            with open(log_path, 'rb') as log:
+                if b'Done (' in log.read():
+                    return
+            if time.monotonic() >= next_heartbeat:
+                report('wait_ready', 75)
+                next_heartbeat = time.monotonic() + HEARTBEAT_SECONDS
+            time.sleep(1)
+        raise ProvisioningError('Server did not become ready in %d seconds' % READY_TIMEOUT_SECONDS)
+
+    def stop(self, server: Dict[str, Any]) -> None:
+        pid = self.read_pid(server)
+        if not pid:
+            return
+        os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + STOP_TIMEOUT_SECONDS
+        while time.monotonic() < deadline and self.read_pid(server):
+            time.sleep(1)
+        if self.read_pid(server):
+            os.killpg(pid, signal.SIGKILL)
+        if os.path.exists(self.pid_path(server)):
+            os.remove(self.pid_path(server))
+
+
+def provision(job: Dict[str, Any], server: Dict[str, Any], runtime: Any, report: Report) -> None:
+    '''
+    Выполняет шаги задания; report(step, progress) отмечает шаг в задании перед его началом.
+    Шаги идемпотентны: повтор после сбоя на любом шаге безопасен.
+    '''
+    if job['kind'] == 'stop':
+        report('stop', 0)
+        runtime.stop(server)
+        return
+    report('download', 0)
+    jar_path = runtime.fetch_jar(server)
+    report('configure', 25)
+    runtime.configure(server, server_properties(server))
+    report('launch', 50)
+    runtime.start(server, jar_path)
+    report('wait_ready', 75)
+    runtime.wait_ready(server, report)
+
+
+_lock = threading.Lock()
+_runtime: Any = None
+
+
+def get_runtime() -> Any:
+    from urllib.parse import urlparse
+
+    global _runtime
+    with _lock:
+        if _runtime is None:
+            url = urlparse(PROVISIONING_RUNTIME_URL)
+            if url.scheme == 'local':
+                _runtime = LocalProcessRuntime(url.path)
+            elif url.scheme == 'stub':
+                _runtime = StubRuntime(url.path)
+            else:
+                raise ProvisioningError('Unknown PROVISIONING_RUNTIME_URL scheme: %s' % url.scheme)
+        return _runtime
@@ -0,0 +1,380 @@
+'''
+Мягкое удаление серверов и фоновая очистка.
+
+DELETE помечает строку minecraft_servers (deleted_at, status = 'deleting') и ставит запись
+в server_purges - ответ 202 не ждёт удаления файлов. У остановленного сервера порты и резерв
+мощности хоста освобождаются сразу; запущенному ставится задание stop, и его порт и резерв
+держатся до последней фазы очистки, а сама очистка начинается только после завершения
+заданий провижининга сервера - процесс игры не остаётся работать на отданном другим порту.
+Очистку выполняет воркер (python purge.py в каталоге функции) или порция POST ?action=purge
+по расписанию: сессии загрузки, снимки, файлы с их чанками, записи баз (DROP делает функция databases), каталоги, свёртки метрик,
+задания провижининга - пачками по PURGE_BATCH_SIZE строк, каждая пачка в своей короткой транзакции, ссылки на блобы
+уменьшаются в той же транзакции (сами байты удаляет сборщик мусора функции files).
+Последней удаляется строка сервера. Между пачками воркер спит так, чтобы работать
+не больше PURGE_DUTY_CYCLE времени, а lock_timeout не даёт ему подолгу ждать блокировок
+запросов пользователей.
+'''
+import os
+import time
+from typing import Dict, Any, List, Optional, Tuple
+
+from jobs import enqueue
+from ports import release_ports
+from scheduler import MOVABLE_STATUSES, release_capacity
+
+PURGE_BATCH_SIZE = int(os.environ.get('PURGE_BATCH_SIZE', '2000'))
+PURGE_DUTY_CYCLE = float(os.environ.get('PURGE_DUTY_CYCLE', '0.5'))
+PURGE_LOCK_TIMEOUT_MS = int(os.environ.get('PURGE_LOCK_TIMEOUT_MS', '2000'))
+PURGE_LEASE_SECONDS = int(os.environ.get('PURGE_LEASE_SECONDS', '60'))
+PURGE_TIME_BUDGET = float(os.environ.get('PURGE_TIME_BUDGET', '20'))
+PURGE_IDLE_SECONDS = float(os.environ.get('PURGE_IDLE_SECONDS', '5'))
+PHASES = ('uploads', 'snapshots', 'files', 'databases', 'directories', 'metrics', 'jobs', 'server')
+
+
+def soft_delete_servers(cursor: Any, server_ids: List[Any]) -> List[Dict[str, Any]]:
+    '''
+    Помечает серверы удалёнными и ставит их в очередь очистки. Уже удалённые пропускаются.
+    Незапущенным серверам порты и резерв освобождаются сразу, остальным ставится задание stop.
+    '''
+    cursor.execute('''
+        SELECT id, status FROM minecraft_servers
+        WHERE id = ANY(%s::integer[]) AND deleted_at IS NULL
+        ORDER BY id
+        FOR UPDATE
+    ''', (server_ids,))
+    previous = {row['id']: row['status'] for row in cursor.fetchall()}
+    enqueue(cursor, [server_id for server_id, status in previous.items() if status not in MOVABLE_STATUSES], 'stop')
+    cursor.execute('''
+        UPDATE minecraft_servers
+        SET deleted_at = CURRENT_TIMESTAMP, status = 'deleting', updated_at = CURRENT_TIMESTAMP
+        WHERE id = ANY(%s::integer[])
+        RETURNING id, server_name
+    ''', (list(previous),))
+    servers = cursor.fetchall()
+    if servers:
+        ids = [server['id'] for server in servers]
+        stopped = [server_id for server_id in ids if previous[server_id] in MOVABLE_STATUSES]
+        if stopped:
+            release_ports(cursor, stopped)
+            release_capacity(cursor, stopped)
+        cursor.execute('''
+            INSERT INTO server_purges (server_id, server_name, files_total)
+            SELECT s.id, s.server_name, COALESCE(t.file_count, 0)
+            FROM minecraft_servers s
+            LEFT JOIN server_storage_totals t ON t.server_id = s.id
+            WHERE s.id = ANY(%s)
+            ON CONFLICT (server_id) DO NOTHING
+        ''', (ids,))
+    return servers
+
+
+def render_purge(purge: Dict[str, Any]) -> Dict[str, Any]:
+    if purge['status'] == 'done':
+        progress = 1.0
+    elif purge['files_total']:
+        progress = round(min(purge['files_removed'] / purge['files_total'], 1.0), 4)
+    else:
+        progress = 0.0
+    return {
+        'server_id': purge['server_id'],
+        'server_name': purge['server_name'],
+        'status': purge['status'],
+        'phase': purge['phase'],
+        'files_total': purge['files_total'],
+        'files_removed': purge['files_removed'],
+        'progress': progress,
+        'databases_removed': purge['databases_removed'],
+        'snapshots_removed': purge['snapshots_removed'],
+        'chunk_refs_released': purge['chunk_refs_released'],
+        'attempts': purge['attempts'],
+        'last_error': purge['last_error'],
+        'requested_at': purge['requested_at'].isoformat() if purge['requested_at'] else None,
+        'finished_at': purge['finished_at'].isoformat() if purge['finished_at'] else None
+    }
+
+
+def read_purge(cursor: Any, server_id: Any) -> Optional[Dict[str, Any]]:
+    cursor.execute('SELECT * FROM server_purges WHERE server_id = %s', (server_id,))
+    purge = cursor.fetchone()
+    return render_purge(purge) if purge else None
+
+
+def claim_purge(cursor: Any) -> Optional[Dict[str, Any]]:
+    '''
+    Берёт самую старую незавершённую очистку сервера без ожидающих и идущих заданий
+    провижининга (остановка удалённого сервера должна закончиться до очистки). Аренда
+    продлевается каждой пачкой, так что очистку упавшего воркера через PURGE_LEASE_SECONDS
+    подхватит другой.
+    '''
+    cursor.execute('''
+        UPDATE server_purges
+        SET status = 'running', started_at = COALESCE(started_at, CURRENT_TIMESTAMP),
+            attempts = attempts + 1, updated_at = CURRENT_TIMESTAMP
+        WHERE server_id = (
+            SELECT p.server_id FROM server_purges p
+            WHERE (p.status = 'pending'
+                   OR (p.status = 'running' AND p.updated_at < CURRENT_TIMESTAMP - make_interval(secs => %s)))
+              AND NOT EXISTS (
+                  SELECT 1 FROM provisioning_jobs j
+                  WHERE j.server_id = p.server_id AND j.status IN ('queued', 'running')
+              )
+            ORDER BY p.requested_at
+            LIMIT 1
+            FOR UPDATE SKIP LOCKED
+        )
+        RETURNING *
+    ''', (PURGE_LEASE_SECONDS,))
+    return cursor.fetchone()
+
+
+def release_blob_refs_sql(source: str) -> str:
+    return '''
+        UPDATE blobs b SET ref_count = b.ref_count - r.refs
+        FROM (SELECT blob_sha256, COUNT(*) AS refs FROM ''' + source + ''' GROUP BY blob_sha256) r
+        WHERE b.sha256 = r.blob_sha256
+        RETURNING r.refs
+    '''
+
+
+def purge_uploads(cursor: Any, server_id: int, limit: int) -> Tuple[int, int]:
+    cursor.execute('SELECT id FROM upload_sessions WHERE server_id = %s LIMIT %s', (server_id, limit))
+    ids = [row['id'] for row in cursor.fetchall()]
+    if not ids:
+        return 0, 0
+    cursor.execute('''
+        WITH removed AS (
+            DELETE FROM upload_session_chunks WHERE upload_id = ANY(%s) RETURNING blob_sha256
+        ), released AS (''' + release_blob_refs_sql('removed') + ''')
+        SELECT COALESCE(SUM(refs), 0) AS refs FROM released
+    ''', (ids,))
+    refs = cursor.fetchone()['refs']
+    cursor.execute('DELETE FROM upload_sessions WHERE id = ANY(%s)', (ids,))
+    return len(ids), refs
+
+
+def purge_snapshot(cursor: Any, server_id: int, limit: int) -> Tuple[int, int]:
+    cursor.execute(
+        'SELECT id FROM server_snapshots WHERE server_id = %s ORDER BY id DESC LIMIT 1',
+        (server_id,)
+    )
+    snapshot = cursor.fetchone()
+    if not snapshot:
+        return 0, 0
+    cursor.execute('''
+        WITH removed AS (
+            DELETE FROM snapshot_blob_refs WHERE snapshot_id = %s RETURNING blob_sha256, ref_count
+        ), released AS (
+            UPDATE blobs b SET ref_count = b.ref_count - r.ref_count
+            FROM removed r
+            WHERE b.sha256 = r.blob_sha256
+            RETURNING r.ref_count
+        )
+        SELECT COALESCE(SUM(ref_count), 0) AS refs FROM released
+    ''', (snapshot['id'],))
+    refs = cursor.fetchone()['refs']
+    cursor.execute('DELETE FROM server_snapshots WHERE id = %s', (snapshot['id'],))
+    return 1, refs
+
+
+def purge_files(cursor: Any, server_id: int, limit: int) -> Tuple[int, int]:
+    cursor.execute('SELECT id FROM server_files WHERE server_id = %s LIMIT %s', (server_id, limit))
+    ids = [row['id'] for row in cursor.fetchall()]
+    if not ids:
+        return 0, 0
+    cursor.execute('''
+        WITH removed AS (
+            DELETE FROM server_file_chunks WHERE file_id = ANY(%s) RETURNING blob_sha256
+        ), released AS (''' + release_blob_refs_sql('removed') + ''')
+        SELECT COALESCE(SUM(refs), 0) AS refs FROM released
+    ''', (ids,))
+    refs = cursor.fetchone()['refs']
+    cursor.execute('''
+        WITH removed AS (DELETE FROM server_files WHERE id = ANY(%s) RETURNING file_size_bytes)
+        UPDATE server_storage_totals t
+        SET file_count = t.file_count - r.file_count, file_bytes = t.file_bytes - r.file_bytes,
+            updated_at = CURRENT_TIMESTAMP
+        FROM (SELECT COUNT(*) AS file_count, COALESCE(SUM(file_size_bytes), 0) AS file_bytes FROM removed) r
+        WHERE t.server_id = %s
+    ''', (ids, server_id))
+    return len(ids), refs
+
+
+def purge_databases(cursor: Any, server_id: int, limit: int) -> Tuple[int, int]:
+    '''
+    Записи отвязываются от сервера и переводятся в dropping: сами базы Postgres удаляет
+    периодическое задание функции databases, уже удаляемые из итогов не вычитаются второй раз.
+    '''
+    cursor.execute('''
+        WITH detached AS (
+            UPDATE server_databases d
+            SET server_id = NULL, status = 'dropping', updated_at = CURRENT_TIMESTAMP
+            FROM (SELECT id, status FROM server_databases WHERE server_id = %s LIMIT %s FOR UPDATE) old
+            WHERE d.id = old.id
+            RETURNING old.status AS old_status, d.db_size_bytes
+        ), totals AS (
+            UPDATE server_storage_totals t
+            SET database_count = t.database_count - r.database_count,
+                database_bytes = t.database_bytes - r.database_bytes, updated_at = CURRENT_TIMESTAMP
+            FROM (
+                SELECT COUNT(*) AS database_count, COALESCE(SUM(db_size_bytes), 0) AS database_bytes
+                FROM detached WHERE old_status <> 'dropping'
+            ) r
+            WHERE t.server_id = %s
+        )
+        SELECT COUNT(*) AS removed FROM detached
+    ''', (server_id, limit, server_id))
+    return cursor.fetchone()['removed'], 0
+
+
+def purge_directories(cursor: Any, server_id: int, limit: int) -> Tuple[int, int]:
+    '''
+    Сначала самые глубокие: в пачку родитель попадает только вместе со всеми детьми.
+    '''
+    cursor.execute('''
+        DELETE FROM server_directories
+        WHERE id IN (
+            SELECT id FROM server_directories WHERE server_id = %s ORDER BY depth DESC LIMIT %s
+        )
+    ''', (server_id, limit))
+    return cursor.rowcount, 0
+
+
+def purge_metrics(cursor: Any, server_id: int, limit: int) -> Tuple[int, int]:
+    for table in ('server_metrics_1h', 'server_metrics_1m'):
+        cursor.execute('''
+            DELETE FROM ''' + table + '''
+            WHERE server_id = %s AND bucket IN (
+                SELECT bucket FROM ''' + table + ''' WHERE server_id = %s LIMIT %s
+            )
+        ''', (server_id, server_id, limit))
+        if cursor.rowcount:
+            return cursor.rowcount, 0
+    return 0, 0
+
+
+def purge_jobs(cursor: Any, server_id: int, limit: int) -> Tuple[int, int]:
+    cursor.execute('''
+        DELETE FROM provisioning_jobs
+        WHERE id IN (SELECT id FROM provisioning_jobs WHERE server_id = %s LIMIT %s)
+    ''', (server_id, limit))
+    return cursor.rowcount, 0
+
+
+def purge_server(cursor: Any, server_id: int, limit: int) -> Tuple[int, int]:
+    release_ports(cursor, [server_id])
+    release_capacity(cursor, [server_id])
+    cursor.execute('DELETE FROM server_storage_totals WHERE server_id = %s', (server_id,))
+    cursor.execute('DELETE FROM minecraft_servers WHERE id = %s AND deleted_at IS NOT NULL', (server_id,))
+    return 0, 0
+
+
+PHASE_STEPS = {
+    'uploads': purge_uploads,
+    'snapshots': purge_snapshot,
+    'files': purge_files,
+    'databases': purge_databases,
+    'directories': purge_directories,
+    'metrics': purge_metrics,
+    'jobs': purge_jobs,
+    'server': purge_server
+}
+
+
+def purge_batch(cursor: Any, purge: Dict[str, Any], limit: int) -> bool:
+    '''
+    Одна пачка первой непустой фазы. Фазы каждый раз проверяются с начала (пустая стоит
+    одного индексного запроса), поэтому строки, созданные гонкой уже после своей фазы,
+    тоже будут удалены. Возвращает True, когда сервер удалён полностью.
+    '''
+    phase = PHASES[0]
+    removed, refs = PHASE_STEPS[phase](cursor, purge['server_id'], limit)
+    while removed == 0 and phase != 'server':
+        phase = PHASES[PHASES.index(phase) + 1]
+        removed, refs = PHASE_STEPS[phase](cursor, purge['server_id'], limit)
+    finished = phase == 'server'
+    cursor.execute('''
+        UPDATE server_purges SET
+            phase = %s,
+            status = CASE WHEN %s THEN 'done' ELSE status END,
+            finished_at = CASE WHEN %s THEN CURRENT_TIMESTAMP ELSE finished_at END,
+            files_removed = files_removed + %s,
+            databases_removed = databases_removed + %s,
+            snapshots_removed = snapshots_removed + %s,
+            chunk_refs_released = chunk_refs_released + %s,
+            last_error = NULL,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE server_id = %s
+        RETURNING *
+    ''', (phase, finished, finished, removed if phase == 'files' else 0, removed if phase == 'databases' else 0,
+          removed if phase == 'snapshots' else 0, refs, purge['server_id']))
+    purge.update(cursor.fetchone())
+    return finished
+
+
+def run_purges(conn: Any, cursor: Any, time_budget: float = PURGE_TIME_BUDGET,
+               limit: int = PURGE_BATCH_SIZE) -> Dict[str, Any]:
+    '''
+    Выполняет пачки очисток, пока не кончится time_budget или очередь; на ошибке очистка
+    возвращается в очередь с last_error, и порция заканчивается.
+    После каждой пачки спит elapsed * (1 - PURGE_DUTY_CYCLE) / PURGE_DUTY_CYCLE.
+    '''
+    import psycopg2
+
+    deadline = time.monotonic() + time_budget
+    summary = {'batches': 0, 'finished': [], 'errors': 0, 'busy_seconds': 0.0}
+    purge = None
+    while time.monotonic() < deadline:
+        if purge is None:
+            purge = claim_purge(cursor)
+            conn.commit()
+            if purge is None:
+                break
+        started = time.monotonic()
+        try:
+            cursor.execute('SET LOCAL lock_timeout = %s', (PURGE_LOCK_TIMEOUT_MS,))
+            if purge_batch(cursor, purge, limit):
+                summary['finished'].append(purge['server_id'])
+            conn.commit()
+            summary['batches'] += 1
+        except psycopg2.Error as exc:
+            conn.rollback()
+            summary['errors'] += 1
+            cursor.execute(
+                "UPDATE server_purges SET status = 'pending', last_error = %s, updated_at = CURRENT_TIMESTAMP "
+                'WHERE server_id = %s',
+                ((exc.pgerror or str(exc))[:1000], purge['server_id'])
+            )
+            conn.commit()
+            break
+        elapsed = time.monotonic() - started
+        summary['busy_seconds'] += elapsed
+        if purge is not None and purge['status'] == 'done':
+            purge = None
+        time.sleep(min(elapsed * (1 - PURGE_DUTY_CYCLE) / PURGE_DUTY_CYCLE, max(deadline - time.monotonic(), 0)))
+    summary['busy_seconds'] = round(summary['busy_seconds'], 3)
+    return summary
+
+
+def main() -> None:
+    import argparse
+
+    import pool
+    from runtime import cursor_class
+
+    parser = argparse.ArgumentParser(description='Фоновая очистка мягко удалённых серверов')
+    parser.add_argument('--once', action='store_true', help='одна порция PURGE_TIME_BUDGET и выход')
+    args = parser.parse_args()
+
+    while True:
+        with pool.connection() as conn:
+            with conn.cursor(cursor_factory=cursor_class()) as cursor:
+                summary = run_purges(conn, cursor)
+        print(summary, flush=True)
+        if args.once:
+            break
+        if not summary['batches'] or summary['errors']:
+            time.sleep(PURGE_IDLE_SECONDS)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+'''
+ETag/If-None-Match и короткоживущий кэш сериализованных GET-ответов внутри контейнера.
+Версия данных - сумма счётчиков изменений таблицы из table_version_stripes. Триггер
+увеличивает одну из 64 полос по номеру транзакции, так что параллельные писатели
+не ждут друг друга на одной строке, а версия, как и данные, меняется только при
+коммите. Проверка актуальности - одно чтение по первичному ключу.
+Копия модуля лежит в каждой функции backend/* - держите копии одинаковыми.
+'''
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Callable, List, Optional
+
+CACHE_TTL = float(os.environ.get('RESPONSE_CACHE_TTL', '2'))
+CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', '256'))
+CACHE_MAX_BODY = int(os.environ.get('RESPONSE_CACHE_MAX_BODY', str(1024 * 1024)))
+
+_lock = threading.Lock()
+_entries: 'OrderedDict[str, Dict[str, Any]]' = OrderedDict()
+
+
+def cache_key(event: Dict[str, Any]) -> str:
+    query_params = event.get('queryStringParameters') or {}
+    return '&'.join('%s=%s' % (name, query_params[name]) for name in sorted(query_params))
+
+
+def request_header(event: Dict[str, Any], name: str) -> Optional[str]:
+    for key, value in (event.get('headers') or {}).items():
+        if key.lower() == name.lower():
+            return value
+    return None
+
+
+def table_version(cursor: Any, tables: List[str]) -> str:
+    cursor.execute('''
+        SELECT table_name, SUM(version) AS version FROM table_version_stripes
+        WHERE table_name = ANY(%s)
+        GROUP BY table_name
+        ORDER BY table_name
+    ''', (tables,))
+    return '.'.join('%s:%s' % (row['table_name'], row['version']) for row in cursor.fetchall())
+
+
+def render(event: Dict[str, Any], entry: Dict[str, Any]) -> Dict[str, Any]:
+    headers = dict(entry['headers'])
+    headers['ETag'] = entry['etag']
+    headers['Cache-Control'] = 'no-cache'
+    headers['Access-Control-Expose-Headers'] = ', '.join(
+        filter(None, [headers.get('Access-Control-Expose-Headers'), 'ETag'])
+    )
+    if_none_match = request_header(event, 'If-None-Match')
+    if if_none_match and entry['etag'] in [tag.strip() for tag in if_none_match.split(',')]:
+        return {'statusCode': 304, 'headers': headers, 'body': '', 'isBase64Encoded': False}
+    return {'statusCode': entry['statusCode'], 'headers': headers, 'body': entry['body'], 'isBase64Encoded': False}
+
+
+def lookup(event: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    '''
+    Ответ из кэша без похода в БД, пока не истёк TTL и в этом контейнере не было записей.
+    '''
+    key = cache_key(event)
+    with _lock:
+        entry = _entries.get(key)
+        if not entry or entry['expires'] < time.monotonic():
+            return None
+        _entries.move_to_end(key)
+    return render(event, entry)
+
+
+def fetch(event: Dict[str, Any], cursor: Any, tables: List[str],
+          produce: Callable[[], Dict[str, Any]]) -> Dict[str, Any]:
+    '''
+    Сверяет версию таблиц: если она не менялась, отдаёт сохранённое тело (или 304),
+    иначе строит ответ через produce() и кладёт его в кэш. Версия читается до данных,
+    так что кэш может оказаться только новее своей версии, но не старее.
+    '''
+    import hashlib
+
+    key = cache_key(event)
+    version = table_version(cursor, tables)
+    with _lock:
+        entry = _entries.get(key)
+        if entry and entry['version'] == version:
+            entry['expires'] = time.monotonic() + CACHE_TTL
+            _entries.move_to_end(key)
+        else:
+            entry = None
+    if entry:
+        return render(event, entry)
+
+    response = produce()
+    if response['statusCode'] != 200 or len(response['body']) > CACHE_MAX_BODY:
+        return response
+
+    entry = {
+        'version': version,
+        'etag': '"%s"' % hashlib.sha1((key + '|' + version + '|' + response['body']).encode('utf-8')).hexdigest()[:20],
+        'statusCode': response['statusCode'],
+        'headers': response['headers'],
+        'body': response['body'],
+        'expires': time.monotonic() + CACHE_TTL
+    }
+    with _lock:
+        _entries[key] = entry
+        _entries.move_to_end(key)
+        while len(_entries) > CACHE_MAX_ENTRIES:
+            _entries.popitem(last=False)
+    return render(event, entry)
+
+
+def invalidate() -> None:
+    with _lock:
+        _entries.clear()
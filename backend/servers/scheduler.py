@@ -0,0 +1,369 @@
+'''
+Размещение серверов по хостам. Запускаемый и работающий сервер держит резерв памяти и CPU
+на своём хосте (minecraft_servers.reserved_*), сумма резервов хоста лежит в hosts.reserved_*.
+Резерв ставится при переходе в starting и снимается в stopped/error и при удалении,
+поэтому созданные, но не запущенные серверы места на хостах не занимают.
+Потребность считается по профилю версии и max_players, хост выбирается best-fit
+(PLACEMENT_STRATEGY=binpack: самый заполненный из подходящих, чтобы крупным серверам
+оставались целые хосты) или spread (самый свободный).
+
+План строится в Python по снимку hosts без блокировок, а резерв ставится одним условным
+UPDATE на хост: если параллельная транзакция успела занять место, условие не пройдёт,
+и серверы этого хоста перепланируются по свежему снимку. Серверы с хостов в статусе
+draining при старте и в rebalance переносятся на активные хосты вместе с портом.
+'''
+import os
+from typing import Dict, Any, Iterable, List, NamedTuple, Optional, Sequence, Tuple
+
+from ports import allocate_ports, bind_ports, release_ports
+
+PLACEMENT_STRATEGY = os.environ.get('PLACEMENT_STRATEGY', 'binpack')
+PLACEMENT_ATTEMPTS = 3
+MEMORY_STEP_MB = 256
+HOST_STATUSES = ('active', 'draining')
+MOVABLE_STATUSES = ('stopped', 'error')
+# (минимальная версия, память МБ, МБ на игрока, CPU милли-ядер, милли-ядер на игрока)
+RESOURCE_PROFILES = (
+    ((1, 18), 2048, 48, 1000, 25),
+    ((1, 13), 1536, 32, 750, 20),
+    ((0,), 1024, 24, 500, 15)
+)
+
+
+class NoCapacity(Exception):
+    pass
+
+
+class Demand(NamedTuple):
+    key: Any
+    memory_mb: int
+    cpu_millis: int
+    host: Optional[str] = None
+    pinned: bool = False
+
+
+class HostState:
+    __slots__ = ('name', 'memory_mb', 'cpu_millis', 'free_memory_mb', 'free_cpu_millis')
+
+    def __init__(self, name: str, memory_mb: int, cpu_millis: int, reserved_memory_mb: int = 0,
+                 reserved_cpu_millis: int = 0) -> None:
+        self.name = name
+        self.memory_mb = memory_mb
+        self.cpu_millis = cpu_millis
+        self.free_memory_mb = memory_mb - reserved_memory_mb
+        self.free_cpu_millis = cpu_millis - reserved_cpu_millis
+
+    def fits(self, demand: Demand) -> bool:
+        return demand.memory_mb <= self.free_memory_mb and demand.cpu_millis <= self.free_cpu_millis
+
+    def take(self, demand: Demand) -> None:
+        self.free_memory_mb -= demand.memory_mb
+        self.free_cpu_millis -= demand.cpu_millis
+
+
+def parse_version(version: Any) -> Tuple[int, ...]:
+    '''
+    '1.20.4' -> (1, 20, 4); суффиксы вроде '-pre1' отбрасываются, разбор идёт до первой нечисловой части.
+    '''
+    parts = []
+    for part in str(version or '').split('.'):
+        digits = ''
+        for char in part:
+            if not char.isdigit():
+                break
+            digits += char
+        if not digits:
+            break
+        parts.append(int(digits))
+    return tuple(parts)
+
+
+def server_demand(key: Any, version: Any, max_players: Any, host: Optional[str] = None,
+                  pinned: bool = False) -> Demand:
+    '''
+    Потребность сервера по профилю версии; нераспознанная версия считается новейшей.
+    Память округляется вверх до MEMORY_STEP_MB.
+    '''
+    parsed = parse_version(version) or (99,)
+    profile = next(profile for profile in RESOURCE_PROFILES if parsed >= profile[0])
+    _, memory_mb, memory_per_player, cpu_millis, cpu_per_player = profile
+    players = max(int(max_players or 0), 1)
+    memory = memory_mb + memory_per_player * players
+    memory = -(-memory // MEMORY_STEP_MB) * MEMORY_STEP_MB
+    return Demand(key, memory, cpu_millis + cpu_per_player * players, host, pinned)
+
+
+def fit_score(host: HostState, demand: Demand) -> float:
+    '''
+    Доля хоста, занятая после размещения, по памяти и CPU; больше - плотнее.
+    '''
+    memory_used = 1 - (host.free_memory_mb - demand.memory_mb) / host.memory_mb
+    cpu_used = 1 - (host.free_cpu_millis - demand.cpu_millis) / host.cpu_millis
+    return memory_used + cpu_used
+
+
+def choose_host(hosts: Iterable[HostState], demand: Demand, strategy: str = PLACEMENT_STRATEGY) -> Optional[HostState]:
+    sign = -1 if strategy == 'spread' else 1
+    best = None
+    best_score = 0.0
+    for host in hosts:
+        if host.fits(demand):
+            score = sign * fit_score(host, demand)
+            if best is None or score > best_score:
+                best = host
+                best_score = score
+    return best
+
+
+def plan(hosts: Dict[str, HostState], demands: Sequence[Demand],
+         strategy: str = PLACEMENT_STRATEGY) -> Dict[Any, str]:
+    '''
+    Раскладывает потребности по хостам (по убыванию памяти - first-fit decreasing),
+    уменьшая свободное место в hosts. Предпочтительный host берётся, если влезает;
+    закреплённый (pinned) - только он. Не влезшие ключи в результат не попадают.
+    '''
+    placed = {}
+    for demand in sorted(demands, key=lambda item: (-item.memory_mb, -item.cpu_millis)):
+        preferred = hosts.get(demand.host) if demand.host else None
+        if preferred is not None and preferred.fits(demand):
+            host = preferred
+        elif demand.pinned:
+            continue
+        else:
+            host = choose_host(hosts.values(), demand, strategy)
+            if host is None:
+                continue
+        host.take(demand)
+        placed[demand.key] = host.name
+    return placed
+
+
+def load_hosts(cursor: Any) -> Dict[str, HostState]:
+    cursor.execute('''
+        SELECT name, memory_mb, cpu_millis, reserved_memory_mb, reserved_cpu_millis
+        FROM hosts WHERE status = 'active'
+    ''')
+    return {
+        row['name']: HostState(row['name'], row['memory_mb'], row['cpu_millis'],
+                               row['reserved_memory_mb'], row['reserved_cpu_millis'])
+        for row in cursor.fetchall()
+    }
+
+
+def reserve(cursor: Any, demands: Sequence[Demand]) -> Dict[Any, str]:
+    '''
+    Размещает и резервирует потребности. Возвращает {key: host} для получивших место;
+    для остальных ничего не записано.
+    '''
+    from psycopg2.extras import execute_values
+
+    placed: Dict[Any, str] = {}
+    pending = list(demands)
+    for _ in range(PLACEMENT_ATTEMPTS):
+        planned = plan(load_hosts(cursor), pending)
+        totals: Dict[str, List[int]] = {}
+        for demand in pending:
+            if demand.key in planned:
+                total = totals.setdefault(planned[demand.key], [0, 0])
+                total[0] += demand.memory_mb
+                total[1] += demand.cpu_millis
+        if not totals:
+            break
+        reserved = {row['name'] for row in execute_values(cursor, '''
+            UPDATE hosts AS h
+            SET reserved_memory_mb = h.reserved_memory_mb + v.memory_mb,
+                reserved_cpu_millis = h.reserved_cpu_millis + v.cpu_millis,
+                updated_at = CURRENT_TIMESTAMP
+            FROM (VALUES %s) AS v(name, memory_mb, cpu_millis)
+            WHERE h.name = v.name AND h.status = 'active'
+              AND h.reserved_memory_mb + v.memory_mb <= h.memory_mb
+              AND h.reserved_cpu_millis + v.cpu_millis <= h.cpu_millis
+            RETURNING h.name
+        ''', sorted((name,) + tuple(total) for name, total in totals.items()),
+            template='(%s, %s::integer, %s::integer)', page_size=len(totals), fetch=True)}
+        for demand in pending:
+            if planned.get(demand.key) in reserved:
+                placed[demand.key] = planned[demand.key]
+        pending = [demand for demand in pending if demand.key not in placed]
+        if not pending or len(reserved) == len(totals):
+            break
+    return placed
+
+
+def reserve_one(cursor: Any, demand: Demand) -> str:
+    placed = reserve(cursor, [demand])
+    if demand.key not in placed:
+        raise NoCapacity('No host has %d MB of memory and %d CPU millicores free%s' % (
+            demand.memory_mb, demand.cpu_millis, ' on host %s' % demand.host if demand.pinned else ''))
+    return placed[demand.key]
+
+
+def release_capacity(cursor: Any, server_ids: List[Any]) -> None:
+    '''
+    Снимает резервы серверов с их хостов и обнуляет reserved_* у серверов.
+    '''
+    cursor.execute('''
+        WITH released AS (
+            SELECT id, host, reserved_memory_mb, reserved_cpu_millis FROM minecraft_servers
+            WHERE id = ANY(%s::integer[]) AND reserved_memory_mb IS NOT NULL
+            ORDER BY id
+            FOR UPDATE
+        ), cleared AS (
+            UPDATE minecraft_servers s SET reserved_memory_mb = NULL, reserved_cpu_millis = NULL
+            FROM released r WHERE s.id = r.id
+        )
+        UPDATE hosts h
+        SET reserved_memory_mb = h.reserved_memory_mb - r.memory_mb,
+            reserved_cpu_millis = h.reserved_cpu_millis - r.cpu_millis,
+            updated_at = CURRENT_TIMESTAMP
+        FROM (
+            SELECT host, SUM(reserved_memory_mb) AS memory_mb, SUM(reserved_cpu_millis) AS cpu_millis
+            FROM released GROUP BY host
+        ) r
+        WHERE h.name = r.host
+    ''', (server_ids,))
+
+
+def place_servers(cursor: Any, server_ids: List[Any], statuses: Sequence[str],
+                  reserve_capacity: bool = True) -> List[int]:
+    '''
+    Даёт резерв серверам в статусах statuses, у которых его нет, или чей хост не активен.
+    Сервер остаётся на своём хосте, если тот активен и на нём есть место, иначе переезжает
+    на выбранный хост с новым портом. С reserve_capacity=False сервер только переезжает
+    по плану, резерв не ставится. Возвращает id серверов, которым места не нашлось:
+    для них ничего не изменено.
+    '''
+    from psycopg2.extras import execute_values
+
+    if not server_ids:
+        return []
+    cursor.execute('''
+        SELECT s.id, s.host, s.port, s.version, s.max_players, s.reserved_memory_mb, h.status AS host_status
+        FROM minecraft_servers s
+        LEFT JOIN hosts h ON h.name = s.host
+        WHERE s.id = ANY(%s::integer[]) AND s.status = ANY(%s) AND s.deleted_at IS NULL
+          AND (s.reserved_memory_mb IS NULL OR h.status IS DISTINCT FROM 'active')
+        ORDER BY s.id
+        FOR UPDATE OF s
+    ''', (server_ids, list(statuses)))
+    servers = {row['id']: row for row in cursor.fetchall()}
+    if not servers:
+        return []
+
+    demands = [
+        server_demand(server['id'], server['version'], server['max_players'],
+                      server['host'] if server['host_status'] == 'active' else None)
+        for server in servers.values()
+    ]
+    placed = reserve(cursor, demands) if reserve_capacity else plan(load_hosts(cursor), demands)
+    moved = [server_id for server_id, host in placed.items() if host != servers[server_id]['host']]
+    release_capacity(cursor, [server_id for server_id in placed if servers[server_id]['reserved_memory_mb'] is not None])
+    if moved:
+        release_ports(cursor, moved)
+
+    ports: Dict[int, int] = {}
+    by_host: Dict[str, List[int]] = {}
+    for server_id in sorted(moved):
+        by_host.setdefault(placed[server_id], []).append(server_id)
+    for host, host_servers in sorted(by_host.items()):
+        ports.update(zip(host_servers, allocate_ports(cursor, host, len(host_servers))))
+
+    if placed:
+        rows = []
+        for server_id, host in sorted(placed.items()):
+            server = servers[server_id]
+            demand = server_demand(server_id, server['version'], server['max_players'])
+            rows.append((server_id, host, ports.get(server_id, server['port']),
+                         demand.memory_mb if reserve_capacity else None,
+                         demand.cpu_millis if reserve_capacity else None))
+        execute_values(cursor, '''
+            UPDATE minecraft_servers AS s
+            SET host = v.host, port = v.port, reserved_memory_mb = v.memory_mb,
+                reserved_cpu_millis = v.cpu_millis, updated_at = CURRENT_TIMESTAMP
+            FROM (VALUES %s) AS v(id, host, port, memory_mb, cpu_millis)
+            WHERE s.id = v.id
+        ''', rows, template='(%s::integer, %s, %s::integer, %s::integer, %s::integer)', page_size=len(rows))
+        if moved:
+            bind_ports(cursor, [{'id': server_id, 'host': placed[server_id], 'port': ports[server_id]} for server_id in moved])
+    return sorted(set(servers) - set(placed))
+
+
+def rebalance(cursor: Any, limit: int, host: Optional[str] = None) -> Dict[str, Any]:
+    '''
+    Переносит остановленные серверы с хостов draining (или только с host) на активные.
+    Резерв им не ставится - его получат при старте. Работающие серверы не трогаются:
+    они переедут при следующем старте.
+    '''
+    cursor.execute('''
+        SELECT s.id FROM minecraft_servers s
+        JOIN hosts h ON h.name = s.host
+        WHERE h.status = 'draining' AND (%s::varchar IS NULL OR h.name = %s)
+          AND s.status = ANY(%s) AND s.deleted_at IS NULL
+        ORDER BY s.id
+        LIMIT %s
+        FOR UPDATE OF s SKIP LOCKED
+    ''', (host, host, list(MOVABLE_STATUSES), limit))
+    server_ids = [row['id'] for row in cursor.fetchall()]
+    unplaced = place_servers(cursor, server_ids, MOVABLE_STATUSES, False) if server_ids else []
+
+    cursor.execute('''
+        SELECT COUNT(*) FILTER (WHERE s.status = ANY(%s)) AS stopped,
+               COUNT(*) FILTER (WHERE NOT s.status = ANY(%s)) AS running
+        FROM minecraft_servers s
+        JOIN hosts h ON h.name = s.host
+        WHERE h.status = 'draining' AND (%s::varchar IS NULL OR h.name = %s) AND s.deleted_at IS NULL
+    ''', (list(MOVABLE_STATUSES), list(MOVABLE_STATUSES), host, host))
+    remaining = cursor.fetchone()
+    return {
+        'moved': len(server_ids) - len(unplaced),
+        'unplaced': unplaced,
+        'remaining_stopped': remaining['stopped'],
+        'remaining_running': remaining['running']
+    }
+
+
+def render_host(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        'name': row['name'],
+        'status': row['status'],
+        'memory_mb': row['memory_mb'],
+        'cpu_millis': row['cpu_millis'],
+        'reserved_memory_mb': row['reserved_memory_mb'],
+        'reserved_cpu_millis': row['reserved_cpu_millis'],
+        'memory_utilization': round(row['reserved_memory_mb'] / row['memory_mb'], 4) if row['memory_mb'] else None,
+        'cpu_utilization': round(row['reserved_cpu_millis'] / row['cpu_millis'], 4) if row['cpu_millis'] else None,
+        'server_count': row.get('server_count', 0)
+    }
+
+
+def list_hosts(cursor: Any) -> List[Dict[str, Any]]:
+    cursor.execute('''
+        SELECT h.*, COALESCE(c.server_count, 0) AS server_count
+        FROM hosts h
+        LEFT JOIN (
+            SELECT host, COUNT(*) AS server_count FROM minecraft_servers
+            WHERE deleted_at IS NULL GROUP BY host
+        ) c ON c.host = h.name
+        ORDER BY h.name
+    ''')
+    return [render_host(row) for row in cursor.fetchall()]
+
+
+def save_host(cursor: Any, name: str, memory_mb: int, cpu_millis: int) -> Dict[str, Any]:
+    cursor.execute('''
+        INSERT INTO hosts (name, memory_mb, cpu_millis) VALUES (%s, %s, %s)
+        ON CONFLICT (name) DO UPDATE
+        SET memory_mb = EXCLUDED.memory_mb, cpu_millis = EXCLUDED.cpu_millis, updated_at = CURRENT_TIMESTAMP
+        RETURNING *
+    ''', (name, memory_mb, cpu_millis))
+    return render_host(cursor.fetchone())
+
+
+def set_host_status(cursor: Any, name: str, status: str) -> Optional[Dict[str, Any]]:
+    cursor.execute('''
+        UPDATE hosts SET status = %s, updated_at = CURRENT_TIMESTAMP
+        WHERE name = %s
+        RETURNING *
+    ''', (status, name))
+    row = cursor.fetchone()
+    return render_host(row) if row else None
@@ -0,0 +1,83 @@
+'''
+Фильтры списка серверов: version, status, gamemode (значение или список через запятую)
+и q - подстрока имени. Фильтры по колонкам сохраняют обычный порядок created_at DESC, id DESC
+и идут по частичным btree-индексам (колонка, created_at, id); q ищется ILIKE по триграммному
+GIN-индексу, а выдача ранжируется similarity(server_name, q) с курсором по (rank, id).
+'''
+import base64
+from typing import Any, List, Mapping, NamedTuple, Optional, Tuple
+
+FILTER_COLUMNS = ('version', 'status', 'gamemode')
+MAX_FILTER_VALUES = 20
+MAX_QUERY_LENGTH = 100
+
+
+class ServerFilter(NamedTuple):
+    conditions: List[str]
+    params: List[Any]
+    query: Optional[str]
+
+
+def escape_like(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def parse_filters(query_params: Mapping[str, Any]) -> ServerFilter:
+    conditions = []
+    params: List[Any] = []
+    for column in FILTER_COLUMNS:
+        value = query_params.get(column)
+        if not value:
+            continue
+        values = [item.strip() for item in value.split(',') if item.strip()]
+        if not values or len(values) > MAX_FILTER_VALUES:
+            raise ValueError('%s must list 1 to %d values' % (column, MAX_FILTER_VALUES))
+        if len(values) == 1:
+            conditions.append(column + ' = %s')
+            params.append(values[0])
+        else:
+            conditions.append(column + ' = ANY(%s)')
+            params.append(values)
+
+    search = (query_params.get('q') or '').strip()
+    if len(search) > MAX_QUERY_LENGTH:
+        raise ValueError('q must be at most %d characters' % MAX_QUERY_LENGTH)
+    if search:
+        conditions.append('server_name ILIKE %s')
+        params.append('%' + escape_like(search) + '%')
+    return ServerFilter(conditions, params, search or None)
+
+
+def where_clause(filters: ServerFilter) -> str:
+    return ''.join('AND ' + condition + ' ' for condition in filters.conditions)
+
+
+def encode_rank_cursor(rank: float, server_id: int) -> str:
+    raw = 'rank|{!r}|{}'.format(rank, server_id)
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_rank_cursor(token: str) -> Tuple[float, int]:
+    kind, rank, server_id = base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8').split('|')
+    if kind != 'rank':
+        raise ValueError('Cursor does not belong to a ranked search')
+    return float(rank), int(server_id)
+
+
+def ranked_query(select_list: str, filters: ServerFilter, after: Optional[Tuple[float, int]],
+                 limit: int) -> Tuple[str, List[Any]]:
+    '''
+    Страница поиска по q: последняя колонка - rank. Курсор (rank, id) из предыдущей страницы
+    сравнивается с тем же выражением similarity, поэтому страницы не пересекаются.
+    '''
+    sql = (
+        'SELECT ' + select_list + ', similarity(server_name, %s) AS rank FROM minecraft_servers '
+        'WHERE deleted_at IS NULL ' + where_clause(filters)
+    )
+    params: List[Any] = [filters.query] + filters.params
+    if after:
+        sql += 'AND (similarity(server_name, %s), id) < (%s, %s) '
+        params.extend([filters.query, after[0], after[1]])
+    sql += 'ORDER BY rank DESC, id DESC LIMIT %s'
+    params.append(limit)
+    return sql, params
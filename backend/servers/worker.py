@@ -0,0 +1,159 @@
+'''
+Воркер провижининга: python worker.py в каталоге функции, рядом с purge.py.
+
+Главный цикл забирает задания из provisioning_jobs (jobs.claim) не больше, чем свободно
+потоков в пуле (--concurrency), и раздаёт их потокам; каждое задание выполняется на своём
+соединении из pool, шаги отмечаются в задании и видны через GET ?action=jobs.
+Успешный start переводит сервер starting -> running, stop - stopping -> stopped;
+исчерпавшее попытки задание переводит сервер в error. Задание stop выполняется и для
+удалённого сервера (status = 'deleting'): его очистка ждёт, пока остановка закончится. SIGTERM/SIGINT прекращают выдачу,
+воркер дожидается начатых заданий и выходит.
+'''
+import os
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Dict, Any, List, Set
+
+import jobs
+import lifecycle
+import provisioner
+
+WORKER_CONCURRENCY = int(os.environ.get('WORKER_CONCURRENCY', '4'))
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', '1'))
+EXPECTED_STATUS = {'start': 'starting', 'stop': 'stopping'}
+RUNNABLE_STATUSES = {'start': ('starting',), 'stop': ('stopping', 'deleting')}
+FINAL_STATUS = {'start': 'running', 'stop': 'stopped'}
+
+
+class LeaseLost(Exception):
+    pass
+
+
+def load_server(cursor: Any, server_id: Any) -> Any:
+    cursor.execute(
+        'SELECT ' + ', '.join(provisioner.SERVER_COLUMNS) + ' FROM minecraft_servers WHERE id = %s',
+        (server_id,)
+    )
+    return cursor.fetchone()
+
+
+def fail_server(cursor: Any, job: Dict[str, Any]) -> None:
+    lifecycle.transition(cursor, job['server_id'], 'error', EXPECTED_STATUS[job['kind']])
+
+
+def run_job(job: Dict[str, Any]) -> Dict[str, Any]:
+    '''
+    Выполняет одно задание. Сервер, который успел уйти из ожидаемого статуса (его удалили
+    или остановили до начала запуска), не трогается - задание отменяется.
+    '''
+    import psycopg2
+
+    import pool
+    from runtime import cursor_class
+
+    started = time.monotonic()
+    summary = {'job': job['id'], 'server_id': job['server_id'], 'kind': job['kind'], 'attempt': job['attempts']}
+    with pool.connection() as conn:
+        with conn.cursor(cursor_factory=cursor_class()) as cursor:
+            def report(step: str, progress: int) -> None:
+                if not jobs.heartbeat(cursor, job, step, progress):
+                    conn.rollback()
+                    raise LeaseLost('Job %s is no longer leased by this worker' % job['id'])
+                conn.commit()
+
+            server = load_server(cursor, job['server_id'])
+            if not server or server['status'] not in RUNNABLE_STATUSES[job['kind']]:
+                jobs.finish(cursor, job, 'cancelled', 'Server is no longer %s' % EXPECTED_STATUS[job['kind']])
+                conn.commit()
+                summary['status'] = 'cancelled'
+                return summary
+
+            try:
+                provisioner.provision(job, server, provisioner.get_runtime(), report)
+                if jobs.finish(cursor, job, 'succeeded'):
+                    lifecycle.transition(
+                        cursor, job['server_id'], FINAL_STATUS[job['kind']], EXPECTED_STATUS[job['kind']]
+                    )
+                conn.commit()
+                summary['status'] = 'succeeded'
+            except LeaseLost as exc:
+                summary['status'] = 'lease_lost'
+                summary['error'] = str(exc)
+            except (psycopg2.OperationalError, psycopg2.InterfaceError):
+                raise
+            except Exception as exc:
+                conn.rollback()
+                message = getattr(exc, 'pgerror', None) or str(exc) or exc.__class__.__name__
+                status = jobs.retry(cursor, job, message)
+                if status == 'failed':
+                    fail_server(cursor, job)
+                conn.commit()
+                summary['status'] = status or 'lease_lost'
+                summary['error'] = message
+    summary['seconds'] = round(time.monotonic() - started, 3)
+    return summary
+
+
+def log_result(future: Any) -> None:
+    try:
+        print(future.result(), flush=True)
+    except Exception as exc:
+        print({'error': repr(exc)}, flush=True)
+
+
+def claim_jobs(worker_id: str, limit: int) -> List[Dict[str, Any]]:
+    import pool
+    from runtime import cursor_class
+
+    with pool.connection() as conn:
+        with conn.cursor(cursor_factory=cursor_class()) as cursor:
+            for job in jobs.recover_stale(cursor):
+                fail_server(cursor, job)
+            claimed = jobs.claim(cursor, worker_id, limit)
+            conn.commit()
+    return claimed
+
+
+def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Воркер заданий запуска и остановки серверов')
+    parser.add_argument('--concurrency', type=int, default=WORKER_CONCURRENCY, help='число потоков пула')
+    parser.add_argument('--worker-id', default='%s:%d' % (socket.gethostname(), os.getpid()))
+    parser.add_argument('--once', action='store_true', help='выполнить готовые задания и выйти')
+    args = parser.parse_args()
+
+    os.environ.setdefault('DB_POOL_MAX_SIZE', str(args.concurrency + 1))
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+    signal.signal(signal.SIGINT, lambda signum, frame: stopping.set())
+
+    active: Set[Any] = set()
+    with ThreadPoolExecutor(max_workers=args.concurrency, thread_name_prefix='job') as executor:
+        while not stopping.is_set():
+            active = {future for future in active if not future.done()}
+            claimed = []
+            if len(active) < args.concurrency:
+                try:
+                    claimed = claim_jobs(args.worker_id, args.concurrency - len(active))
+                except Exception as exc:
+                    print({'error': repr(exc)}, flush=True)
+            for job in claimed:
+                future = executor.submit(run_job, job)
+                future.add_done_callback(log_result)
+                active.add(future)
+            if args.once and not claimed and not active:
+                break
+            if not claimed:
+                if active:
+                    wait(active, timeout=JOB_POLL_SECONDS, return_when=FIRST_COMPLETED)
+                else:
+                    stopping.wait(JOB_POLL_SECONDS)
+        wait(active)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,151 @@
+'''
+Кэш jar-артефактов (backend/servers/artifacts.py) без Postgres и сети: апстрим - локальный
+каталог с синтетическими jar, чтение из него ограничено --upstream-mbps, как загрузка.
+
+Сценарий: --starts запусков серверов потоком из --threads потоков, версия каждого запуска
+выбирается по Ципфу из --versions версий (несколько популярных версий на большинство серверов).
+Каждый запуск материализует jar в свой каталог сервера. Отчёт: сколько раз и сколько байт
+скачано из апстрима против наивного варианта (скачивание на каждый запуск), доля попаданий,
+вытеснения при --cache-mb, способы материализации и задержка p50/p95/p99.
+
+    python benchmarks/artifact_bench.py
+    python benchmarks/artifact_bench.py --starts 2000 --versions 30 --cache-mb 400 --output artifacts.json
+'''
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, BinaryIO, List, Optional, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'backend', 'servers'))
+
+import artifacts  # noqa: E402
+
+
+class ThrottledStream:
+    def __init__(self, stream: BinaryIO, bytes_per_second: float) -> None:
+        self.stream = stream
+        self.bytes_per_second = bytes_per_second
+
+    def read(self, size: int) -> bytes:
+        block = self.stream.read(size)
+        time.sleep(len(block) / self.bytes_per_second)
+        return block
+
+    def __enter__(self) -> 'ThrottledStream':
+        return self
+
+    def __exit__(self, *exc: Any) -> None:
+        self.stream.close()
+
+
+class CountingFetcher(artifacts.DirectoryFetcher):
+    def __init__(self, root: str, bytes_per_second: float) -> None:
+        super().__init__(root)
+        self.bytes_per_second = bytes_per_second
+        self.lock = threading.Lock()
+        self.calls = 0
+
+    def open(self, flavour: str, version: str) -> Tuple[Any, Optional[str]]:
+        with self.lock:
+            self.calls += 1
+        stream, checksum = super().open(flavour, version)
+        return ThrottledStream(stream, self.bytes_per_second), checksum
+
+
+def make_upstream(root: str, versions: int, jar_mb: float, rnd: random.Random) -> List[str]:
+    names = ['1.%d.%d' % (8 + index // 3, index % 3) for index in range(versions)]
+    os.makedirs(os.path.join(root, artifacts.DEFAULT_FLAVOUR))
+    for name in names:
+        data = rnd.randbytes(int(jar_mb * 1024 * 1024))
+        path = os.path.join(root, artifacts.DEFAULT_FLAVOUR, name + '.jar')
+        with open(path, 'wb') as output:
+            output.write(data)
+        with open(path + '.sha256', 'w') as output:
+            output.write(hashlib.sha256(data).hexdigest() + '  ' + name + '.jar\n')
+    return names
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+def run(args: argparse.Namespace, workdir: str) -> Dict[str, Any]:
+    rnd = random.Random(args.seed)
+    names = make_upstream(os.path.join(workdir, 'upstream'), args.versions, args.jar_mb, rnd)
+    weights = [1 / (rank + 1) ** args.zipf for rank in range(len(names))]
+    plan = rnd.choices(names, weights, k=args.starts)
+
+    fetcher = CountingFetcher(os.path.join(workdir, 'upstream'), args.upstream_mbps * 1024 * 1024 / 8)
+    cache = artifacts.ArtifactCache(os.path.join(workdir, 'cache'), fetcher, int(args.cache_mb * 1024 * 1024))
+    latencies: List[float] = []
+    latencies_lock = threading.Lock()
+
+    def start(index: int) -> None:
+        started = time.perf_counter()
+        cache.materialize(artifacts.DEFAULT_FLAVOUR, plan[index],
+                          os.path.join(workdir, 'servers', str(index), 'server.jar'))
+        with latencies_lock:
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.threads) as executor:
+        list(executor.map(start, range(args.starts)))
+    elapsed = time.perf_counter() - started
+
+    stats = cache.stats()
+    jar_bytes = int(args.jar_mb * 1024 * 1024)
+    return {
+        'starts': args.starts,
+        'versions': args.versions,
+        'distinct_versions_started': len(set(plan)),
+        'seconds': round(elapsed, 3),
+        'upstream_fetches': fetcher.calls,
+        'upstream_bytes': stats['fetched_bytes'],
+        'naive_upstream_bytes': args.starts * jar_bytes,
+        'hit_ratio': round(stats['hits'] / max(1, stats['hits'] + stats['misses']), 4),
+        'evictions': stats['evictions'],
+        'materialized': {method: stats[method] for method in ('hardlink', 'reflink', 'copy')},
+        'materialize_ms': {
+            'p50': round(percentile(latencies, 0.5) * 1000, 2),
+            'p95': round(percentile(latencies, 0.95) * 1000, 2),
+            'p99': round(percentile(latencies, 0.99) * 1000, 2)
+        }
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--starts', type=int, default=1000)
+    parser.add_argument('--versions', type=int, default=20)
+    parser.add_argument('--jar-mb', type=float, default=8)
+    parser.add_argument('--zipf', type=float, default=1.2, help='skew of version popularity')
+    parser.add_argument('--threads', type=int, default=16)
+    parser.add_argument('--upstream-mbps', type=float, default=800, help='upstream bandwidth, megabits/s')
+    parser.add_argument('--cache-mb', type=float, default=10240)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write the report as JSON')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='artifact-bench-')
+    try:
+        report = run(args, workdir)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
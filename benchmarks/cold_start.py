@@ -0,0 +1,114 @@
+'''
+Проверка бюджета холодного старта функций backend/*.
+
+Для каждой функции несколько раз запускает свежий интерпретатор, импортирует index
+и вызывает handler с preflight OPTIONS. Из -X importtime берутся собственное время
+модулей репозитория (сумма self по файлам каталога функции) - под бюджетом именно оно,
+стандартная библиотека от машины к машине стоит по-разному - и для справки кумулятивное
+время index. На этом пути не должны загружаться psycopg2 и модули маршрутов:
+всё, кроме CORE_MODULES, импортируется внутри обработчиков. Перед замером
+байткод функций обновляется через compileall, чтобы результат не зависел от того,
+успел ли устареть __pycache__ после правок.
+
+Код возврата 1, если медиана превысила бюджет, драйвер или модуль маршрута подгрузился,
+поэтому скрипт годится как проверка перед деплоем:
+
+    python benchmarks/cold_start.py --budget-ms 10
+'''
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, Any, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCTIONS = ('servers', 'files', 'databases')
+DEFAULT_BUDGET_MS = 10.0
+CORE_MODULES = frozenset(('index', 'runtime', 'pool', 'response_cache', 'tracing', 'row_encoder', 'storage', 'directories'))
+
+PROBE = '''
+import json, sys, time
+started = time.perf_counter()
+import index
+response = index.handler({'httpMethod': 'OPTIONS'}, None)
+print(json.dumps({
+    'status': response['statusCode'],
+    'handler_ms': (time.perf_counter() - started) * 1000,
+    'psycopg2_loaded': 'psycopg2' in sys.modules
+}))
+'''
+
+
+def import_times(stderr: str) -> Dict[str, Tuple[int, int]]:
+    '''
+    {модуль: (self, кумулятивное)} из вывода -X importtime, микросекунды.
+    '''
+    times: Dict[str, Tuple[int, int]] = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        parts = [part.strip() for part in line[len('import time:'):].split('|')]
+        if len(parts) == 3 and parts[0].isdigit():
+            times[parts[2]] = (int(parts[0]), int(parts[1]))
+    return times
+
+
+def probe(function: str) -> Dict[str, Any]:
+    directory = os.path.join(ROOT, 'backend', function)
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE='1', TRACE_LOG='0')
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', PROBE],
+        cwd=directory, env=env, capture_output=True, text=True, check=True
+    )
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    times = import_times(completed.stderr)
+    own = {name: times[name][0] for name in times if os.path.exists(os.path.join(directory, name + '.py'))}
+    result['import_ms'] = times['index'][1] / 1000
+    result['own_ms'] = sum(own.values()) / 1000
+    result['route_modules'] = sorted(set(own) - CORE_MODULES)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=7)
+    parser.add_argument('--budget-ms', type=float, default=float(os.environ.get('COLD_START_BUDGET_MS', DEFAULT_BUDGET_MS)))
+    parser.add_argument('--functions', nargs='*', default=list(FUNCTIONS))
+    args = parser.parse_args()
+
+    subprocess.run(
+        [sys.executable, '-m', 'compileall', '-q'] + [os.path.join(ROOT, 'backend', name) for name in args.functions],
+        check=True
+    )
+
+    failures: List[str] = []
+    print('%-10s %12s %12s %12s %10s' % ('function', 'own p50', 'import p50', 'handler p50', 'psycopg2'))
+    for function in args.functions:
+        runs = [probe(function) for _ in range(args.runs)]
+        own_ms = statistics.median(run['own_ms'] for run in runs)
+        import_ms = statistics.median(run['import_ms'] for run in runs)
+        handler_ms = statistics.median(run['handler_ms'] for run in runs)
+        loaded = any(run['psycopg2_loaded'] for run in runs)
+        print('%-10s %10.2fms %10.2fms %10.2fms %10s' % (
+            function, own_ms, import_ms, handler_ms, 'loaded' if loaded else '-'
+        ))
+        if any(run['status'] != 200 for run in runs):
+            failures.append('%s: OPTIONS did not return 200' % function)
+        if loaded:
+            failures.append('%s: psycopg2 imported on the OPTIONS path' % function)
+        if runs[0]['route_modules']:
+            failures.append('%s: route modules imported on the OPTIONS path: %s' % (
+                function, ', '.join(runs[0]['route_modules'])
+            ))
+        if own_ms > args.budget_ms:
+            failures.append('%s: own modules %.2fms exceed budget %.2fms' % (function, own_ms, args.budget_ms))
+
+    for failure in failures:
+        print('FAIL ' + failure)
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == '__main__':
+    main()
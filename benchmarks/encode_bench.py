@@ -0,0 +1,145 @@
+'''
+Бенчмарк сериализации списков: строк в секунду до и после перехода на кортежи
+и скомпилированные кодировщики строк (backend/*/row_encoder.py).
+
+Без флагов сравнивает в памяти на синтетических строках minecraft_servers:
+  dict_rows      - как было: RealDictRow -> новый dict на строку -> json.dumps;
+  tuple_encoder  - кортежи + compile_row_encoder.
+
+С --database дополнительно гоняет страницы по живому Postgres (локальный через
+initdb/pg_ctl или BENCH_DATABASE_URL, как handlers_bench.py):
+  sql_dict_rows  - RealDictCursor + dict на строку + json.dumps;
+  handler_python - handler servers с ROW_JSON_MODE=python (кортежи + кодировщик);
+  handler_pg     - handler servers с ROW_JSON_MODE=postgres (json_agg в БД).
+
+    python benchmarks/encode_bench.py --rows 200000
+    python benchmarks/encode_bench.py --database --servers 20000 --page 500
+'''
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Any, Callable, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVER_FIELDS = ('id', 'server_name', 'version', 'port', 'max_players', 'gamemode', 'difficulty', 'status', 'created_at')
+
+
+def synthetic_rows(count: int) -> List[tuple]:
+    started = datetime(2024, 1, 1)
+    return [(
+        i, 'server-%d' % i, '1.20.%d' % (i % 5), 20000 + i, 20 + i % 80,
+        ('survival', 'creative', 'adventure')[i % 3], 'normal', ('stopped', 'running')[i % 2],
+        started + timedelta(seconds=i, microseconds=i % 1000)
+    ) for i in range(count)]
+
+
+def dict_rows_json(rows: List[Dict[str, Any]]) -> str:
+    result = []
+    for server in rows:
+        item = {field: server[field] for field in SERVER_FIELDS}
+        item['created_at'] = server['created_at'].isoformat() if server['created_at'] else None
+        result.append(item)
+    return json.dumps({'servers': result})
+
+
+def measure(name: str, rows_per_call: int, call: Callable[[], Any], seconds: float) -> Dict[str, Any]:
+    call()
+    calls = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        call()
+        calls += 1
+    elapsed = time.perf_counter() - started
+    rate = rows_per_call * calls / elapsed
+    print('%-16s %12.0f rows/s  %8.3f ms/call' % (name, rate, elapsed / calls * 1000))
+    return {'rows_per_second': round(rate), 'ms_per_call': round(elapsed / calls * 1000, 3)}
+
+
+def bench_memory(rows_count: int, seconds: float) -> Dict[str, Any]:
+    sys.path.insert(0, os.path.join(ROOT, 'backend', 'servers'))
+    try:
+        from row_encoder import compile_row_encoder, encode_rows
+    finally:
+        sys.path.pop(0)
+
+    tuples = synthetic_rows(rows_count)
+    dicts = [dict(zip(SERVER_FIELDS, row)) for row in tuples]
+    encoder = compile_row_encoder(SERVER_FIELDS, SERVER_FIELDS)
+    assert json.loads(dict_rows_json(dicts[:10]))['servers'] == json.loads(encode_rows(encoder, tuples[:10]))
+
+    print('in-memory, %d rows per call' % rows_count)
+    return {
+        'dict_rows': measure('dict_rows', rows_count, lambda: dict_rows_json(dicts), seconds),
+        'tuple_encoder': measure('tuple_encoder', rows_count, lambda: encode_rows(encoder, tuples), seconds)
+    }
+
+
+def bench_database(servers: int, page: int, seconds: float) -> Dict[str, Any]:
+    import psycopg2
+    from psycopg2.extras import RealDictCursor
+    import handlers_bench
+
+    postgres = None
+    dsn = os.environ.get('BENCH_DATABASE_URL')
+    if not dsn:
+        postgres = handlers_bench.LocalPostgres()
+        dsn = postgres.start()
+    try:
+        os.environ['DATABASE_URL'] = dsn
+        os.environ['TRACE_LOG'] = '0'
+        os.environ['RESPONSE_CACHE_TTL'] = '0'
+        os.environ['RESPONSE_CACHE_MAX_BODY'] = '0'
+        handlers_bench.apply_migrations(dsn)
+        handlers_bench.seed(dsn, servers, 0, 0)
+
+        conn = psycopg2.connect(dsn)
+        query = 'SELECT ' + ', '.join(SERVER_FIELDS) + ' FROM minecraft_servers ORDER BY created_at DESC, id DESC LIMIT %s'
+
+        def sql_dict_rows() -> str:
+            with conn.cursor(cursor_factory=RealDictCursor) as cursor:
+                cursor.execute(query, (page,))
+                body = dict_rows_json(cursor.fetchall())
+            conn.rollback()
+            return body
+
+        event = {'httpMethod': 'GET', 'queryStringParameters': {'limit': str(page)}}
+        context = handlers_bench.Context('encode-bench')
+        handlers = {}
+        for mode in ('python', 'postgres'):
+            os.environ['ROW_JSON_MODE'] = mode
+            handlers[mode] = handlers_bench.load_handler('servers')
+
+        print('postgres, %d servers, page of %d rows' % (servers, page))
+        results = {'sql_dict_rows': measure('sql_dict_rows', page, sql_dict_rows, seconds)}
+        results['handler_python'] = measure('handler_python', page, lambda: handlers['python'](event, context), seconds)
+        results['handler_pg'] = measure('handler_pg', page, lambda: handlers['postgres'](event, context), seconds)
+        conn.close()
+        return results
+    finally:
+        if postgres:
+            postgres.stop()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000, help='строк на вызов в памяти')
+    parser.add_argument('--seconds', type=float, default=3.0, help='длительность каждого замера')
+    parser.add_argument('--database', action='store_true', help='замерить и путь через Postgres')
+    parser.add_argument('--servers', type=int, default=20000)
+    parser.add_argument('--page', type=int, default=500)
+    parser.add_argument('--output', help='куда записать JSON с результатами')
+    args = parser.parse_args()
+
+    output = {'memory': bench_memory(args.rows, args.seconds)}
+    if args.database:
+        output['database'] = bench_database(args.servers, args.page, args.seconds)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(output, output_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
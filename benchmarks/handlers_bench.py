@@ -0,0 +1,446 @@
+'''
+Нагрузочный бенчмарк функций backend/servers, backend/files и backend/databases.
+
+Поднимает локальный Postgres (initdb/pg_ctl из PATH или pg_config --bindir) либо
+берёт готовую базу из BENCH_DATABASE_URL, накатывает db_migrations/*.sql, засевает
+объёмы (по умолчанию 10k серверов, 1M файлов, 50k БД, 200 хостов) и вызывает handler каждой
+функции в процессе синтетическими событиями с заданной конкурентностью.
+
+Для каждого сценария пишет p50/p95/p99, пропускную способность, число SQL-запросов
+на вызов и пиковую память в JSON, который можно сравнить с прогоном другого коммита:
+
+    python benchmarks/handlers_bench.py --output bench.json
+    python benchmarks/handlers_bench.py --scale 0.1 --compare bench.json
+'''
+import argparse
+import importlib
+import json
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Callable, List, Optional, Tuple
+
+import psycopg2
+import psycopg2.extensions
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MIGRATIONS_DIR = os.path.join(ROOT, 'db_migrations')
+FUNCTIONS = ('servers', 'files', 'databases')
+BENCH_HOSTS = 200
+FUNCTION_MODULES = (
+    'index', 'pool', 'response_cache', 'tracing', 'runtime', 'row_encoder',
+    'change_feed', 'lifecycle', 'ports', 'cloning', 'purge', 'metrics', 'scheduler', 'search', 'jobs',
+    'directories', 'storage', 'blob_store', 'uploads', 'snapshots', 'admin', 'provisioning'
+)
+
+_query_counter = threading.local()
+
+
+class CountingConnection(psycopg2.extensions.connection):
+    '''
+    Соединение, чьи курсоры считают execute() в счётчике текущего потока.
+    '''
+    _factories: Dict[Any, Any] = {}
+
+    def cursor(self, *args: Any, **kwargs: Any) -> Any:
+        base = kwargs.get('cursor_factory') or self.cursor_factory or psycopg2.extensions.cursor
+        factory = self._factories.get(base)
+        if factory is None:
+            def execute(cursor: Any, query: Any, vars: Any = None) -> Any:
+                _query_counter.count = getattr(_query_counter, 'count', 0) + 1
+                return base.execute(cursor, query, vars)
+            factory = type('Counting' + base.__name__, (base,), {'execute': execute})
+            self._factories[base] = factory
+        kwargs['cursor_factory'] = factory
+        return super().cursor(*args, **kwargs)
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def postgres_bindir() -> str:
+    if shutil.which('initdb'):
+        return os.path.dirname(shutil.which('initdb'))
+    try:
+        return subprocess.check_output(['pg_config', '--bindir'], text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        raise SystemExit('initdb not found: install PostgreSQL or set BENCH_DATABASE_URL')
+
+
+class LocalPostgres:
+    def __init__(self) -> None:
+        self.bindir = postgres_bindir()
+        self.datadir = tempfile.mkdtemp(prefix='mc-bench-pg-')
+        self.port = free_port()
+
+    def start(self) -> str:
+        subprocess.run(
+            [os.path.join(self.bindir, 'initdb'), '-D', self.datadir, '-U', 'postgres', '-A', 'trust'],
+            check=True, stdout=subprocess.DEVNULL
+        )
+        subprocess.run([
+            os.path.join(self.bindir, 'pg_ctl'), '-D', self.datadir, '-w', '-l',
+            os.path.join(self.datadir, 'server.log'),
+            '-o', '-p %d -k %s -c max_connections=200 -c fsync=off' % (self.port, self.datadir),
+            'start'
+        ], check=True, stdout=subprocess.DEVNULL)
+        return 'postgresql://postgres@127.0.0.1:%d/postgres' % self.port
+
+    def stop(self) -> None:
+        subprocess.run(
+            [os.path.join(self.bindir, 'pg_ctl'), '-D', self.datadir, '-m', 'fast', 'stop'],
+            stdout=subprocess.DEVNULL
+        )
+        shutil.rmtree(self.datadir, ignore_errors=True)
+
+
+def apply_migrations(dsn: str) -> None:
+    conn = psycopg2.connect(dsn)
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        for name in sorted(os.listdir(MIGRATIONS_DIR)):
+            if name.endswith('.sql'):
+                with open(os.path.join(MIGRATIONS_DIR, name), encoding='utf-8') as migration:
+                    cursor.execute(migration.read())
+    conn.close()
+
+
+def seed(dsn: str, servers: int, files: int, databases: int) -> None:
+    '''
+    Засевает данные set-based запросами: на каждый сервер - дерево /world/region,
+    /plugins, /logs и равная доля файлов и баз.
+    '''
+    files_per_dir = max(1, files // max(1, servers * 4))
+    databases_per_server = max(1, databases // max(1, servers))
+    conn = psycopg2.connect(dsn)
+    with conn.cursor() as cursor:
+        cursor.execute('''
+            INSERT INTO minecraft_servers (server_name, version, port, max_players, gamemode, difficulty, status)
+            SELECT 'bench-' || g, '1.20.' || (g %% 5), 20000 + g, 20 + g %% 80,
+                   (ARRAY['survival', 'creative', 'adventure'])[1 + g %% 3], 'normal',
+                   (ARRAY['stopped', 'running'])[1 + g %% 2]
+            FROM generate_series(1, %s) g
+        ''', (servers,))
+        cursor.execute('''
+            UPDATE port_allocations a SET server_id = s.id, allocated_at = s.created_at
+            FROM minecraft_servers s
+            WHERE s.host = a.host AND s.port = a.port
+        ''')
+        cursor.execute('''
+            INSERT INTO hosts (name, memory_mb, cpu_millis)
+            SELECT 'bench-node-' || g, 262144, 128000 FROM generate_series(1, %s) g
+            ON CONFLICT (name) DO NOTHING
+        ''', (BENCH_HOSTS,))
+        cursor.execute('''
+            INSERT INTO port_allocations (host, port)
+            SELECT h.name, p FROM hosts h CROSS JOIN generate_series(19132, 21131) p
+            WHERE h.name LIKE 'bench-node-%%'
+            ON CONFLICT (host, port) DO NOTHING
+        ''')
+        cursor.execute('''
+            INSERT INTO server_directories (server_id, name, path, depth)
+            SELECT id, '', '/', 0 FROM minecraft_servers
+        ''')
+        cursor.execute('''
+            INSERT INTO server_directories (server_id, parent_id, name, path, depth)
+            SELECT r.server_id, r.id, d.name, '/' || d.name || '/', 1
+            FROM server_directories r
+            CROSS JOIN (VALUES ('world'), ('plugins'), ('logs')) AS d(name)
+            WHERE r.path = '/'
+        ''')
+        cursor.execute('''
+            INSERT INTO server_directories (server_id, parent_id, name, path, depth)
+            SELECT server_id, id, 'region', '/world/region/', 2
+            FROM server_directories WHERE path = '/world/'
+        ''')
+        cursor.execute('''
+            INSERT INTO server_files (server_id, file_path, file_name, file_size_bytes, file_type, directory_id)
+            SELECT d.server_id, rtrim(d.path, '/'), 'f' || g || '.dat', (g * 7919) %% 4194304, 'file', d.id
+            FROM server_directories d
+            CROSS JOIN generate_series(1, %s) g
+            WHERE d.path <> '/'
+        ''', (files_per_dir,))
+        cursor.execute('''
+            INSERT INTO server_databases (server_id, db_name, db_size_bytes, status, size_refreshed_at)
+            SELECT s.id, 'db_' || s.id || '_' || g, g * 1048576, 'ready', CURRENT_TIMESTAMP
+            FROM minecraft_servers s
+            CROSS JOIN generate_series(1, %s) g
+        ''', (databases_per_server,))
+        cursor.execute('''
+            INSERT INTO server_storage_totals (server_id, file_count, file_bytes, database_count, database_bytes)
+            SELECT s.id,
+              (SELECT COUNT(*) FROM server_files f WHERE f.server_id = s.id),
+              (SELECT COALESCE(SUM(file_size_bytes), 0) FROM server_files f WHERE f.server_id = s.id),
+              (SELECT COUNT(*) FROM server_databases d WHERE d.server_id = s.id),
+              (SELECT COALESCE(SUM(db_size_bytes), 0) FROM server_databases d WHERE d.server_id = s.id)
+            FROM minecraft_servers s
+            ON CONFLICT (server_id) DO NOTHING
+        ''')
+    conn.commit()
+    conn.autocommit = True
+    with conn.cursor() as cursor:
+        cursor.execute('VACUUM ANALYZE')
+    conn.close()
+
+
+def load_handler(function: str) -> Callable[[Dict[str, Any], Any], Dict[str, Any]]:
+    '''
+    Импортирует index.py функции изолированно: у функций одинаковые имена модулей
+    (index, pool, search, ...), поэтому после импорта они убираются из sys.modules.
+    Модули маршрутов index импортирует лениво внутри обработчиков, так что они
+    загружаются здесь же и возвращаются в sys.modules перед каждым вызовом.
+    '''
+    function_dir = os.path.join(ROOT, 'backend', function)
+    sys.path.insert(0, function_dir)
+    try:
+        module = importlib.import_module('index')
+        for name in FUNCTION_MODULES:
+            if os.path.exists(os.path.join(function_dir, name + '.py')):
+                importlib.import_module(name)
+        pool_module = sys.modules['pool']
+        pool_module._connect = lambda: psycopg2.connect(
+            os.environ['DATABASE_URL'], connection_factory=CountingConnection
+        )
+        modules = {name: sys.modules[name] for name in FUNCTION_MODULES if name in sys.modules}
+    finally:
+        sys.path.remove(function_dir)
+        for name in FUNCTION_MODULES:
+            sys.modules.pop(name, None)
+
+    def handler(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+        sys.modules.update(modules)
+        return module.handler(event, context)
+
+    return handler
+
+
+class Context:
+    def __init__(self, request_id: str) -> None:
+        self.request_id = request_id
+        self.function_name = 'bench'
+
+
+def build_scenarios(servers: int) -> Dict[str, Tuple[str, Callable[[int], Dict[str, Any]]]]:
+    def server_id(i: int) -> int:
+        return 1 + (i * 7919) % servers
+
+    return {
+        'servers.list': ('servers', lambda i: {'httpMethod': 'GET', 'queryStringParameters': {'limit': '100'}}),
+        'servers.list_projected': ('servers', lambda i: {
+            'httpMethod': 'GET', 'queryStringParameters': {'limit': '500', 'fields': 'id,server_name,status'}
+        }),
+        'servers.create': ('servers', lambda i: {'httpMethod': 'POST', 'body': json.dumps({
+            'server_name': 'bench-new-%d' % i, 'version': '1.20.4', 'port': 40000 + i
+        })}),
+        'servers.create_auto_port': ('servers', lambda i: {'httpMethod': 'POST', 'body': json.dumps({
+            'server_name': 'bench-auto-%d' % i, 'version': '1.20.4'
+        })}),
+        'servers.clone': ('servers', lambda i: {
+            'httpMethod': 'POST', 'queryStringParameters': {'action': 'clone'},
+            'body': json.dumps({'source_id': server_id(i), 'server_name': 'bench-clone-%d' % i})
+        }),
+        'servers.metrics_ingest': ('servers', lambda i: {
+            'httpMethod': 'POST', 'queryStringParameters': {'action': 'metrics'},
+            'body': json.dumps([{
+                'server_id': server_id(i * 50 + n), 'ts': time.time() - n, 'tps': 19.5, 'players': n % 20,
+                'heap_used_bytes': 2147483648, 'heap_max_bytes': 4294967296, 'loaded_chunks': 1200
+            } for n in range(1000)])
+        }),
+        'servers.metrics_range': ('servers', lambda i: {
+            'httpMethod': 'GET', 'queryStringParameters': {'action': 'metrics', 'id': str(server_id(i))}
+        }),
+        'servers.search': ('servers', lambda i: {
+            'httpMethod': 'GET', 'queryStringParameters': {'q': 'bench-%d' % (i % 100), 'status': 'stopped', 'limit': '50'}
+        }),
+        'servers.transition': ('servers', lambda i: {'httpMethod': 'PUT', 'body': json.dumps({
+            'id': server_id(i), 'status': 'starting'
+        })}),
+        'files.list': ('files', lambda i: {
+            'httpMethod': 'GET', 'queryStringParameters': {'server_id': str(server_id(i))}
+        }),
+        'files.children': ('files', lambda i: {
+            'httpMethod': 'GET', 'queryStringParameters': {
+                'server_id': str(server_id(i)), 'action': 'children', 'path': '/world/region'
+            }
+        }),
+        'files.export_ndjson': ('files', lambda i: {
+            'httpMethod': 'GET', 'queryStringParameters': {'server_id': str(server_id(i)), 'format': 'ndjson'}
+        }),
+        'files.search': ('files', lambda i: {
+            'httpMethod': 'GET', 'queryStringParameters': {
+                'server_id': str(server_id(i)), 'action': 'search', 'q': 'f%d' % (i % 10), 'ext': 'dat'
+            }
+        }),
+        'files.usage': ('files', lambda i: {
+            'httpMethod': 'GET', 'queryStringParameters': {'server_id': str(server_id(i)), 'action': 'usage'}
+        }),
+        'files.create': ('files', lambda i: {'httpMethod': 'POST', 'body': json.dumps({
+            'server_id': server_id(i), 'file_path': '/plugins', 'file_name': 'bench-%d.jar' % i,
+            'file_size_bytes': 1048576
+        })}),
+        'databases.list': ('databases', lambda i: {
+            'httpMethod': 'GET', 'queryStringParameters': {'server_id': str(server_id(i))}
+        }),
+        'databases.create': ('databases', lambda i: {'httpMethod': 'POST', 'body': json.dumps({
+            'server_id': server_id(i), 'db_name': 'bench_db_%d' % i
+        })})
+    }
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(fraction * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def run_scenario(handler: Callable[..., Dict[str, Any]], make_event: Callable[[int], Dict[str, Any]],
+                 requests: int, concurrency: int) -> Dict[str, Any]:
+    latencies: List[float] = []
+    queries: List[int] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def call(i: int) -> None:
+        nonlocal errors
+        event = make_event(i)
+        _query_counter.count = 0
+        started = time.perf_counter()
+        try:
+            response = handler(event, Context('bench-%d' % i))
+            failed = response['statusCode'] >= 500
+        except Exception:
+            failed = True
+        elapsed = (time.perf_counter() - started) * 1000
+        with lock:
+            latencies.append(elapsed)
+            queries.append(_query_counter.count)
+            errors += int(failed)
+
+    handler(make_event(0), Context('bench-warmup'))
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(call, range(1, requests + 1)))
+    wall = time.perf_counter() - started
+
+    tracemalloc.start()
+    handler(make_event(requests + 1), Context('bench-memory'))
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        'throughput_rps': round(requests / wall, 1) if wall else 0.0,
+        'queries_per_request': round(sum(queries) / len(queries), 2) if queries else 0.0,
+        'peak_traced_kb': traced_peak // 1024,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current: Dict[str, Any], baseline_path: str) -> None:
+    with open(baseline_path, encoding='utf-8') as baseline_file:
+        baseline = json.load(baseline_file)
+    print('%-26s %12s %12s %9s' % ('scenario', 'base p95', 'p95', 'change'))
+    for name, result in current['results'].items():
+        base = baseline.get('results', {}).get(name)
+        if not base or not base['p95_ms']:
+            continue
+        change = (result['p95_ms'] - base['p95_ms']) / base['p95_ms'] * 100
+        print('%-26s %12.3f %12.3f %+8.1f%%' % (name, base['p95_ms'], result['p95_ms'], change))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', type=float, default=1.0, help='множитель объёмов засева')
+    parser.add_argument('--servers', type=int, default=10000)
+    parser.add_argument('--files', type=int, default=1000000)
+    parser.add_argument('--databases', type=int, default=50000)
+    parser.add_argument('--requests', type=int, default=500, help='вызовов на сценарий')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--scenario', action='append', help='запустить только эти сценарии')
+    parser.add_argument('--response-cache', action='store_true', help='не отключать кэш ответов')
+    parser.add_argument('--output', help='куда записать JSON с результатами')
+    parser.add_argument('--compare', help='JSON прошлого прогона для сравнения p95')
+    args = parser.parse_args()
+
+    servers = max(1, int(args.servers * args.scale))
+    files = int(args.files * args.scale)
+    databases = int(args.databases * args.scale)
+
+    postgres = None
+    dsn = os.environ.get('BENCH_DATABASE_URL')
+    if not dsn:
+        postgres = LocalPostgres()
+        dsn = postgres.start()
+    try:
+        os.environ['DATABASE_URL'] = dsn
+        os.environ['DB_POOL_MAX_SIZE'] = str(args.concurrency)
+        os.environ['TRACE_LOG'] = '0'
+        if not args.response_cache:
+            os.environ['RESPONSE_CACHE_TTL'] = '0'
+            os.environ['RESPONSE_CACHE_MAX_BODY'] = '0'
+
+        print('migrating and seeding %d servers / %d files / %d databases' % (servers, files, databases))
+        apply_migrations(dsn)
+        seed(dsn, servers, files, databases)
+
+        handlers = {function: load_handler(function) for function in FUNCTIONS}
+        scenarios = build_scenarios(servers)
+        selected = args.scenario or list(scenarios)
+
+        output: Dict[str, Any] = {
+            'commit': git_commit(),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'config': {
+                'servers': servers, 'files': files, 'databases': databases,
+                'requests': args.requests, 'concurrency': args.concurrency,
+                'response_cache': args.response_cache
+            },
+            'results': {}
+        }
+        for name in selected:
+            function, make_event = scenarios[name]
+            result = run_scenario(handlers[function], make_event, args.requests, args.concurrency)
+            output['results'][name] = result
+            print('%-26s p50 %8.2f  p95 %8.2f  p99 %8.2f ms  %8.1f rps  %5.1f q/req  errors %d' % (
+                name, result['p50_ms'], result['p95_ms'], result['p99_ms'],
+                result['throughput_rps'], result['queries_per_request'], result['errors']
+            ))
+    finally:
+        if postgres:
+            postgres.stop()
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as output_file:
+            json.dump(output, output_file, indent=2)
+    if args.compare:
+        compare(output, args.compare)
+
+
+if __name__ == '__main__':
+    main()
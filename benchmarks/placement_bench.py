@@ -0,0 +1,161 @@
+'''
+Симуляция планировщика размещения (backend/servers/scheduler.py) без Postgres: те же
+профили потребности, скоринг и план, что при POST и старте, но снимок хостов живёт в памяти.
+
+Сценарий:
+  1. place     - --servers серверов по одному решению на сервер (как поток POST), на --nodes
+                 хостах трёх размеров; для каждой стратегии (binpack, spread) - утилизация памяти/CPU,
+                 сколько не поместилось, сколько хостов ещё вмещает самый крупный профиль,
+                 и задержка решения p50/p95/p99;
+  2. drain     - --drain самых загруженных хостов выводится, их серверы перепланируются
+                 одной пачкой (как rebalance), замеряется время и число не поместившихся.
+
+    python benchmarks/placement_bench.py
+    python benchmarks/placement_bench.py --servers 10000 --nodes 200 --output placement.json
+'''
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from typing import Dict, Any, List, Tuple
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'backend', 'servers'))
+
+import scheduler  # noqa: E402
+
+# (память МБ, CPU милли-ядер, доля хостов)
+NODE_SHAPES = ((262144, 128000, 0.5), (131072, 64000, 0.3), (65536, 32000, 0.2))
+VERSIONS = (('1.8.9', 0.1), ('1.12.2', 0.15), ('1.16.5', 0.2), ('1.20.4', 0.55))
+MAX_PLAYERS = ((10, 0.35), (20, 0.35), (50, 0.2), (100, 0.1))
+
+
+def weighted(rnd: random.Random, choices: Tuple[Tuple[Any, float], ...]) -> Any:
+    return rnd.choices([value for value, _ in choices], [weight for _, weight in choices])[0]
+
+
+def make_nodes(count: int) -> List[Tuple[str, int, int]]:
+    nodes = []
+    for shape_index, (memory_mb, cpu_millis, share) in enumerate(NODE_SHAPES):
+        shape_count = round(count * share) if shape_index < len(NODE_SHAPES) - 1 else count - len(nodes)
+        for _ in range(shape_count):
+            nodes.append(('node-%03d' % len(nodes), memory_mb, cpu_millis))
+    return nodes
+
+
+def make_demands(count: int, rnd: random.Random) -> List[scheduler.Demand]:
+    return [
+        scheduler.server_demand(index, weighted(rnd, VERSIONS), weighted(rnd, MAX_PLAYERS))
+        for index in range(count)
+    ]
+
+
+def percentile(samples: List[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] if ordered else 0.0
+
+
+def utilization(hosts: Dict[str, scheduler.HostState], largest: scheduler.Demand) -> Dict[str, Any]:
+    memory_total = sum(host.memory_mb for host in hosts.values())
+    cpu_total = sum(host.cpu_millis for host in hosts.values())
+    memory_used = [1 - host.free_memory_mb / host.memory_mb for host in hosts.values()]
+    return {
+        'memory': round(sum(host.memory_mb - host.free_memory_mb for host in hosts.values()) / memory_total, 4),
+        'cpu': round(sum(host.cpu_millis - host.free_cpu_millis for host in hosts.values()) / cpu_total, 4),
+        'host_memory_min': round(min(memory_used), 4),
+        'host_memory_max': round(max(memory_used), 4),
+        'empty_hosts': sum(1 for host in hosts.values() if host.free_memory_mb == host.memory_mb),
+        'hosts_fitting_largest': sum(1 for host in hosts.values() if host.fits(largest))
+    }
+
+
+def simulate(nodes: List[Tuple[str, int, int]], demands: List[scheduler.Demand], strategy: str,
+             drain: int) -> Dict[str, Any]:
+    hosts = {name: scheduler.HostState(name, memory_mb, cpu_millis) for name, memory_mb, cpu_millis in nodes}
+    largest = max(demands, key=lambda demand: (demand.memory_mb, demand.cpu_millis))
+    assignments: Dict[Any, str] = {}
+    latencies = []
+    started = time.perf_counter()
+    for demand in demands:
+        decision_started = time.perf_counter()
+        placed = scheduler.plan(hosts, [demand], strategy)
+        latencies.append(time.perf_counter() - decision_started)
+        assignments.update(placed)
+    elapsed = time.perf_counter() - started
+    result = {
+        'placed': len(assignments),
+        'unplaced': len(demands) - len(assignments),
+        'seconds': round(elapsed, 3),
+        'decision_us': {
+            'p50': round(percentile(latencies, 0.5) * 1e6, 1),
+            'p95': round(percentile(latencies, 0.95) * 1e6, 1),
+            'p99': round(percentile(latencies, 0.99) * 1e6, 1)
+        },
+        'utilization': utilization(hosts, largest)
+    }
+
+    drained = sorted(hosts.values(), key=lambda host: host.free_memory_mb / host.memory_mb)[:drain]
+    drained_names = {host.name for host in drained}
+    for name in drained_names:
+        del hosts[name]
+    evicted = [demand for demand in demands if assignments.get(demand.key) in drained_names]
+    started = time.perf_counter()
+    moved = scheduler.plan(hosts, evicted, strategy)
+    result['drain'] = {
+        'hosts': len(drained_names),
+        'evicted': len(evicted),
+        'moved': len(moved),
+        'unplaced': len(evicted) - len(moved),
+        'seconds': round(time.perf_counter() - started, 4),
+        'utilization': utilization(hosts, largest)
+    }
+    return result
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print('%d servers on %d nodes, demand %.0f GB / %.0f cores, capacity %.0f GB / %.0f cores' % (
+        report['servers'], report['nodes'], report['demand_memory_mb'] / 1024, report['demand_cpu_millis'] / 1000,
+        report['capacity_memory_mb'] / 1024, report['capacity_cpu_millis'] / 1000))
+    print('%-8s %7s %8s %7s %7s %9s %9s %6s %8s %7s %8s' % (
+        'strategy', 'placed', 'unplaced', 'mem', 'cpu', 'p50 us', 'p99 us', 'empty', 'fit-big', 'drain', 'd-unpl'))
+    for strategy in ('binpack', 'spread'):
+        result = report[strategy]
+        print('%-8s %7d %8d %6.1f%% %6.1f%% %9.1f %9.1f %6d %8d %7d %8d' % (
+            strategy, result['placed'], result['unplaced'], result['utilization']['memory'] * 100,
+            result['utilization']['cpu'] * 100, result['decision_us']['p50'], result['decision_us']['p99'],
+            result['utilization']['empty_hosts'], result['utilization']['hosts_fitting_largest'],
+            result['drain']['moved'], result['drain']['unplaced']))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--servers', type=int, default=10000)
+    parser.add_argument('--nodes', type=int, default=200)
+    parser.add_argument('--drain', type=int, default=10, help='number of most loaded nodes to drain')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='write the report as JSON')
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    nodes = make_nodes(args.nodes)
+    demands = make_demands(args.servers, rnd)
+    report = {
+        'servers': args.servers,
+        'nodes': args.nodes,
+        'demand_memory_mb': sum(demand.memory_mb for demand in demands),
+        'demand_cpu_millis': sum(demand.cpu_millis for demand in demands),
+        'capacity_memory_mb': sum(node[1] for node in nodes),
+        'capacity_cpu_millis': sum(node[2] for node in nodes)
+    }
+    for strategy in ('binpack', 'spread'):
+        report[strategy] = simulate(nodes, demands, strategy, args.drain)
+    print_report(report)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(report, output, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,253 @@
+'''
+Бенчмарк снимков миров (backend/files/snapshots.py) без Postgres: учёт ссылок на блобы
+ведётся в памяти с той же семантикой, что BlobRefTable, хранилище - LocalBlobStore в рабочем каталоге.
+
+Сценарий:
+  1. генерирует синтетический мир: region-файлы случайных байт (сжатые чанки Minecraft
+     почти не сжимаются) общим объёмом --world-gb;
+  2. full        - первый снимок, режется и пишется весь мир;
+  3. churn       - переписывает участки по --edit-kb в случайных region-файлах, пока не наберётся
+                   --churn от объёма мира (как сохранение мира перезаписывает секторы);
+  4. incremental - второй снимок: неизменённые файлы берутся из манифеста первого,
+                   изменённые режутся заново, в хранилище уходят только новые чанки;
+  5. restore     - восстановление второго снимка в каталог потоком по манифесту с проверкой sha256;
+  6. gc          - удаление первого снимка и сборка блобов без ссылок.
+
+    python benchmarks/snapshot_bench.py --world-gb 5 --churn 0.01
+    python benchmarks/snapshot_bench.py --world-gb 0.5 --output snapshot.json
+'''
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import Counter
+from typing import Dict, Any, Iterator, List, Set
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'backend', 'files'))
+
+import snapshots  # noqa: E402
+from blob_store import LocalBlobStore  # noqa: E402
+
+READ_SIZE = 1024 * 1024
+MB = 1024 * 1024
+
+
+class MemoryRefs:
+    def __init__(self) -> None:
+        self.blobs: Dict[str, List[int]] = {}
+
+    def add(self, blob_refs: snapshots.BlobRefs) -> Set[str]:
+        needed = set()
+        for sha256, (size, count) in blob_refs.items():
+            blob = self.blobs.setdefault(sha256, [size, 0])
+            blob[1] += count
+            if blob[1] == count:
+                needed.add(sha256)
+        return needed
+
+    def release(self, refs: Counter) -> None:
+        for sha256, count in refs.items():
+            self.blobs[sha256][1] -= count
+
+    def collect(self, store: LocalBlobStore) -> Dict[str, int]:
+        garbage = [sha256 for sha256, (_, count) in self.blobs.items() if count == 0]
+        freed = 0
+        for sha256 in garbage:
+            store.delete(sha256)
+            freed += self.blobs.pop(sha256)[0]
+        return {'deleted_blobs': len(garbage), 'freed_bytes': freed}
+
+    def stored_bytes(self) -> int:
+        return sum(size for size, _ in self.blobs.values())
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as source:
+        for piece in iter(lambda: source.read(READ_SIZE), b''):
+            digest.update(piece)
+    return digest.hexdigest()
+
+
+def read_pieces(world_dir: str) -> Any:
+    def read_content(file: Dict[str, Any]) -> Iterator[bytes]:
+        with open(os.path.join(world_dir, file['file_path'].lstrip('/'), file['file_name']), 'rb') as source:
+            for piece in iter(lambda: source.read(READ_SIZE), b''):
+                yield piece
+    return read_content
+
+
+def generate_world(world_dir: str, world_bytes: int, region_bytes: int, rnd: random.Random) -> List[Dict[str, Any]]:
+    region_dir = os.path.join(world_dir, 'world', 'region')
+    os.makedirs(region_dir)
+    files = []
+    count = max(1, world_bytes // region_bytes)
+    side = int(count ** 0.5) + 1
+    for index in range(count):
+        name = 'r.%d.%d.mca' % (index % side, index // side)
+        digest = hashlib.sha256()
+        with open(os.path.join(region_dir, name), 'wb') as target:
+            for _ in range(region_bytes // READ_SIZE):
+                piece = rnd.randbytes(READ_SIZE)
+                digest.update(piece)
+                target.write(piece)
+        files.append({
+            'file_path': '/world/region', 'file_name': name, 'file_type': 'file',
+            'file_size_bytes': region_bytes, 'content_sha256': digest.hexdigest()
+        })
+    return files
+
+
+def apply_churn(world_dir: str, files: List[Dict[str, Any]], churn_bytes: int, edit_bytes: int,
+                rnd: random.Random) -> int:
+    touched = set()
+    written = 0
+    while written < churn_bytes:
+        index = rnd.randrange(len(files))
+        file = files[index]
+        offset = rnd.randrange(0, max(1, file['file_size_bytes'] - edit_bytes))
+        with open(os.path.join(world_dir, file['file_path'].lstrip('/'), file['file_name']), 'r+b') as target:
+            target.seek(offset)
+            target.write(rnd.randbytes(edit_bytes))
+        touched.add(index)
+        written += edit_bytes
+    for index in touched:
+        file = files[index]
+        file['content_sha256'] = file_sha256(os.path.join(world_dir, file['file_path'].lstrip('/'), file['file_name']))
+    return len(touched)
+
+
+def take_snapshot(files: List[Dict[str, Any]], previous: Dict[str, Any], world_dir: str,
+                  refs: MemoryRefs, store: LocalBlobStore) -> Dict[str, Any]:
+    started = time.perf_counter()
+    manifest_sha256, snapshot_refs, stats = snapshots.build_manifest(
+        files, previous, read_pieces(world_dir), refs, store
+    )
+    elapsed = time.perf_counter() - started
+    result = stats.as_dict()
+    result.update({
+        'seconds': round(elapsed, 3),
+        'read_mb_per_s': round(stats.read_bytes / MB / elapsed, 1) if elapsed else None,
+        'manifest_sha256': manifest_sha256,
+        'manifest_bytes': refs.blobs[manifest_sha256][0],
+        'refs': snapshot_refs
+    })
+    return result
+
+
+def previous_chunks(store: LocalBlobStore, snapshot: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        entry['sha256']: entry['chunks']
+        for entry in snapshots.iter_manifest(store, snapshot['manifest_sha256'], snapshot['manifest_bytes'])
+        if entry['sha256']
+    }
+
+
+def restore(store: LocalBlobStore, snapshot: Dict[str, Any], target_dir: str) -> Dict[str, Any]:
+    started = time.perf_counter()
+    restored_files = 0
+    restored_bytes = 0
+    mismatched = 0
+    for entry in snapshots.iter_manifest(store, snapshot['manifest_sha256'], snapshot['manifest_bytes']):
+        directory = os.path.join(target_dir, entry['path'].lstrip('/'))
+        os.makedirs(directory, exist_ok=True)
+        digest = hashlib.sha256()
+        with open(os.path.join(directory, entry['name']), 'wb') as target:
+            for piece in snapshots.iter_entry_content(store, entry):
+                digest.update(piece)
+                target.write(piece)
+                restored_bytes += len(piece)
+        restored_files += 1
+        mismatched += digest.hexdigest() != entry['sha256']
+    elapsed = time.perf_counter() - started
+    return {
+        'seconds': round(elapsed, 3),
+        'files': restored_files,
+        'bytes': restored_bytes,
+        'mb_per_s': round(restored_bytes / MB / elapsed, 1) if elapsed else None,
+        'sha256_mismatches': mismatched
+    }
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    world_mb = report['world_bytes'] / MB
+    print('world: %.0f MB in %d files, churn %.0f MB in %d files' % (
+        world_mb, report['world_files'], report['churn_bytes'] / MB, report['churned_files']))
+    print('%-12s %9s %10s %10s %10s %10s' % ('phase', 'seconds', 'read MB', 'new MB', 'chunks', 'new chunks'))
+    for phase in ('full', 'incremental'):
+        stats = report[phase]
+        print('%-12s %9.2f %10.1f %10.1f %10d %10d' % (
+            phase, stats['seconds'], stats['read_bytes'] / MB, stats['new_bytes'] / MB,
+            stats['chunk_count'], stats['new_chunk_count']))
+    incremental = report['incremental']
+    print('incremental stored %.2f%% of the world (a full copy would store %.0f MB)' % (
+        100.0 * incremental['new_bytes'] / report['world_bytes'], world_mb))
+    print('restore: %.2fs, %.0f MB/s, %d sha256 mismatches' % (
+        report['restore']['seconds'], report['restore']['mb_per_s'] or 0, report['restore']['sha256_mismatches']))
+    print('gc after deleting the full snapshot: %d blobs, %.1f MB freed; store holds %.0f MB' % (
+        report['gc']['deleted_blobs'], report['gc']['freed_bytes'] / MB, report['store_bytes'] / MB))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--world-gb', type=float, default=5.0)
+    parser.add_argument('--churn', type=float, default=0.01, help='share of world bytes rewritten between snapshots')
+    parser.add_argument('--region-mb', type=int, default=8)
+    parser.add_argument('--edit-kb', type=int, default=64)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--workdir', help='directory for the world, store and restore (default: temporary)')
+    parser.add_argument('--keep', action='store_true', help='keep the working directory')
+    parser.add_argument('--output', help='write the report as JSON')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='mc-snapshot-bench-')
+    world_dir = os.path.join(workdir, 'world-live')
+    store = LocalBlobStore(os.path.join(workdir, 'store'))
+    refs = MemoryRefs()
+    rnd = random.Random(args.seed)
+    try:
+        world_bytes = int(args.world_gb * 1024 * MB)
+        files = generate_world(world_dir, world_bytes, args.region_mb * MB, rnd)
+        full = take_snapshot(files, {}, world_dir, refs, store)
+
+        churn_bytes = int(world_bytes * args.churn)
+        churned_files = apply_churn(world_dir, files, churn_bytes, args.edit_kb * 1024, rnd)
+        incremental = take_snapshot(files, previous_chunks(store, full), world_dir, refs, store)
+
+        restored = restore(store, incremental, os.path.join(workdir, 'restored'))
+
+        refs.release(full.pop('refs'))
+        incremental.pop('refs')
+        collected = refs.collect(store)
+
+        report = {
+            'world_bytes': sum(file['file_size_bytes'] for file in files),
+            'world_files': len(files),
+            'churn_bytes': churn_bytes,
+            'churned_files': churned_files,
+            'cdc': {'min': snapshots.CDC_MIN_SIZE, 'avg': snapshots.CDC_AVG_SIZE, 'max': snapshots.CDC_MAX_SIZE},
+            'full': full,
+            'incremental': incremental,
+            'restore': restored,
+            'gc': collected,
+            'store_bytes': refs.stored_bytes()
+        }
+        print_report(report)
+        if args.output:
+            with open(args.output, 'w') as output:
+                json.dump(report, output, indent=2)
+        if restored['sha256_mismatches']:
+            sys.exit(1)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+UPDATE minecraft_servers SET created_at = CURRENT_TIMESTAMP WHERE created_at IS NULL;
+
+ALTER TABLE minecraft_servers ALTER COLUMN created_at SET NOT NULL;
+
+CREATE INDEX IF NOT EXISTS idx_minecraft_servers_created_at_id
+  ON minecraft_servers (created_at DESC, id DESC);
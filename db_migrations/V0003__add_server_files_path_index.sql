@@ -0,0 +1,2 @@
+CREATE INDEX IF NOT EXISTS idx_server_files_server_path
+  ON server_files (server_id, file_path, file_name, id);
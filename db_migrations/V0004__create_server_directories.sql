@@ -0,0 +1,55 @@
+CREATE TABLE IF NOT EXISTS server_directories (
+  id SERIAL PRIMARY KEY,
+  server_id INTEGER NOT NULL REFERENCES minecraft_servers(id),
+  parent_id INTEGER REFERENCES server_directories(id),
+  name VARCHAR(255) NOT NULL,
+  path VARCHAR(1000) NOT NULL,
+  depth INTEGER NOT NULL DEFAULT 0,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  UNIQUE (server_id, path)
+);
+
+CREATE INDEX IF NOT EXISTS idx_server_directories_parent
+  ON server_directories (parent_id, name);
+
+CREATE INDEX IF NOT EXISTS idx_server_directories_path_prefix
+  ON server_directories (server_id, path varchar_pattern_ops);
+
+ALTER TABLE server_files ADD COLUMN IF NOT EXISTS directory_id INTEGER REFERENCES server_directories(id);
+
+CREATE INDEX IF NOT EXISTS idx_server_files_directory
+  ON server_files (directory_id, file_name);
+
+WITH RECURSIVE normalized AS (
+  SELECT DISTINCT server_id,
+    CASE WHEN btrim(file_path, '/') = '' THEN '/' ELSE '/' || btrim(file_path, '/') || '/' END AS path
+  FROM server_files
+  WHERE server_id IS NOT NULL
+), prefixes AS (
+  SELECT server_id, path FROM normalized
+  UNION
+  SELECT server_id, regexp_replace(path, '[^/]+/$', '') FROM prefixes WHERE path <> '/'
+)
+INSERT INTO server_directories (server_id, name, path, depth)
+SELECT server_id,
+  CASE WHEN path = '/' THEN '' ELSE substring(path from '([^/]+)/$') END,
+  path,
+  length(path) - length(replace(path, '/', '')) - 1
+FROM prefixes
+ON CONFLICT (server_id, path) DO NOTHING;
+
+UPDATE server_directories child
+SET parent_id = parent.id
+FROM server_directories parent
+WHERE child.path <> '/'
+  AND child.parent_id IS NULL
+  AND parent.server_id = child.server_id
+  AND parent.path = regexp_replace(child.path, '[^/]+/$', '');
+
+UPDATE server_files f
+SET directory_id = d.id,
+    file_path = CASE WHEN d.path = '/' THEN '/' ELSE rtrim(d.path, '/') END
+FROM server_directories d
+WHERE f.directory_id IS NULL
+  AND d.server_id = f.server_id
+  AND d.path = CASE WHEN btrim(f.file_path, '/') = '' THEN '/' ELSE '/' || btrim(f.file_path, '/') || '/' END;
@@ -0,0 +1,54 @@
+ALTER TABLE server_files ADD COLUMN IF NOT EXISTS file_size_bytes BIGINT NOT NULL DEFAULT 0;
+
+UPDATE server_files
+SET file_size_bytes = (
+  replace(substring(upper(file_size) from '\d+(?:[.,]\d+)?'), ',', '.')::numeric *
+  power(1024, CASE substring(upper(file_size) from '([KMGT]?B)\s*$')
+    WHEN 'KB' THEN 1 WHEN 'MB' THEN 2 WHEN 'GB' THEN 3 WHEN 'TB' THEN 4 ELSE 0 END)
+)::bigint
+WHERE upper(file_size) ~ '^\s*\d+([.,]\d+)?\s*[KMGT]?B?\s*$';
+
+ALTER TABLE server_files DROP COLUMN IF EXISTS file_size;
+
+ALTER TABLE server_databases ADD COLUMN IF NOT EXISTS db_size_bytes BIGINT NOT NULL DEFAULT 0;
+
+UPDATE server_databases
+SET db_size_bytes = (
+  replace(substring(upper(db_size) from '\d+(?:[.,]\d+)?'), ',', '.')::numeric *
+  power(1024, CASE substring(upper(db_size) from '([KMGT]?B)\s*$')
+    WHEN 'KB' THEN 1 WHEN 'MB' THEN 2 WHEN 'GB' THEN 3 WHEN 'TB' THEN 4 ELSE 0 END)
+)::bigint
+WHERE upper(db_size) ~ '^\s*\d+([.,]\d+)?\s*[KMGT]?B?\s*$';
+
+ALTER TABLE server_databases DROP COLUMN IF EXISTS db_size;
+
+CREATE TABLE IF NOT EXISTS server_storage_totals (
+  server_id INTEGER PRIMARY KEY REFERENCES minecraft_servers(id),
+  file_count BIGINT NOT NULL DEFAULT 0,
+  file_bytes BIGINT NOT NULL DEFAULT 0,
+  database_count BIGINT NOT NULL DEFAULT 0,
+  database_bytes BIGINT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+INSERT INTO server_storage_totals (server_id, file_count, file_bytes, database_count, database_bytes)
+SELECT s.id,
+  COALESCE(f.file_count, 0),
+  COALESCE(f.file_bytes, 0),
+  COALESCE(d.database_count, 0),
+  COALESCE(d.database_bytes, 0)
+FROM minecraft_servers s
+LEFT JOIN (
+  SELECT server_id, COUNT(*) AS file_count, SUM(file_size_bytes) AS file_bytes
+  FROM server_files GROUP BY server_id
+) f ON f.server_id = s.id
+LEFT JOIN (
+  SELECT server_id, COUNT(*) AS database_count, SUM(db_size_bytes) AS database_bytes
+  FROM server_databases GROUP BY server_id
+) d ON d.server_id = s.id
+ON CONFLICT (server_id) DO UPDATE SET
+  file_count = EXCLUDED.file_count,
+  file_bytes = EXCLUDED.file_bytes,
+  database_count = EXCLUDED.database_count,
+  database_bytes = EXCLUDED.database_bytes,
+  updated_at = CURRENT_TIMESTAMP;
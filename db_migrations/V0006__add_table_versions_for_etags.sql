@@ -0,0 +1,49 @@
+CREATE TABLE IF NOT EXISTS table_versions (
+  table_name VARCHAR(100) PRIMARY KEY,
+  version BIGINT NOT NULL DEFAULT 0,
+  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+BEGIN
+  INSERT INTO table_versions (table_name, version) VALUES (TG_TABLE_NAME, 1)
+  ON CONFLICT (table_name) DO UPDATE
+    SET version = table_versions.version + 1, updated_at = CURRENT_TIMESTAMP;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+INSERT INTO table_versions (table_name) VALUES ('minecraft_servers') ON CONFLICT (table_name) DO NOTHING;
+
+DROP TRIGGER IF EXISTS trg_minecraft_servers_version ON minecraft_servers;
+CREATE TRIGGER trg_minecraft_servers_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON minecraft_servers
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+INSERT INTO table_versions (table_name) VALUES ('server_files') ON CONFLICT (table_name) DO NOTHING;
+
+DROP TRIGGER IF EXISTS trg_server_files_version ON server_files;
+CREATE TRIGGER trg_server_files_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON server_files
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+INSERT INTO table_versions (table_name) VALUES ('server_directories') ON CONFLICT (table_name) DO NOTHING;
+
+DROP TRIGGER IF EXISTS trg_server_directories_version ON server_directories;
+CREATE TRIGGER trg_server_directories_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON server_directories
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+INSERT INTO table_versions (table_name) VALUES ('server_storage_totals') ON CONFLICT (table_name) DO NOTHING;
+
+DROP TRIGGER IF EXISTS trg_server_storage_totals_version ON server_storage_totals;
+CREATE TRIGGER trg_server_storage_totals_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON server_storage_totals
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
+
+INSERT INTO table_versions (table_name) VALUES ('server_databases') ON CONFLICT (table_name) DO NOTHING;
+
+DROP TRIGGER IF EXISTS trg_server_databases_version ON server_databases;
+CREATE TRIGGER trg_server_databases_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON server_databases
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
@@ -0,0 +1,48 @@
+CREATE TABLE IF NOT EXISTS server_status_changes (
+  seq BIGSERIAL PRIMARY KEY,
+  txid BIGINT NOT NULL DEFAULT txid_current(),
+  server_id INTEGER NOT NULL,
+  status VARCHAR(50),
+  change_type VARCHAR(10) NOT NULL,
+  changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_server_status_changes_txid
+  ON server_status_changes (txid, seq);
+
+CREATE INDEX IF NOT EXISTS idx_server_status_changes_changed_at
+  ON server_status_changes (changed_at);
+
+CREATE OR REPLACE FUNCTION record_server_status_change() RETURNS trigger AS $$
+DECLARE
+  change_seq BIGINT;
+  row_id INTEGER;
+  row_status VARCHAR(50);
+BEGIN
+  IF TG_OP = 'UPDATE' AND NEW.status IS NOT DISTINCT FROM OLD.status THEN
+    RETURN NULL;
+  END IF;
+
+  IF TG_OP = 'DELETE' THEN
+    row_id := OLD.id;
+    row_status := NULL;
+  ELSE
+    row_id := NEW.id;
+    row_status := NEW.status;
+  END IF;
+
+  INSERT INTO server_status_changes (server_id, status, change_type)
+  VALUES (row_id, row_status, lower(TG_OP))
+  RETURNING seq INTO change_seq;
+
+  PERFORM pg_notify('server_status', json_build_object(
+    'seq', change_seq, 'server_id', row_id, 'status', row_status, 'change', lower(TG_OP)
+  )::text);
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_minecraft_servers_status_change ON minecraft_servers;
+CREATE TRIGGER trg_minecraft_servers_status_change
+  AFTER INSERT OR UPDATE OF status OR DELETE ON minecraft_servers
+  FOR EACH ROW EXECUTE FUNCTION record_server_status_change();
@@ -0,0 +1,10 @@
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+  idempotency_key VARCHAR(255) PRIMARY KEY,
+  request_hash VARCHAR(64) NOT NULL,
+  status_code INTEGER,
+  response_body TEXT,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created_at
+  ON idempotency_keys (created_at);
@@ -0,0 +1,93 @@
+ALTER TABLE minecraft_servers
+  ADD COLUMN IF NOT EXISTS host VARCHAR(255) NOT NULL DEFAULT 'default';
+
+CREATE TABLE IF NOT EXISTS port_allocations (
+  host VARCHAR(255) NOT NULL,
+  port INTEGER NOT NULL,
+  server_id INTEGER REFERENCES minecraft_servers(id),
+  allocated_at TIMESTAMP,
+  PRIMARY KEY (host, port)
+);
+
+CREATE INDEX IF NOT EXISTS idx_port_allocations_free
+  ON port_allocations (host, port) WHERE server_id IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_port_allocations_server_id
+  ON port_allocations (server_id) WHERE server_id IS NOT NULL;
+
+INSERT INTO port_allocations (host, port)
+SELECT 'default', port FROM generate_series(19132, 21131) AS port
+ON CONFLICT (host, port) DO NOTHING;
+
+CREATE TABLE IF NOT EXISTS server_port_reassignments (
+  id SERIAL PRIMARY KEY,
+  server_id INTEGER NOT NULL,
+  server_name VARCHAR(255) NOT NULL,
+  host VARCHAR(255) NOT NULL,
+  old_port INTEGER NOT NULL,
+  new_port INTEGER NOT NULL,
+  reassigned_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+DO $$
+DECLARE
+  duplicate_count INTEGER;
+  free_count INTEGER;
+  conflicts TEXT;
+BEGIN
+  SELECT count(*) INTO duplicate_count
+  FROM (
+    SELECT row_number() OVER (PARTITION BY host, port ORDER BY id) AS copy
+    FROM minecraft_servers
+  ) s
+  WHERE copy > 1;
+
+  SELECT count(*) INTO free_count
+  FROM port_allocations a
+  WHERE a.host = 'default'
+    AND NOT EXISTS (SELECT 1 FROM minecraft_servers s WHERE s.host = a.host AND s.port = a.port);
+
+  IF duplicate_count > free_count THEN
+    SELECT string_agg(format('id=%s host=%s port=%s', id, host, port), ', ' ORDER BY host, port, id) INTO conflicts
+    FROM (
+      SELECT id, host, port, count(*) OVER (PARTITION BY host, port) AS copies
+      FROM minecraft_servers
+    ) s
+    WHERE copies > 1;
+    RAISE EXCEPTION '% servers share a port with another server, but only % ports are free in the default range: %',
+      duplicate_count, free_count, conflicts;
+  END IF;
+END $$;
+
+WITH duplicates AS (
+  SELECT id, port AS old_port, row_number() OVER (ORDER BY id) AS n
+  FROM (
+    SELECT id, port, row_number() OVER (PARTITION BY host, port ORDER BY id) AS copy
+    FROM minecraft_servers
+  ) s
+  WHERE copy > 1
+),
+free AS (
+  SELECT a.port, row_number() OVER (ORDER BY a.port) AS n
+  FROM port_allocations a
+  WHERE a.host = 'default'
+    AND NOT EXISTS (SELECT 1 FROM minecraft_servers s WHERE s.host = a.host AND s.port = a.port)
+),
+moved AS (
+  UPDATE minecraft_servers s
+  SET port = free.port, updated_at = CURRENT_TIMESTAMP
+  FROM duplicates
+  JOIN free ON free.n = duplicates.n
+  WHERE s.id = duplicates.id
+  RETURNING s.id, s.server_name, s.host, duplicates.old_port, s.port
+)
+INSERT INTO server_port_reassignments (server_id, server_name, host, old_port, new_port)
+SELECT id, server_name, host, old_port, port FROM moved;
+
+UPDATE port_allocations a
+SET server_id = s.id, allocated_at = s.created_at
+FROM minecraft_servers s
+WHERE s.host = a.host AND s.port = a.port AND a.server_id IS NULL;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_minecraft_servers_host_port
+  ON minecraft_servers (host, port);
@@ -0,0 +1,54 @@
+CREATE TABLE IF NOT EXISTS blobs (
+  sha256 CHAR(64) PRIMARY KEY,
+  size_bytes BIGINT NOT NULL,
+  ref_count INTEGER NOT NULL DEFAULT 0,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_blobs_unreferenced
+  ON blobs (created_at) WHERE ref_count = 0;
+
+ALTER TABLE server_files
+  ADD COLUMN IF NOT EXISTS content_sha256 CHAR(64);
+
+CREATE INDEX IF NOT EXISTS idx_server_files_content_sha256
+  ON server_files (content_sha256) WHERE content_sha256 IS NOT NULL;
+
+CREATE TABLE IF NOT EXISTS server_file_chunks (
+  file_id INTEGER NOT NULL REFERENCES server_files(id),
+  chunk_index INTEGER NOT NULL,
+  offset_bytes BIGINT NOT NULL,
+  size_bytes INTEGER NOT NULL,
+  blob_sha256 CHAR(64) NOT NULL REFERENCES blobs(sha256),
+  PRIMARY KEY (file_id, chunk_index)
+);
+
+CREATE INDEX IF NOT EXISTS idx_server_file_chunks_blob
+  ON server_file_chunks (blob_sha256);
+
+CREATE TABLE IF NOT EXISTS upload_sessions (
+  id VARCHAR(36) PRIMARY KEY,
+  server_id INTEGER NOT NULL REFERENCES minecraft_servers(id),
+  file_path VARCHAR(500) NOT NULL,
+  file_name VARCHAR(255) NOT NULL,
+  file_type VARCHAR(50),
+  size_bytes BIGINT NOT NULL,
+  chunk_size INTEGER NOT NULL,
+  expected_sha256 CHAR(64),
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_upload_sessions_updated_at
+  ON upload_sessions (updated_at);
+
+CREATE TABLE IF NOT EXISTS upload_session_chunks (
+  upload_id VARCHAR(36) NOT NULL REFERENCES upload_sessions(id) ON DELETE CASCADE,
+  chunk_index INTEGER NOT NULL,
+  size_bytes INTEGER NOT NULL,
+  blob_sha256 CHAR(64) NOT NULL REFERENCES blobs(sha256),
+  PRIMARY KEY (upload_id, chunk_index)
+);
+
+CREATE INDEX IF NOT EXISTS idx_upload_session_chunks_blob
+  ON upload_session_chunks (blob_sha256);
@@ -0,0 +1,33 @@
+CREATE TABLE IF NOT EXISTS server_snapshots (
+  id SERIAL PRIMARY KEY,
+  server_id INTEGER NOT NULL REFERENCES minecraft_servers(id),
+  parent_id INTEGER REFERENCES server_snapshots(id) ON DELETE SET NULL,
+  label VARCHAR(255),
+  manifest_sha256 CHAR(64) NOT NULL REFERENCES blobs(sha256),
+  file_count INTEGER NOT NULL DEFAULT 0,
+  total_bytes BIGINT NOT NULL DEFAULT 0,
+  chunk_count INTEGER NOT NULL DEFAULT 0,
+  new_chunk_count INTEGER NOT NULL DEFAULT 0,
+  new_bytes BIGINT NOT NULL DEFAULT 0,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_server_snapshots_server
+  ON server_snapshots (server_id, id DESC);
+
+CREATE TABLE IF NOT EXISTS snapshot_blob_refs (
+  snapshot_id INTEGER NOT NULL REFERENCES server_snapshots(id),
+  blob_sha256 CHAR(64) NOT NULL REFERENCES blobs(sha256),
+  ref_count INTEGER NOT NULL,
+  PRIMARY KEY (snapshot_id, blob_sha256)
+);
+
+CREATE INDEX IF NOT EXISTS idx_snapshot_blob_refs_blob
+  ON snapshot_blob_refs (blob_sha256);
+
+INSERT INTO table_versions (table_name) VALUES ('server_snapshots') ON CONFLICT (table_name) DO NOTHING;
+
+DROP TRIGGER IF EXISTS trg_server_snapshots_version ON server_snapshots;
+CREATE TRIGGER trg_server_snapshots_version
+  AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON server_snapshots
+  FOR EACH STATEMENT EXECUTE FUNCTION bump_table_version();
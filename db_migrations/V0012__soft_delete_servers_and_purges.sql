@@ -0,0 +1,38 @@
+ALTER TABLE minecraft_servers ADD COLUMN IF NOT EXISTS deleted_at TIMESTAMP;
+
+DROP INDEX IF EXISTS idx_minecraft_servers_host_port;
+
+CREATE UNIQUE INDEX IF NOT EXISTS idx_minecraft_servers_live_host_port
+  ON minecraft_servers (host, port) WHERE deleted_at IS NULL;
+
+DROP INDEX IF EXISTS idx_minecraft_servers_created_at_id;
+
+CREATE INDEX IF NOT EXISTS idx_minecraft_servers_live_created_at_id
+  ON minecraft_servers (created_at DESC, id DESC) WHERE deleted_at IS NULL;
+
+CREATE TABLE IF NOT EXISTS server_purges (
+  server_id INTEGER PRIMARY KEY,
+  server_name VARCHAR(255),
+  status VARCHAR(20) NOT NULL DEFAULT 'pending',
+  phase VARCHAR(20),
+  files_total BIGINT NOT NULL DEFAULT 0,
+  files_removed BIGINT NOT NULL DEFAULT 0,
+  databases_removed INTEGER NOT NULL DEFAULT 0,
+  snapshots_removed INTEGER NOT NULL DEFAULT 0,
+  chunk_refs_released BIGINT NOT NULL DEFAULT 0,
+  attempts INTEGER NOT NULL DEFAULT 0,
+  last_error TEXT,
+  requested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  started_at TIMESTAMP,
+  finished_at TIMESTAMP,
+  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX IF NOT EXISTS idx_server_purges_pending
+  ON server_purges (requested_at) WHERE status <> 'done';
+
+CREATE INDEX IF NOT EXISTS idx_server_databases_server_id
+  ON server_databases (server_id);
+
+CREATE INDEX IF NOT EXISTS idx_upload_sessions_server_id
+  ON upload_sessions (server_id);
@@ -0,0 +1,43 @@
+CREATE TABLE IF NOT EXISTS server_metrics (
+  server_id INTEGER NOT NULL,
+  sampled_at TIMESTAMP NOT NULL,
+  tps REAL NOT NULL,
+  players INTEGER NOT NULL,
+  heap_used_bytes BIGINT NOT NULL,
+  heap_max_bytes BIGINT,
+  loaded_chunks INTEGER NOT NULL
+) PARTITION BY RANGE (sampled_at);
+
+CREATE TABLE IF NOT EXISTS server_metrics_1m (
+  server_id INTEGER NOT NULL,
+  bucket TIMESTAMP NOT NULL,
+  samples INTEGER NOT NULL,
+  tps_sum DOUBLE PRECISION NOT NULL,
+  tps_min REAL NOT NULL,
+  tps_max REAL NOT NULL,
+  players_sum BIGINT NOT NULL,
+  players_max INTEGER NOT NULL,
+  heap_used_sum NUMERIC(30, 0) NOT NULL,
+  heap_used_max BIGINT NOT NULL,
+  heap_max_bytes BIGINT,
+  chunks_sum BIGINT NOT NULL,
+  chunks_max INTEGER NOT NULL,
+  PRIMARY KEY (server_id, bucket)
+) PARTITION BY RANGE (bucket);
+
+CREATE TABLE IF NOT EXISTS server_metrics_1h (
+  server_id INTEGER NOT NULL,
+  bucket TIMESTAMP NOT NULL,
+  samples INTEGER NOT NULL,
+  tps_sum DOUBLE PRECISION NOT NULL,
+  tps_min REAL NOT NULL,
+  tps_max REAL NOT NULL,
+  players_sum BIGINT NOT NULL,
+  players_max INTEGER NOT NULL,
+  heap_used_sum NUMERIC(30, 0) NOT NULL,
+  heap_used_max BIGINT NOT NULL,
+  heap_max_bytes BIGINT,
+  chunks_sum BIGINT NOT NULL,
+  chunks_max INTEGER NOT NULL,
+  PRIMARY KEY (server_id, bucket)
+);
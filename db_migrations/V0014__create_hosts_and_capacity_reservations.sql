@@ -0,0 +1,23 @@
+CREATE TABLE IF NOT EXISTS hosts (
+  name VARCHAR(255) PRIMARY KEY,
+  memory_mb INTEGER NOT NULL,
+  cpu_millis INTEGER NOT NULL,
+  reserved_memory_mb INTEGER NOT NULL DEFAULT 0,
+  reserved_cpu_millis INTEGER NOT NULL DEFAULT 0,
+  status VARCHAR(20) NOT NULL DEFAULT 'active',
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  CHECK (reserved_memory_mb >= 0 AND reserved_cpu_millis >= 0)
+);
+
+CREATE INDEX IF NOT EXISTS idx_hosts_status ON hosts (status);
+
+INSERT INTO hosts (name, memory_mb, cpu_millis)
+SELECT DISTINCT host, 65536, 16000 FROM port_allocations
+ON CONFLICT (name) DO NOTHING;
+
+INSERT INTO hosts (name, memory_mb, cpu_millis) VALUES ('default', 65536, 16000)
+ON CONFLICT (name) DO NOTHING;
+
+ALTER TABLE minecraft_servers ADD COLUMN IF NOT EXISTS reserved_memory_mb INTEGER;
+ALTER TABLE minecraft_servers ADD COLUMN IF NOT EXISTS reserved_cpu_millis INTEGER;
@@ -0,0 +1,16 @@
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE EXTENSION IF NOT EXISTS btree_gin;
+
+CREATE INDEX IF NOT EXISTS idx_minecraft_servers_name_trgm
+ON minecraft_servers USING GIN (server_name gin_trgm_ops) WHERE deleted_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_minecraft_servers_status_page
+ON minecraft_servers (status, created_at DESC, id DESC) WHERE deleted_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_minecraft_servers_version_page
+ON minecraft_servers (version, created_at DESC, id DESC) WHERE deleted_at IS NULL;
+CREATE INDEX IF NOT EXISTS idx_minecraft_servers_gamemode_page
+ON minecraft_servers (gamemode, created_at DESC, id DESC) WHERE deleted_at IS NULL;
+
+CREATE INDEX IF NOT EXISTS idx_server_files_name_trgm
+ON server_files USING GIN (server_id, file_name gin_trgm_ops);
+CREATE INDEX IF NOT EXISTS idx_server_files_extension
+ON server_files (server_id, (lower(substring(file_name FROM '\.([^.]+)$'))), file_path, file_name, id);
@@ -0,0 +1,31 @@
+CREATE TABLE IF NOT EXISTS provisioning_jobs (
+  id BIGSERIAL PRIMARY KEY,
+  server_id INTEGER NOT NULL,
+  kind VARCHAR(20) NOT NULL,
+  host VARCHAR(255) NOT NULL,
+  status VARCHAR(20) NOT NULL DEFAULT 'queued',
+  step VARCHAR(40),
+  progress INTEGER NOT NULL DEFAULT 0,
+  attempts INTEGER NOT NULL DEFAULT 0,
+  max_attempts INTEGER NOT NULL DEFAULT 5,
+  last_error TEXT,
+  locked_by VARCHAR(255),
+  run_after TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+  heartbeat_at TIMESTAMP,
+  created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  started_at TIMESTAMP,
+  finished_at TIMESTAMP,
+  updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+  CHECK (progress BETWEEN 0 AND 100)
+);
+
+CREATE INDEX IF NOT EXISTS idx_provisioning_jobs_queued
+  ON provisioning_jobs (run_after, id) WHERE status = 'queued';
+
+CREATE INDEX IF NOT EXISTS idx_provisioning_jobs_running
+  ON provisioning_jobs (host, heartbeat_at) WHERE status = 'running';
+
+CREATE INDEX IF NOT EXISTS idx_provisioning_jobs_server
+  ON provisioning_jobs (server_id, id DESC);
+
+ALTER TABLE hosts ADD COLUMN IF NOT EXISTS max_concurrent_jobs INTEGER NOT NULL DEFAULT 2;
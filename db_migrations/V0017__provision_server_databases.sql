@@ -0,0 +1,13 @@
+ALTER TABLE server_databases ADD COLUMN IF NOT EXISTS status VARCHAR(20) NOT NULL DEFAULT 'pending';
+ALTER TABLE server_databases ADD COLUMN IF NOT EXISTS kind VARCHAR(20);
+ALTER TABLE server_databases ADD COLUMN IF NOT EXISTS pg_name VARCHAR(63);
+ALTER TABLE server_databases ADD COLUMN IF NOT EXISTS role_name VARCHAR(63);
+ALTER TABLE server_databases ADD COLUMN IF NOT EXISTS last_error TEXT;
+ALTER TABLE server_databases ADD COLUMN IF NOT EXISTS size_refreshed_at TIMESTAMP;
+ALTER TABLE server_databases ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP;
+
+CREATE INDEX IF NOT EXISTS idx_server_databases_size_refresh
+  ON server_databases (size_refreshed_at NULLS FIRST, id) WHERE status = 'ready';
+
+CREATE INDEX IF NOT EXISTS idx_server_databases_maintenance
+  ON server_databases (status, updated_at) WHERE status IN ('pending', 'creating', 'dropping');
@@ -0,0 +1,21 @@
+CREATE TABLE IF NOT EXISTS table_version_stripes (
+  table_name VARCHAR(100) NOT NULL,
+  stripe SMALLINT NOT NULL,
+  version BIGINT NOT NULL DEFAULT 0,
+  PRIMARY KEY (table_name, stripe)
+);
+
+INSERT INTO table_version_stripes (table_name, stripe, version)
+SELECT table_name, 0, version FROM table_versions
+ON CONFLICT (table_name, stripe) DO NOTHING;
+
+CREATE OR REPLACE FUNCTION bump_table_version() RETURNS trigger AS $$
+BEGIN
+  INSERT INTO table_version_stripes AS s (table_name, stripe, version)
+  VALUES (TG_TABLE_NAME, txid_current() % 64, 1)
+  ON CONFLICT (table_name, stripe) DO UPDATE SET version = s.version + 1;
+  RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TABLE IF EXISTS table_versions;
@@ -0,0 +1,15 @@
+UPDATE hosts h
+SET reserved_memory_mb = GREATEST(h.reserved_memory_mb - r.memory_mb, 0),
+    reserved_cpu_millis = GREATEST(h.reserved_cpu_millis - r.cpu_millis, 0),
+    updated_at = CURRENT_TIMESTAMP
+FROM (
+  SELECT host, SUM(reserved_memory_mb) AS memory_mb, SUM(reserved_cpu_millis) AS cpu_millis
+  FROM minecraft_servers
+  WHERE status IN ('stopped', 'error') AND reserved_memory_mb IS NOT NULL
+  GROUP BY host
+) r
+WHERE h.name = r.host;
+
+UPDATE minecraft_servers
+SET reserved_memory_mb = NULL, reserved_cpu_millis = NULL
+WHERE status IN ('stopped', 'error') AND reserved_memory_mb IS NOT NULL;
@@ -15,6 +15,7 @@ interface MinecraftServer {
   id: number;
   server_name: string;
   version: string;
+  host: string;
   port: number;
   max_players: number;
   gamemode: string;
@@ -23,10 +24,23 @@ interface MinecraftServer {
   created_at: string;
 }
 
+const STATUS_LABELS: Record<string, string> = {
+  running: 'Работает',
+  queued: 'В очереди',
+  starting: 'Запускается',
+  stopping: 'Останавливается',
+  stopped: 'Остановлен',
+  error: 'Ошибка',
+  deleting: 'Удаляется'
+};
+
 const ACCESS_CODE = '5152';
 const API_SERVERS = 'https://functions.poehali.dev/c4277baf-518b-4c84-9db7-2b536a2e0f2c';
 const API_FILES = 'https://functions.poehali.dev/9280977d-537c-4bee-a216-c14b02e7dfc7';
 const API_DATABASES = 'https://functions.poehali.dev/82883163-8e70-4293-bdc4-0c327f88e75d';
+const JOB_POLL_INTERVAL_MS = 1000;
+const JOB_POLL_ATTEMPTS = 60;
+const JOB_FINAL_STATUSES = ['succeeded', 'failed', 'cancelled'];
 
 export default function Index() {
   const [isAuthenticated, setIsAuthenticated] = useState(false);
@@ -35,10 +49,17 @@ export default function Index() {
   const [activeTab, setActiveTab] = useState('dashboard');
   const [isCreateDialogOpen, setIsCreateDialogOpen] = useState(false);
 
-  const [newServer, setNewServer] = useState({
+  const [newServer, setNewServer] = useState<{
+    server_name: string;
+    version: string;
+    port: number | '';
+    max_players: number;
+    gamemode: string;
+    difficulty: string;
+  }>({
     server_name: '',
     version: '1.20.0',
-    port: 19132,
+    port: '',
     max_players: 20,
     gamemode: 'survival',
     difficulty: 'normal'
@@ -54,9 +75,16 @@ export default function Index() {
 
   const loadServers = async () => {
     try {
-      const response = await fetch(API_SERVERS);
-      const data = await response.json();
-      setServers(data.servers || []);
+      const loaded: MinecraftServer[] = [];
+      let cursor: string | null = null;
+      do {
+        const url = cursor ? `${API_SERVERS}?after=${encodeURIComponent(cursor)}` : API_SERVERS;
+        const response = await fetch(url);
+        const data = await response.json();
+        loaded.push(...(data.servers || []));
+        cursor = data.next_cursor || null;
+      } while (cursor);
+      setServers(loaded);
     } catch (error) {
       console.error('Error loading servers:', error);
       toast.error('Ошибка загрузки серверов');
@@ -84,7 +112,7 @@ export default function Index() {
       const response = await fetch(API_SERVERS, {
         method: 'POST',
         headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify(newServer)
+        body: JSON.stringify({ ...newServer, port: newServer.port === '' ? 'auto' : newServer.port })
       });
 
       if (response.ok) {
@@ -96,11 +124,14 @@ export default function Index() {
         setNewServer({
           server_name: '',
           version: '1.20.0',
-          port: 19132,
+          port: '',
           max_players: 20,
           gamemode: 'survival',
           difficulty: 'normal'
         });
+      } else if (response.status === 409) {
+        const { error } = await response.json();
+        toast.error(`Порт занят: ${error}`);
       } else {
         toast.error('Ошибка создания сервера');
       }
@@ -110,26 +141,59 @@ export default function Index() {
     }
   };
 
+  const waitForJob = async (jobId: number, onProgress: (job: { status: string }) => void) => {
+    let job: { status: string; last_error?: string } | null = null;
+    for (let attempt = 0; attempt < JOB_POLL_ATTEMPTS; attempt++) {
+      await new Promise(resolve => setTimeout(resolve, JOB_POLL_INTERVAL_MS));
+      const response = await fetch(`${API_SERVERS}?action=jobs&job_id=${jobId}`);
+      if (!response.ok) return null;
+      job = await response.json();
+      if (JOB_FINAL_STATUSES.includes(job.status)) return job;
+      onProgress(job);
+    }
+    return job;
+  };
+
   const toggleServerStatus = async (id: number) => {
     const server = servers.find(s => s.id === id);
     if (!server) return;
 
     const newStatus = server.status === 'running' ? 'stopped' : 'running';
+    const step = newStatus === 'running' ? 'starting' : 'stopping';
+    const setStatus = (status: string) =>
+      setServers(current => current.map(s => (s.id === id ? { ...s, status } : s)));
 
     try {
       const response = await fetch(API_SERVERS, {
         method: 'PUT',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify({ id, status: newStatus })
+        headers: {
+          'Content-Type': 'application/json',
+          'Idempotency-Key': `${id}-${step}-${crypto.randomUUID()}`
+        },
+        body: JSON.stringify({ id, status: step })
       });
+      if (!response.ok) {
+        toast.error('Ошибка изменения статуса');
+        return;
+      }
 
-      if (response.ok) {
-        setServers(servers.map(s => 
-          s.id === id ? { ...s, status: newStatus } : s
-        ));
+      const { job } = await response.json();
+      setStatus(step);
+      const finished = job
+        ? await waitForJob(job.id, current => setStatus(current.status === 'queued' ? 'queued' : step))
+        : null;
+      if (finished?.status === 'succeeded') {
+        setStatus(newStatus);
         toast.success(`Сервер ${newStatus === 'running' ? 'запущен' : 'остановлен'}`);
+      } else if (finished && !JOB_FINAL_STATUSES.includes(finished.status)) {
+        toast.info(
+          finished.status === 'queued'
+            ? 'Задание ещё в очереди: статус обновится, когда его возьмёт воркер'
+            : 'Задание ещё выполняется: обновите страницу позже'
+        );
       } else {
-        toast.error('Ошибка изменения статуса');
+        if (finished?.status === 'failed') setStatus('error');
+        toast.error(finished?.last_error ? `Ошибка изменения статуса: ${finished.last_error}` : 'Ошибка изменения статуса');
       }
     } catch (error) {
       console.error('Error toggling server:', error);
@@ -137,6 +201,32 @@ export default function Index() {
     }
   };
 
+  const cloneServer = async (id: number) => {
+    const serverName = servers.find(s => s.id === id)?.server_name;
+
+    try {
+      const response = await fetch(`${API_SERVERS}?action=clone`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify({ source_id: id })
+      });
+
+      if (response.ok) {
+        const clonedServer = await response.json();
+        setServers([...servers, clonedServer]);
+        toast.success(`Сервер "${serverName}" скопирован: ${clonedServer.file_count} файлов, ${clonedServer.database_count} БД`);
+      } else if (response.status === 409) {
+        const { error } = await response.json();
+        toast.error(`Порт занят: ${error}`);
+      } else {
+        toast.error('Ошибка копирования сервера');
+      }
+    } catch (error) {
+      console.error('Error cloning server:', error);
+      toast.error('Ошибка копирования сервера');
+    }
+  };
+
   const deleteServer = async (id: number) => {
     const serverName = servers.find(s => s.id === id)?.server_name;
 
@@ -147,7 +237,7 @@ export default function Index() {
 
       if (response.ok) {
         setServers(servers.filter(server => server.id !== id));
-        toast.success(`Сервер "${serverName}" удалён`);
+        toast.success(`Сервер "${serverName}" удаляется`);
       } else {
         toast.error('Ошибка удаления сервера');
       }
@@ -366,8 +456,9 @@ export default function Index() {
                     <Input
                       id="port"
                       type="number"
+                      placeholder="Авто"
                       value={newServer.port}
-                      onChange={(e) => setNewServer({ ...newServer, port: parseInt(e.target.value) })}
+                      onChange={(e) => setNewServer({ ...newServer, port: e.target.value === '' ? '' : parseInt(e.target.value) })}
                     />
                   </div>
 
@@ -453,7 +544,7 @@ export default function Index() {
                           <TableCell>0/{server.max_players}</TableCell>
                           <TableCell>
                             <Badge variant={server.status === 'running' ? 'default' : 'secondary'}>
-                              {server.status === 'running' ? 'Работает' : 'Остановлен'}
+                              {STATUS_LABELS[server.status] ?? server.status}
                             </Badge>
                           </TableCell>
                           <TableCell>
@@ -465,6 +556,13 @@ export default function Index() {
                               >
                                 <Icon name={server.status === 'running' ? 'Square' : 'Play'} size={14} />
                               </Button>
+                              <Button
+                                size="sm"
+                                variant="outline"
+                                onClick={() => cloneServer(server.id)}
+                              >
+                                <Icon name="Copy" size={14} />
+                              </Button>
                               <Dialog>
                                 <DialogTrigger asChild>
                                   <Button size="sm" variant="outline">